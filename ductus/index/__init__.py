@@ -14,12 +14,17 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+
 from django.conf import settings
 from django.utils.importlib import import_module
+from ductus.index.fulltext import read_terms, search_text
 from ductus.resource import get_resource_database, hash_name, UnexpectedHeader
 from ductus.wiki.namespaces import registered_namespaces, split_pagename
 from lxml import etree
 
+logger = logging.getLogger(__name__)
+
 _indexing_mongo_database = False  # False means uninitialized; None means
                                   # indexing is not in use
 
@@ -35,6 +40,25 @@ def get_indexing_mongo_database():
             _indexing_mongo_database = getattr(import_module(mod_name), var_name)
     return _indexing_mongo_database
 
+_index_backend = False  # False means uninitialized; None means indexing is
+                        # not in use
+
+def get_index_backend():
+    """Returns the index backend (see ductus.index.backends) given by
+    DUCTUS_INDEX_BACKEND, or else a MongoIndexBackend if
+    DUCTUS_INDEXING_MONGO_DATABASE is set"""
+    global _index_backend
+    if _index_backend is False:
+        index_backend_obj = getattr(settings, "DUCTUS_INDEX_BACKEND", None)
+        if index_backend_obj is not None:
+            mod_name, junk, var_name = index_backend_obj.rpartition('.')
+            _index_backend = getattr(import_module(mod_name), var_name)
+        else:
+            from ductus.index.backends import MongoIndexBackend
+            indexing_db = get_indexing_mongo_database()
+            _index_backend = MongoIndexBackend(indexing_db) if indexing_db is not None else None
+    return _index_backend
+
 class IndexingError(Exception):
     """a basic Exception for index related errors"""
     def __init__(self, value):
@@ -45,47 +69,47 @@ class IndexingError(Exception):
 def search_pages(**kwargs):
     """
     return a list of pages tagged with all `tags` (boolean AND)
-    like [{"absolute_pagename": name, "path": path}]
+    like [{"absolute_pagename": name, "path": path}], sorted by page name
 
     :param **kwargs: the search parameters (which are $and'ed together, so a page must match all criteria to be returned). Format:
         {
         tags: a list of tag values like: ['tag1', 'target-language:en']. This is assumed to be valid tags, no checking is performed in this function!
-        pagename: a string to (partially) match in the page urls/names
+        pagename: a string to match (ignoring case) in the page names.  Strings shorter than three characters only match the start of a word (see ductus.index.pagenames).
+        pagename_prefix: a string the page names must start with, ignoring case
         notags: a special argument that searches for pages with no tags.
+        text: words that must all occur in the text of the pages or of anything they contain.  The pages are then sorted by how well they match (see ductus.index.fulltext).
+        language: the language of `text`, if known
+        after: only return pages whose absolute pagename sorts after this one.  Pass the last page of one search to get the next ones.  Not allowed with `text`.
+        limit: the most pages to return
         }
     """
 
-    if not len(kwargs):
+    if not any(key in kwargs for key in ('tags', 'pagename', 'pagename_prefix', 'notags', 'text')):
         # fixme: we should prompt the user for what they want to search
         raise IndexingError('your search query cannot be empty')
 
-    indexing_db = get_indexing_mongo_database()
-    if indexing_db is None:
+    index = get_index_backend()
+    if index is None:
         raise IndexingError("indexing database is not available")
-    collection = indexing_db.urn_index
-
-    # construct the mongodb query
-    query = {}
-    query["current_wikipages"] = {"$not": {"$size": 0}}
-    for key in kwargs:
-        if key == 'tags' and kwargs[key]:
-            query["tags"] = {"$all": kwargs[key]}
-        if key == 'pagename':
-            query['current_wikipages']['$regex'] = kwargs[key]
-            query['current_wikipages']['$options'] = 'i'
-        if key == 'notags':
-            # special search feature to report all pages without tags
-            query["tags"] = {"$size": 0}
-            break
-
-    if len(query) > 1:
-        query = {'$and': [query]}
 
     # perform the search
-    pages = collection.find(query, {"current_wikipages": 1, "tags": 1}).sort("current_wikipages")
+    if 'text' in kwargs:
+        if 'after' in kwargs:
+            raise IndexingError("a text search cannot be continued after a page name")
+        pages = search_text(index, kwargs['text'], language=kwargs.get('language'),
+                            tags=kwargs.get('tags'), notags=('notags' in kwargs),
+                            pagename=kwargs.get('pagename'),
+                            pagename_prefix=kwargs.get('pagename_prefix'),
+                            limit=kwargs.get('limit'))
+    else:
+        pages = index.search(tags=kwargs.get('tags'),
+                             pagename=kwargs.get('pagename'),
+                             notags=('notags' in kwargs),
+                             pagename_prefix=kwargs.get('pagename_prefix'),
+                             after=kwargs.get('after'),
+                             limit=kwargs.get('limit'))
     results = []
-    for page in pages:
-        absolute_pagename = page["current_wikipages"][0]
+    for absolute_pagename, tags in pages:
         prefix, pagename = split_pagename(absolute_pagename)
         try:
             wns = registered_namespaces[prefix]
@@ -98,64 +122,127 @@ def search_pages(**kwargs):
             results.append({
                 "absolute_pagename": absolute_pagename,
                 "path": path,
-                "tags": page["tags"],
+                "tags": tags,
             })
 
     return results
 
 def get_list_of_target_lang_codes():
-    """return the list of all language codes used as target-language tags in lessons"""
-    indexing_db = get_indexing_mongo_database()
-    if indexing_db is None:
+    """return the list of all language codes used as target-language tags in current lessons"""
+    index = get_index_backend()
+    if index is None:
         raise IndexingError("indexing database is not available")
-    collection = indexing_db.urn_index
 
-    tags = filter(lambda tag: tag is not None and tag.startswith('target-language:'), collection.distinct('tags'))
+    tags = index.count_current_tags('target-language:')
     return [tag.split(':')[1] for tag in tags]
 
-def perform_upsert(collection, urn, obj, ignore=None):
-    """Update/insert the index document for a `urn` in mongo.
+# a resource never changes, so neither do its links
+_forward_link_cache_timeout = 60 * 60 * 24
 
-    `collection` is the collection for the index.
-    `urn`: the urn for which to store the object.
-    `obj`: a dict object representing the data to store.
-    """
-    # REMEMBER that dictionary order matters in mongodb; we just ignore
-    # it
+def _get_link_cache_timeout():
+    """Returns how long to cache what links to a resource, and the pages
+    that include it, in seconds.  update_index() clears what it changes, but
+    index_maintenance does not."""
+    return getattr(settings, "DUCTUS_INDEX_LINK_CACHE_TIMEOUT", 300)
+
+def _cached_many(prefix, urns, compute, timeout):
+    """Returns a dict giving the value for each of `urns` from the cache,
+    calling `compute` with the rest and caching what it returns"""
+    from django.core.cache import cache
+    urns = set(urns)
+    rv = dict((key[len(prefix):], value) for key, value in
+              cache.get_many([prefix + urn for urn in urns]).items())
+    missing = urns.difference(rv)
+    if missing:
+        computed = compute(missing)
+        cache.set_many(dict((prefix + urn, value) for urn, value in computed.items()), timeout)
+        rv.update(computed)
+    return rv
 
-    # fixme: first inspect element to see if things might already be
-    # right.  also check to make sure there aren't any unexpected
-    # attributes on the toplevel element.  and do the same thing for
-    # blobs too.
+def _get_index_or_raise():
+    index = get_index_backend()
+    if index is None:
+        raise IndexingError("indexing database is not available")
+    return index
 
-    obj = dict(obj)
-    obj["urn"] = urn
-    collection.update({"urn": urn}, obj, upsert=True, safe=True)
+def get_links_many(urns):
+    """Returns a dict giving the set of urns that each of `urns` links to.
+    Urns that are not indexed are left out."""
+    index = _get_index_or_raise()
+    return _cached_many('index_links:', urns, index.get_links,
+                        _forward_link_cache_timeout)
 
-def verify(collection, urn, current_wikipages_list, force_update=False):
-    """Updates a urn's indexing info and returns the set of its recursive links.
+def get_links(urn):
+    return get_links_many([urn]).get(urn)
 
-    `collection`: the mongo collection to use as returned by ``get_indexing_mongo_database()``.
-    `urn`: the urn to update the index for, starting with "urn:".
-    `wikipages_url_list` is the sorted list of urls pointing to `urn`.
-    `force_update`: set to True to update the index even if `urn` is already in the index (defaults to ``False``).
-    """
-    if not force_update:
-        q = collection.find_one({"urn": urn}, {"recursive_links": 1})
-        if q:
-            try:
-                return set(q["recursive_links"])
-            except KeyError:
-                return set()
+def get_recursive_links_many(urns):
+    """Returns a dict giving the set of urns that each of `urns` links to,
+    directly or through other resources (i.e. everything needed to show
+    it).  Urns that are not indexed are left out."""
+    index = _get_index_or_raise()
+    return _cached_many('index_recursive_links:', urns, index.get_recursive_links,
+                        _forward_link_cache_timeout)
+
+def get_recursive_links(urn):
+    return get_recursive_links_many([urn]).get(urn)
 
+def get_links_to_many(urns, recursive=False):
+    """Returns a dict giving, for each of `urns`, the set of urns that link to
+    it ("what links here"), directly or, if `recursive`, through other
+    resources"""
+    index = _get_index_or_raise()
+    prefix = 'index_recursive_links_to:' if recursive else 'index_links_to:'
+    return _cached_many(prefix, urns,
+                        lambda urns: index.get_linking_urns(urns, recursive=recursive),
+                        _get_link_cache_timeout())
+
+def get_links_to(urn, recursive=False):
+    return get_links_to_many([urn], recursive)[urn]
+
+def get_pages_including_many(urns):
+    """Returns a dict giving, for each of `urns`, the set of absolute names
+    of the current wiki pages that are it or link to it, directly or
+    through other resources"""
+    index = _get_index_or_raise()
+
+    def compute(urns):
+        rv = dict((urn, set()) for urn in urns)
+        for contained, pagenames, tags in index.find_current_containers(urns).values():
+            for urn in contained:
+                rv[urn].update(pagenames)
+        return rv
+
+    return _cached_many('index_pages_including:', urns, compute, _get_link_cache_timeout())
+
+def get_pages_including(urn):
+    return get_pages_including_many([urn])[urn]
+
+def _clear_link_cache(urns):
+    "Forgets what is cached about the links to each of `urns`"
+    from django.core.cache import cache
+    cache.delete_many([prefix + urn for urn in urns for prefix in
+                       ('index_links_to:', 'index_recursive_links_to:', 'index_pages_including:')])
+
+_index_fields = ('common.parents.href', 'tags.value')
+
+def read_index_info(urn):
+    """Returns (obj, links) for a urn: the index document of the resource
+    (without its "recursive_links" and "current_wikipages"), and the set of
+    urns it links to.  The resource is parsed only once.
+
+    If the resource has text (see ductus.index.fulltext), the document has
+    "terms", a dict giving how many times each term occurs in it.
+    """
+    from ductus.resource import _registered_ductmodels
+    from ductus.resource.ductmodels import FieldPath
     resource_database = get_resource_database()
 
     try:
         tree = resource_database.get_xml_tree(urn)
     except UnexpectedHeader:
         # it must be a blob
-        perform_upsert(collection, urn, {"fqn": None})
-        return set()
+        return {"fqn": None}, set()
+    root = tree.getroot()
 
     links = set()
     for event, element in etree.iterwalk(tree):
@@ -164,44 +251,166 @@ def verify(collection, urn, current_wikipages_list, force_update=False):
             if link.startswith('urn:%s:' % hash_name):
                 links.add(link)
 
-    recursive_links = set(links)
-    for link in links:
-        additional_links = verify(collection, link, [])
-        recursive_links.update(additional_links)
-
-    resource = resource_database.get_resource_object(urn)
-
-    assert resource.fqn is not None
-    obj = {
-        "fqn": resource.fqn,
-        "links": list(links),
-        "recursive_links": sorted(recursive_links),
-        "current_wikipages": sorted(current_wikipages_list),
-    }
+    obj = {"links": list(links)}
+    model_class = _registered_ductmodels[root.tag] # fixme: may raise KeyError
     try:
-        obj["parents"] = sorted([parent.href for parent in resource.common.parents])
-        obj["tags"] = sorted([tag.value for tag in resource.tags])
+        if hasattr(model_class, "legacy_ductmodel_conversion"):
+            # only the converted resource can tell us these
+            obj["fqn"] = resource_database.get_resource_metadata(urn)['fqn']
+            fields = resource_database.get_resource_fields(urn, _index_fields)
+        else:
+            obj["fqn"] = root.tag
+            fields = dict((path, FieldPath.get(model_class, path).read(root))
+                          for path in _index_fields)
     except AttributeError:
         pass
-    perform_upsert(collection, urn, obj)
+    else:
+        obj["parents"] = sorted(fields['common.parents.href'])
+        obj["tags"] = sorted(fields['tags.value'])
+    assert obj["fqn"] is not None
+    # (legacy resources are indexed without their text)
+    terms = read_terms(root)
+    if terms is not None:
+        obj["terms"] = terms
+    return obj, links
+
+def verify(index, urn, current_wikipages_list, force_update=False, memo=None):
+    """Updates a urn's indexing info and returns the set of its recursive links.
+
+    `index`: the index backend to use as returned by ``get_index_backend()``.
+    `urn`: the urn to update the index for, starting with "urn:".
+    `wikipages_url_list` is the sorted list of urls pointing to `urn`.
+    `force_update`: set to True to update the index even if `urn` is already in the index (defaults to ``False``).
+    `memo`: a dict mapping each urn already verified to its recursive links,
+    which is shared between calls to avoid verifying a urn twice.
+
+    Any resource linked from `urn` that is not yet indexed is indexed too.
+    The links are followed one level at a time, asking the index about all
+    the urns of a level at once, and all the new index documents are
+    written at the end with a single bulk write.
+    """
+    if memo is None:
+        memo = {}
+    if force_update:
+        memo.pop(urn, None)
+    else:
+        if urn not in memo:
+            memo.update(index.get_recursive_links([urn]))
+        if urn in memo:
+            return memo[urn]
+
+    # find everything that needs to be indexed
+    objs = {}
+    links_by_urn = {}
+    level = [urn]
+    while level:
+        next_level = set()
+        for u in level:
+            obj, links = read_index_info(u)
+            objs[u] = obj
+            links_by_urn[u] = links
+            next_level.update(links)
+        next_level.difference_update(memo, links_by_urn)
+        memo.update(index.get_recursive_links(next_level))
+        level = next_level.difference(memo)
+
+    # work out the recursive links, children first.  (a resource cannot link
+    # to itself, even indirectly, so there are no cycles.)
+    stack = [urn]
+    while stack:
+        u = stack[-1]
+        if u in memo:
+            stack.pop()
+            continue
+        pending = [link for link in links_by_urn[u] if link not in memo]
+        if pending:
+            stack.extend(pending)
+            continue
+        stack.pop()
+        recursive_links = set(links_by_urn[u])
+        for link in links_by_urn[u]:
+            recursive_links.update(memo[link])
+        memo[u] = recursive_links
+        if objs[u]["fqn"] is not None:
+            objs[u]["recursive_links"] = sorted(recursive_links)
+            objs[u]["current_wikipages"] = []
+
+    if objs[urn]["fqn"] is not None:
+        objs[urn]["current_wikipages"] = sorted(current_wikipages_list)
+    index.update(objs)
+
+    return memo[urn]
 
-    return recursive_links
+def update_index(pagename, urn, urns=()):
+    """
+    Brings the index up to date after a change to a wiki page.
 
+    `pagename` is the absolute name of the page, which is now current at
+    `urn` (starting with 'urn:'), or at nothing if `urn` is None (i.e. it
+    has been unlinked).  The index documents of `urn` and of each of `urns`
+    (such as the page's previous revision) are refreshed.
 
-def update_index_on_save(urn, url, parent_urn=None):
+    Whatever the database says, `pagename` is taken to be current at `urn`,
+    so the update can be done before the revision is saved, or after later
+    revisions are (and then done again for those).
     """
-    Update the index for the specified urn (to be used when saving a blueprint), and for its parents (if any, i.e: if modifying an existing wikipage).
-    Note that this function assumes a single url is linked to the urn, which is true only for wiki edits. Do not call this function for maintenance purposes.
+    from ductus.wiki.models import get_current_wikipages_map
+    index = get_index_backend()
+    if index is None:
+        raise IndexingError("indexing database is not available")
+
+    urns = set(urns)
+    if urn is not None:
+        urns.add(urn)
+    current_wikipages_map = get_current_wikipages_map(urns)
+    memo = {}
+    # the current urn first, so the others can use what it has indexed
+    for u in sorted(urns, key=lambda u: u != urn):
+        current_wikipages = current_wikipages_map.get(u, set())
+        current_wikipages.discard(pagename)
+        if u == urn:
+            current_wikipages.add(pagename)
+        verify(index, u, current_wikipages, force_update=True, memo=memo)
+
+    # everything newly linked to, or whose pages may have changed, is among
+    # these urns and their recursive links
+    changed = set(urns)
+    for u in urns:
+        changed.update(memo[u])
+    _clear_link_cache(changed)
 
-    `urn` is the urn of the newly saved blueprint (ie: the latest revision). Must start with 'urn:'.
-    `url` is an array of urls under which the urn is saved. Empty array means delete the page ("unlink" it, the urn remains in the index).
-    `parent_urn` is the urn to the parent of `urn` (optional).
+    # and the search results that may have changed.  (the other urns are
+    # the page's earlier revisions.)
+    from ductus.index.search_cache import pages_changed
+    tags_before = None
+    for u in urns.difference([urn]):
+        tags_before = (tags_before or set()).union(_get_tags(u))
+    pages_changed(tags_before, _get_tags(urn) if urn is not None else None)
+
+def _get_tags(urn):
+    try:
+        return set(get_resource_database().get_resource_fields(urn, ('tags.value',))['tags.value'])
+    except AttributeError:
+        # resources of this kind have no tags
+        return set()
+
+def queue_index_update(pagename, urn, urns=()):
+    """
+    Arranges for update_index() to be called with the given arguments: soon,
+    if DUCTUS_INDEX_QUEUE is set (see ductus.index.queue), or else right
+    away.  Either way, a failure to update the index does not stop a wiki
+    edit; index_maintenance puts the index right later.
     """
-    indexing_db = get_indexing_mongo_database()
-    if indexing_db is None:
-        raise Exception
-    collection = indexing_db.urn_index
-
-    verify(collection, urn, url, force_update=(url==[]))
-    if parent_urn:
-        verify(collection, parent_urn, [], force_update=True)
+    from ductus.index.queue import get_index_queue, queue_job
+    if get_index_backend() is None:
+        # indexing is not in use
+        return
+
+    if get_index_queue() is not None:
+        queue_job(pagename, urn, urns)
+        return
+
+    try:
+        update_index(pagename, urn, urns)
+    except Exception:
+        logger.exception("Could not update the index for %s", pagename)
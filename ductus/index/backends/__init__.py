@@ -0,0 +1,72 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Index backends
+
+An index backend keeps one document per urn (see ductus.index.verify), with
+the keys "fqn", "links", "recursive_links", "current_wikipages", "parents"
+and "tags" (a blob only has "fqn", which is None), and "terms" for a
+resource with text (see ductus.index.fulltext).  Each backend provides:
+
+* prepare(): creates whatever indexes the backend needs
+
+* update(objs): stores the documents in `objs`, a dict keyed by urn,
+  replacing any that are already there.  A page given in
+  "current_wikipages" is taken away from any other document that has it.
+  The tag counts are adjusted to match, correctly even when several
+  processes update the index at once.
+
+* get_recursive_links(urns): returns a dict giving the recursive links of
+  each of `urns` that is in the index
+
+* set_current_wikipages(current_wikipages_map): makes "current_wikipages"
+  of every document agree with the given map of urn to page names, and
+  counts the tags again from scratch
+
+* search(tags=None, pagename=None, notags=False, pagename_prefix=None,
+  after=None, limit=None): returns a list of (absolute pagename, tags) for
+  the current wiki pages matching all the criteria (see
+  ductus.index.search_pages), sorted by page name.  Only pages sorting
+  after `after` are returned, and at most `limit` of them.
+
+* get_links(urns): returns a dict giving the links of each of `urns` that
+  is in the index
+
+* get_linking_urns(urns, recursive=False): returns a dict giving, for each
+  of `urns`, the set of resources that link to it (directly, or also
+  through other resources if `recursive`).  This is looked up by link, so
+  it takes time in proportion to the size of the result.
+
+* get_postings(terms): returns a dict giving, for each of `terms`, a dict
+  of the number of times it occurs in each resource that has it
+
+* find_current_containers(urns): returns a dict giving, for each current
+  resource that is or recursively links to any of `urns`, a tuple of the
+  set of those urns, its sorted page names and its tags
+
+* get_tags(prefix): returns the set of all tags starting with `prefix`
+
+* count_current_tags(prefix): returns a dict giving, for each tag starting
+  with `prefix`, the number of current resources that have it.  These
+  counts are kept up to date as documents are updated, so this does not
+  look at the documents themselves.
+
+* get_state(name) and set_state(name, value): keep a small dict of
+  json-compatible values, such as index_maintenance's progress
+"""
+
+from ductus.index.backends.mongodb import MongoIndexBackend
+from ductus.index.backends.sqlite import SqliteIndexBackend
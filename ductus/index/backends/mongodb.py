@@ -0,0 +1,295 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+
+from ductus.index.pagenames import pagename_key, pagename_tokens, pagename_trigrams, pagename_matches
+
+def _pagename_fields(current_wikipages):
+    """Returns the fields that let the current page names of a document be
+    searched (see ductus.index.pagenames)"""
+    keys = set(pagename_key(pagename) for pagename in current_wikipages)
+    tokens = set()
+    trigrams = set()
+    for key in keys:
+        tokens.update(pagename_tokens(key))
+        trigrams.update(pagename_trigrams(key))
+    return {
+        "pagename_keys": sorted(keys),
+        "pagename_tokens": sorted(tokens),
+        "pagename_trigrams": sorted(trigrams),
+    }
+
+def _pagename_regex(key):
+    """Returns a regular expression for the page names whose key contains
+    `key`, when matched ignoring case.  It may match a few more, since the
+    database's idea of case is not quite Python's."""
+    return u''.join(u'[ _]' if c == u'_' else re.escape(c) for c in key)
+
+class MongoIndexBackend(object):
+    """Keeps the index in the urn_index collection of a pymongo database
+
+    Each document with current wiki pages also gets the normalized keys,
+    tokens and trigrams of their names, which are indexed so page names
+    can be searched without scanning the collection.  The number of current
+    documents having each tag is kept in the tag_counts collection.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.collection = database.urn_index
+
+    def prepare(self):
+        collection = self.collection
+        collection.ensure_index("urn", unique=True, drop_dups=True)
+        collection.ensure_index("parents", sparse=True)
+        collection.ensure_index("tags", sparse=True)
+        collection.ensure_index("links")
+        collection.ensure_index("recursive_links")
+        collection.ensure_index("pagename_keys", sparse=True)
+        collection.ensure_index("pagename_tokens", sparse=True)
+        collection.ensure_index("pagename_trigrams", sparse=True)
+        collection.ensure_index("terms.term", sparse=True)
+
+    def update(self, objs):
+        from pymongo import ReturnDocument, UpdateOne
+        # the tags of documents that become current are counted, and those
+        # of documents that stop being current are uncounted.  each document
+        # is changed atomically, and what it was before is taken from the
+        # change itself, so updates made at the same time (e.g. by several
+        # queue workers) each count only what they changed
+        collection = self.collection
+        counts = {}
+        def add_counts(q, n):
+            for tag in q.get("tags", ()):
+                counts[tag] = counts.get(tag, 0) + n
+
+        # a page has only one current urn, so any other document that has one
+        # of these pages loses it (and may stop being current)
+        pagenames = sorted(set(pagename for obj in objs.values()
+                               for pagename in obj.get("current_wikipages", ())))
+        if pagenames:
+            for q in collection.find({"current_wikipages": {"$in": pagenames},
+                                      "urn": {"$nin": list(objs)}}, {"urn": 1}):
+                q = collection.find_one_and_update(
+                    {"urn": q["urn"], "current_wikipages": {"$in": pagenames}},
+                    {"$pullAll": {"current_wikipages": pagenames}},
+                    projection={"tags": 1, "current_wikipages": 1},
+                    return_document=ReturnDocument.AFTER)
+                if q is None:
+                    # somebody else got there first
+                    continue
+                current_wikipages = q["current_wikipages"]
+                if current_wikipages:
+                    update = {"$set": _pagename_fields(current_wikipages)}
+                else:
+                    update = {"$unset": {"pagename_keys": "", "pagename_tokens": "", "pagename_trigrams": ""}}
+                    add_counts(q, -1)
+                # unless the pages have changed again since, in which case
+                # whoever changed them sets these fields
+                collection.update_one({"_id": q["_id"], "current_wikipages": current_wikipages}, update)
+
+        # REMEMBER that dictionary order matters in mongodb; we just ignore
+        # it
+        for urn, obj in objs.items():
+            obj = dict(obj)
+            obj["urn"] = urn
+            if obj.get("current_wikipages"):
+                obj.update(_pagename_fields(obj["current_wikipages"]))
+                add_counts(obj, 1)
+            if "terms" in obj:
+                # a list, so the terms can be indexed
+                obj["terms"] = [{"term": term, "count": count}
+                                for term, count in sorted(obj["terms"].items())]
+            q = collection.find_one_and_replace(
+                {"urn": urn}, obj, projection={"tags": 1, "current_wikipages": 1},
+                upsert=True, return_document=ReturnDocument.BEFORE)
+            if q is not None and q.get("current_wikipages"):
+                add_counts(q, -1)
+
+        requests = [UpdateOne({"_id": tag}, {"$inc": {"count": n}}, upsert=True)
+                    for tag, n in counts.items() if n]
+        if requests:
+            self.database.tag_counts.bulk_write(requests, ordered=False)
+
+    def get_recursive_links(self, urns):
+        urns = list(urns)
+        rv = {}
+        # keep each query a reasonable size
+        for i in range(0, len(urns), 1000):
+            for q in self.collection.find({"urn": {"$in": urns[i:i + 1000]}},
+                                          {"urn": 1, "recursive_links": 1}):
+                rv[q["urn"]] = set(q.get("recursive_links", ()))
+        return rv
+
+    def get_links(self, urns):
+        urns = list(urns)
+        rv = {}
+        for i in range(0, len(urns), 1000):
+            for q in self.collection.find({"urn": {"$in": urns[i:i + 1000]}},
+                                          {"urn": 1, "links": 1}):
+                rv[q["urn"]] = set(q.get("links", ()))
+        return rv
+
+    def get_linking_urns(self, urns, recursive=False):
+        field = "recursive_links" if recursive else "links"
+        rv = dict((urn, set()) for urn in urns)
+        urns = list(rv)
+        for i in range(0, len(urns), 1000):
+            batch = urns[i:i + 1000]
+            # both fields are indexed
+            for q in self.collection.find({field: {"$in": batch}}, {"urn": 1, field: 1}):
+                for link in set(q[field]).intersection(batch):
+                    rv[link].add(q["urn"])
+        return rv
+
+    def get_postings(self, terms):
+        rv = dict((term, {}) for term in terms)
+        for q in self.collection.find({"terms.term": {"$in": list(rv)}}, {"urn": 1, "terms": 1}):
+            for posting in q["terms"]:
+                if posting["term"] in rv:
+                    rv[posting["term"]][q["urn"]] = posting["count"]
+        return rv
+
+    def find_current_containers(self, urns):
+        urns = list(urns)
+        rv = {}
+        for i in range(0, len(urns), 1000):
+            batch = urns[i:i + 1000]
+            for q in self.collection.find({
+                "$or": [{"urn": {"$in": batch}}, {"recursive_links": {"$in": batch}}],
+                "current_wikipages.0": {"$exists": True},
+            }, {"urn": 1, "recursive_links": 1, "current_wikipages": 1, "tags": 1}):
+                contained = set(q.get("recursive_links", ()))
+                contained.add(q["urn"])
+                contained.intersection_update(batch)
+                if q["urn"] in rv:
+                    rv[q["urn"]][0].update(contained)
+                else:
+                    rv[q["urn"]] = (contained, sorted(q["current_wikipages"]), q.get("tags", []))
+        return rv
+
+    def set_current_wikipages(self, current_wikipages_map):
+        from pymongo import UpdateOne
+        collection = self.collection
+        indexed = dict((q["urn"], q) for q in
+                       collection.find({"current_wikipages.0": {"$exists": True}},
+                                       {"urn": 1, "current_wikipages": 1, "pagename_keys": 1}))
+        requests = []
+        for urn in set(indexed).union(current_wikipages_map):
+            current_wikipages = sorted(current_wikipages_map.get(urn, ()))
+            q = indexed.get(urn, {})
+            # documents indexed before page names were searchable get their
+            # pagename fields here too
+            if q.get("current_wikipages", []) != current_wikipages or (current_wikipages and "pagename_keys" not in q):
+                update = {"$set": {"current_wikipages": current_wikipages}}
+                if current_wikipages:
+                    update["$set"].update(_pagename_fields(current_wikipages))
+                else:
+                    update["$unset"] = {"pagename_keys": "", "pagename_tokens": "", "pagename_trigrams": ""}
+                requests.append(UpdateOne({"urn": urn}, update))
+        for i in range(0, len(requests), 1000):
+            collection.bulk_write(requests[i:i + 1000], ordered=False)
+
+        self.__count_tags()
+
+    def __count_tags(self):
+        from pymongo import ReplaceOne
+        counts = list(self.collection.aggregate([
+            {"$match": {"current_wikipages.0": {"$exists": True}}},
+            {"$unwind": "$tags"},
+            {"$group": {"_id": "$tags", "count": {"$sum": 1}}},
+        ]))
+        # replace the counts one at a time, so they can be read meanwhile
+        requests = [ReplaceOne({"_id": q["_id"]}, q, upsert=True) for q in counts]
+        for i in range(0, len(requests), 1000):
+            self.database.tag_counts.bulk_write(requests[i:i + 1000], ordered=False)
+        self.database.tag_counts.delete_many({"_id": {"$nin": [q["_id"] for q in counts]}})
+
+    def search(self, tags=None, pagename=None, notags=False, pagename_prefix=None,
+               after=None, limit=None):
+        clauses = [{"current_wikipages": {"$not": {"$size": 0}}}]
+        if notags:
+            # special search feature to report all pages without tags
+            clauses.append({"tags": {"$size": 0}})
+            pagename = pagename_prefix = None
+        else:
+            if tags:
+                clauses.append({"tags": {"$all": tags}})
+            # each of these can use an index
+            if pagename:
+                key = pagename_key(pagename)
+                if len(key) >= 3:
+                    clauses.append({"pagename_trigrams": {"$all": sorted(pagename_trigrams(key))}})
+                    clauses.append({"pagename_keys": {"$regex": re.escape(key)}})
+                else:
+                    clauses.append({"pagename_tokens": {"$regex": "^" + re.escape(key)}})
+            if pagename_prefix:
+                clauses.append({"pagename_keys": {"$regex": "^" + re.escape(pagename_key(pagename_prefix))}})
+        if after is not None:
+            clauses.append({"current_wikipages": {"$gt": after}})
+
+        # the documents are split into one result per current page name.  the
+        # names are roughly filtered by the database, so the limit can be
+        # applied there, and exactly by pagename_matches(); if that leaves
+        # too few, we ask for the names after the last one seen
+        name_clauses = []
+        if pagename:
+            name_clauses.append({"current_wikipages": {"$regex": _pagename_regex(pagename_key(pagename)), "$options": "i"}})
+        if pagename_prefix:
+            name_clauses.append({"current_wikipages": {"$regex": "^" + _pagename_regex(pagename_key(pagename_prefix)), "$options": "i"}})
+        rv = []
+        while limit is None or len(rv) < limit:
+            pipeline = [
+                {"$match": {"$and": clauses}},
+                {"$project": {"_id": 0, "current_wikipages": 1, "tags": 1}},
+                {"$unwind": "$current_wikipages"},
+            ]
+            page_clauses = list(name_clauses)
+            if after is not None:
+                page_clauses.append({"current_wikipages": {"$gt": after}})
+            if page_clauses:
+                pipeline.append({"$match": {"$and": page_clauses}})
+            pipeline.append({"$sort": {"current_wikipages": 1}})
+            if limit is not None:
+                n_wanted = limit - len(rv)
+                pipeline.append({"$limit": n_wanted})
+            n_pages = 0
+            for page in self.collection.aggregate(pipeline):
+                n_pages += 1
+                after = page["current_wikipages"]
+                if pagename_matches(after, pagename, pagename_prefix):
+                    rv.append((after, page.get("tags", [])))
+            if limit is None or n_pages < n_wanted:
+                break
+        return rv
+
+    def get_tags(self, prefix):
+        return set(tag for tag in self.collection.distinct('tags')
+                   if tag is not None and tag.startswith(prefix))
+
+    def count_current_tags(self, prefix):
+        return dict((q["_id"], q["count"]) for q in self.database.tag_counts.find({
+            "_id": {"$regex": "^" + re.escape(prefix)},
+            "count": {"$gt": 0},
+        }))
+
+    def get_state(self, name):
+        q = self.database.index_state.find_one({"_id": name})
+        return q["value"] if q else None
+
+    def set_state(self, name, value):
+        self.database.index_state.replace_one({"_id": name}, {"_id": name, "value": value}, upsert=True)
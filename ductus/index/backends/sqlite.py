@@ -0,0 +1,378 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import sqlite3
+import threading
+
+from ductus.index.pagenames import pagename_key, pagename_tokens, pagename_trigrams, pagename_matches
+
+_schema = """
+CREATE TABLE IF NOT EXISTS resources (
+    urn TEXT PRIMARY KEY,
+    fqn TEXT,
+    links TEXT,
+    recursive_links TEXT,
+    parents TEXT,
+    tags TEXT
+);
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    urn TEXT NOT NULL,
+    PRIMARY KEY (tag, urn)
+);
+CREATE INDEX IF NOT EXISTS tags_urn ON tags (urn);
+CREATE TABLE IF NOT EXISTS links (
+    link TEXT NOT NULL,
+    urn TEXT NOT NULL,
+    PRIMARY KEY (link, urn)
+);
+CREATE INDEX IF NOT EXISTS links_urn ON links (urn);
+CREATE TABLE IF NOT EXISTS recursive_links (
+    link TEXT NOT NULL,
+    urn TEXT NOT NULL,
+    PRIMARY KEY (link, urn)
+);
+CREATE INDEX IF NOT EXISTS recursive_links_urn ON recursive_links (urn);
+CREATE TABLE IF NOT EXISTS terms (
+    term TEXT NOT NULL,
+    urn TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (term, urn)
+);
+CREATE INDEX IF NOT EXISTS terms_urn ON terms (urn);
+CREATE TABLE IF NOT EXISTS current_wikipages (
+    pagename TEXT PRIMARY KEY,
+    urn TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS current_wikipages_urn ON current_wikipages (urn);
+CREATE TABLE IF NOT EXISTS pagename_tokens (
+    token TEXT NOT NULL,
+    pagename TEXT NOT NULL,
+    PRIMARY KEY (token, pagename)
+);
+CREATE INDEX IF NOT EXISTS pagename_tokens_pagename ON pagename_tokens (pagename);
+CREATE TABLE IF NOT EXISTS pagename_trigrams (
+    trigram TEXT NOT NULL,
+    pagename TEXT NOT NULL,
+    PRIMARY KEY (trigram, pagename)
+);
+CREATE INDEX IF NOT EXISTS pagename_trigrams_pagename ON pagename_trigrams (pagename);
+CREATE TABLE IF NOT EXISTS tag_counts (
+    tag TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# list-valued keys of an index document, stored as json
+_list_keys = ('links', 'recursive_links', 'parents', 'tags')
+
+def _prefix_range(prefix):
+    "Returns the bounds of the strings that start with `prefix`"
+    return prefix, prefix + u'\U0010ffff'
+
+def _batches(items):
+    "Splits `items` into lists small enough to be query parameters"
+    items = list(items)
+    # sqlite allows at most 999 parameters
+    for i in range(0, len(items), 500):
+        yield items[i:i + 500]
+
+def _current_tags(connection, urns):
+    """Returns a dict giving the tags of each of `urns`, or an empty set for
+    those that are not current"""
+    rv = dict((urn, set()) for urn in urns)
+    for batch in _batches(urns):
+        for urn, tag in connection.execute(
+                'SELECT t.urn, t.tag FROM tags t WHERE t.urn IN (%s) '
+                'AND EXISTS (SELECT 1 FROM current_wikipages cw WHERE cw.urn = t.urn)'
+                % ', '.join('?' * len(batch)), batch):
+            rv[urn].add(tag)
+    return rv
+
+def _count_tags(connection, before, after):
+    """Updates the tag counts given the current tags of some urns before and
+    after a change"""
+    counts = {}
+    for urn in before:
+        for tag in after[urn] - before[urn]:
+            counts[tag] = counts.get(tag, 0) + 1
+        for tag in before[urn] - after[urn]:
+            counts[tag] = counts.get(tag, 0) - 1
+    for tag, count in counts.items():
+        if count:
+            connection.execute('INSERT OR IGNORE INTO tag_counts VALUES (?, 0)', (tag,))
+            connection.execute('UPDATE tag_counts SET count = count + ? WHERE tag = ?', (count, tag))
+    connection.execute('DELETE FROM tag_counts WHERE count <= 0')
+
+def _index_pagenames(connection, pagenames):
+    for pagename in pagenames:
+        key = pagename_key(pagename)
+        connection.executemany('INSERT OR IGNORE INTO pagename_tokens VALUES (?, ?)',
+                               ((token, pagename) for token in pagename_tokens(key)))
+        connection.executemany('INSERT OR IGNORE INTO pagename_trigrams VALUES (?, ?)',
+                               ((trigram, pagename) for trigram in pagename_trigrams(key)))
+
+def _unindex_pagenames(connection, pagenames):
+    for pagename in pagenames:
+        connection.execute('DELETE FROM pagename_tokens WHERE pagename = ?', (pagename,))
+        connection.execute('DELETE FROM pagename_trigrams WHERE pagename = ?', (pagename,))
+
+class SqliteIndexBackend(object):
+    """Keeps the index in an SQLite database file, so no server is needed
+
+    Besides a row for each document, tags, links, recursive links, terms and
+    current wiki pages are kept in tables of their own, each with the indexes needed to search
+    them.  The tokens and trigrams of current page names are kept too (see
+    ductus.index.pagenames), as is the number of current resources having
+    each tag.  Each thread (and process) gets its own connection.  The file is
+    in WAL mode, so searches need not wait for an update to finish.  (A
+    filename of ':memory:' gives a database that is private to one thread,
+    which is only useful for testing.)
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__local = threading.local()
+
+    def _get_connection(self):
+        local = self.__local
+        if getattr(local, 'pid', None) != os.getpid():
+            # a new thread, or a new process that must not share its
+            # parent's connection
+            connection = sqlite3.connect(self.filename, timeout=30)
+            connection.create_function('pagename_matches', 3, pagename_matches)
+            if self.filename != ':memory:':
+                connection.execute('PRAGMA journal_mode=WAL')
+            # each statement commits on its own (the sqlite3 module commits
+            # before anything but INSERT, UPDATE, DELETE and REPLACE), and
+            # connections opened meanwhile may run them too, which IF NOT
+            # EXISTS allows
+            for statement in _schema.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def prepare(self):
+        # the schema includes the indexes
+        with self._get_connection() as connection:
+            connection.execute('ANALYZE')
+
+    def update(self, objs):
+        with self._get_connection() as connection:
+            # take the write lock now, as the counts depend on what is read
+            connection.execute('BEGIN IMMEDIATE')
+            # the urns whose current tags may change: those being updated,
+            # and those whose pages they take over
+            urns = set(objs)
+            pagenames = set(pagename for obj in objs.values()
+                            for pagename in obj.get("current_wikipages", ()))
+            for batch in _batches(pagenames):
+                urns.update(urn for (urn,) in connection.execute(
+                    'SELECT urn FROM current_wikipages WHERE pagename IN (%s)'
+                    % ', '.join('?' * len(batch)), batch))
+            tags_before = _current_tags(connection, urns)
+
+            for urn, obj in objs.items():
+                row = [urn, obj.get("fqn")]
+                row.extend(json.dumps(obj[key]) if key in obj else None
+                           for key in _list_keys)
+                connection.execute('INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?, ?, ?)', row)
+                connection.execute('DELETE FROM tags WHERE urn = ?', (urn,))
+                connection.executemany('INSERT OR IGNORE INTO tags VALUES (?, ?)',
+                                       ((tag, urn) for tag in obj.get("tags", ())))
+                connection.execute('DELETE FROM links WHERE urn = ?', (urn,))
+                connection.executemany('INSERT OR IGNORE INTO links VALUES (?, ?)',
+                                       ((link, urn) for link in obj.get("links", ())))
+                connection.execute('DELETE FROM recursive_links WHERE urn = ?', (urn,))
+                connection.executemany('INSERT OR IGNORE INTO recursive_links VALUES (?, ?)',
+                                       ((link, urn) for link in obj.get("recursive_links", ())))
+                connection.execute('DELETE FROM terms WHERE urn = ?', (urn,))
+                connection.executemany('INSERT INTO terms VALUES (?, ?, ?)',
+                                       ((term, urn, count) for term, count in obj.get("terms", {}).items()))
+                if "current_wikipages" in obj:
+                    old_pagenames = set(pagename for (pagename,) in connection.execute(
+                        'SELECT pagename FROM current_wikipages WHERE urn = ?', (urn,)))
+                    new_pagenames = set(obj["current_wikipages"])
+                    connection.execute('DELETE FROM current_wikipages WHERE urn = ?', (urn,))
+                    # a page has only one current urn, so this replaces any
+                    # other that the page had
+                    connection.executemany('INSERT OR REPLACE INTO current_wikipages VALUES (?, ?)',
+                                           ((pagename, urn) for pagename in new_pagenames))
+                    _unindex_pagenames(connection, old_pagenames - new_pagenames)
+                    _index_pagenames(connection, new_pagenames - old_pagenames)
+
+            _count_tags(connection, tags_before, _current_tags(connection, urns))
+
+    def get_recursive_links(self, urns):
+        connection = self._get_connection()
+        rv = {}
+        for batch in _batches(urns):
+            for urn, recursive_links in connection.execute(
+                    'SELECT urn, recursive_links FROM resources WHERE urn IN (%s)'
+                    % ', '.join('?' * len(batch)), batch):
+                rv[urn] = set(json.loads(recursive_links)) if recursive_links else set()
+        return rv
+
+    def get_links(self, urns):
+        connection = self._get_connection()
+        rv = {}
+        for batch in _batches(urns):
+            for urn, links in connection.execute(
+                    'SELECT urn, links FROM resources WHERE urn IN (%s)'
+                    % ', '.join('?' * len(batch)), batch):
+                rv[urn] = set(json.loads(links)) if links else set()
+        return rv
+
+    def get_linking_urns(self, urns, recursive=False):
+        connection = self._get_connection()
+        table = 'recursive_links' if recursive else 'links'
+        rv = dict((urn, set()) for urn in urns)
+        for batch in _batches(rv):
+            # (link, urn) is the primary key, so this uses it
+            for link, urn in connection.execute(
+                    'SELECT link, urn FROM %s WHERE link IN (%s)'
+                    % (table, ', '.join('?' * len(batch))), batch):
+                rv[link].add(urn)
+        return rv
+
+    def get_postings(self, terms):
+        connection = self._get_connection()
+        rv = dict((term, {}) for term in terms)
+        for batch in _batches(rv):
+            for term, urn, count in connection.execute(
+                    'SELECT term, urn, count FROM terms WHERE term IN (%s)'
+                    % ', '.join('?' * len(batch)), batch):
+                rv[term][urn] = count
+        return rv
+
+    def find_current_containers(self, urns):
+        connection = self._get_connection()
+        contained = {}
+        for batch in _batches(urns):
+            params = ', '.join('?' * len(batch))
+            for (urn,) in connection.execute(
+                    'SELECT DISTINCT urn FROM current_wikipages WHERE urn IN (%s)' % params, batch):
+                contained.setdefault(urn, set()).add(urn)
+            for urn, link in connection.execute(
+                    'SELECT urn, link FROM recursive_links rl WHERE link IN (%s) '
+                    'AND EXISTS (SELECT 1 FROM current_wikipages cw WHERE cw.urn = rl.urn)' % params, batch):
+                contained.setdefault(urn, set()).add(link)
+
+        pagenames = dict((urn, []) for urn in contained)
+        tags = {}
+        for batch in _batches(contained):
+            params = ', '.join('?' * len(batch))
+            for urn, pagename in connection.execute(
+                    'SELECT urn, pagename FROM current_wikipages WHERE urn IN (%s) ORDER BY pagename' % params, batch):
+                pagenames[urn].append(pagename)
+            for urn, urn_tags in connection.execute(
+                    'SELECT urn, tags FROM resources WHERE urn IN (%s)' % params, batch):
+                tags[urn] = json.loads(urn_tags) if urn_tags else []
+        return dict((urn, (contained[urn], pagenames[urn], tags.get(urn, [])))
+                    for urn in contained)
+
+    def set_current_wikipages(self, current_wikipages_map):
+        with self._get_connection() as connection:
+            connection.execute('DELETE FROM current_wikipages')
+            connection.execute('DELETE FROM pagename_tokens')
+            connection.execute('DELETE FROM pagename_trigrams')
+            connection.executemany('INSERT OR REPLACE INTO current_wikipages VALUES (?, ?)',
+                                   ((pagename, urn) for urn, pagenames in current_wikipages_map.items()
+                                    for pagename in pagenames))
+            _index_pagenames(connection, (pagename for pagenames in current_wikipages_map.values()
+                                          for pagename in pagenames))
+            connection.execute('DELETE FROM tag_counts')
+            connection.execute(
+                'INSERT INTO tag_counts SELECT tag, COUNT(*) FROM tags t '
+                'WHERE EXISTS (SELECT 1 FROM current_wikipages cw WHERE cw.urn = t.urn) '
+                'GROUP BY tag')
+
+    def search(self, tags=None, pagename=None, notags=False, pagename_prefix=None,
+               after=None, limit=None):
+        sql = ['SELECT cw.pagename, r.tags FROM']
+        params = []
+        tags = sorted(set(tags or ()))
+        if tags and not notags:
+            # start from the urns having every tag, which the index finds
+            sql.append('(SELECT urn FROM tags WHERE tag IN (%s) GROUP BY urn HAVING COUNT(*) = ?) m '
+                       'JOIN current_wikipages cw ON cw.urn = m.urn'
+                       % ', '.join('?' * len(tags)))
+            params.extend(tags)
+            params.append(len(tags))
+        else:
+            sql.append('current_wikipages cw')
+        sql.append('JOIN resources r ON r.urn = cw.urn')
+
+        where = []
+        if notags:
+            # special search feature to report all pages without tags
+            where.append("r.tags = '[]'")
+        else:
+            # narrow the page names down using the tokens and trigrams, then
+            # check the ones that are left
+            if pagename:
+                key = pagename_key(pagename)
+                if len(key) >= 3:
+                    trigrams = sorted(pagename_trigrams(key))
+                    where.append('cw.pagename IN (SELECT pagename FROM pagename_trigrams WHERE trigram IN (%s) '
+                                 'GROUP BY pagename HAVING COUNT(*) = ?)' % ', '.join('?' * len(trigrams)))
+                    params.extend(trigrams)
+                    params.append(len(trigrams))
+                else:
+                    where.append('cw.pagename IN (SELECT pagename FROM pagename_tokens WHERE token >= ? AND token < ?)')
+                    params.extend(_prefix_range(key))
+            if pagename_prefix:
+                where.append('cw.pagename IN (SELECT pagename FROM pagename_tokens WHERE token >= ? AND token < ?)')
+                params.extend(_prefix_range(pagename_key(pagename_prefix)))
+            if pagename or pagename_prefix:
+                where.append('pagename_matches(cw.pagename, ?, ?)')
+                params.extend((pagename, pagename_prefix))
+        if after is not None:
+            where.append('cw.pagename > ?')
+            params.append(after)
+        if where:
+            sql.append('WHERE ' + ' AND '.join(where))
+        sql.append('ORDER BY cw.pagename')
+        if limit is not None:
+            sql.append('LIMIT ?')
+            params.append(limit)
+        return [(name, json.loads(page_tags) if page_tags else [])
+                for name, page_tags in self._get_connection().execute(' '.join(sql), params)]
+
+    def get_tags(self, prefix):
+        return set(tag for (tag,) in self._get_connection().execute(
+            'SELECT DISTINCT tag FROM tags WHERE tag >= ? AND tag < ?', _prefix_range(prefix)))
+
+    def count_current_tags(self, prefix):
+        return dict(self._get_connection().execute(
+            'SELECT tag, count FROM tag_counts WHERE tag >= ? AND tag < ?', _prefix_range(prefix)))
+
+    def get_state(self, name):
+        for (value,) in self._get_connection().execute('SELECT value FROM state WHERE name = ?', (name,)):
+            return json.loads(value)
+        return None
+
+    def set_state(self, name, value):
+        with self._get_connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO state VALUES (?, ?)', (name, json.dumps(value)))
@@ -0,0 +1,202 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Full text search
+
+The text of each resource is split into terms, and the index keeps, for
+each resource, how many times each term occurs in it (see
+ductus.index.backends).  A resource's own text does not include the text of
+the resources it links to, so a lesson is found by a phrase it contains
+through its recursive links.
+
+Modules say where the text of their resources is with
+register_text_extractor().  Text is split into terms by the tokenizer
+registered for its language, if any, and otherwise by default_tokenizer(),
+which handles any script:
+
+>>> tokenize(u'Hello, World_wide!')
+[u'hello', u'world', u'wide']
+>>> tokenize(u'\\u4e2d\\u6587\\u5b57')
+[u'\\u4e2d\\u6587', u'\\u6587\\u5b57']
+>>> tokenize(u'Stra\\xdfe', 'de')
+[u'strasse']
+"""
+
+import math
+import re
+import unicodedata
+
+_word_re = re.compile(r'[^\W_]+', re.UNICODE)
+
+# scripts written without spaces between words (plus Hangul, whose words are
+# long compounds), which are split into overlapping pairs of characters
+_bigram_script_re = re.compile(u'([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+)')
+
+def default_tokenizer(text):
+    terms = []
+    text = unicodedata.normalize('NFKC', text).lower()
+    for word in _word_re.findall(text):
+        for i, run in enumerate(_bigram_script_re.split(word)):
+            if not run:
+                continue
+            if i % 2 == 0:
+                terms.append(run)
+            elif len(run) == 1:
+                terms.append(run)
+            else:
+                terms.extend(run[j:j + 2] for j in range(len(run) - 1))
+    return terms
+
+_tokenizers = {}
+
+def register_tokenizer(*languages):
+    """Decorator registering a function that splits text in any of
+    `languages` into a list of terms"""
+    def decorator(func):
+        for language in languages:
+            _tokenizers[language] = func
+        return func
+    return decorator
+
+@register_tokenizer('de')
+def german_tokenizer(text):
+    return [term.replace(u'\xdf', u'ss') for term in default_tokenizer(text)]
+
+@register_tokenizer('tr')
+def turkish_tokenizer(text):
+    # the dotted and dotless i are separate letters, each with its own
+    # upper case
+    return default_tokenizer(text.replace(u'I', u'\u0131').replace(u'\u0130', u'i'))
+
+def tokenize(text, language=None):
+    """Returns the list of terms in `text`, which is in the given language
+    (a BCP 47 tag) if known"""
+    if isinstance(text, bytes):
+        # lxml gives ascii text as a byte string
+        text = text.decode('utf-8')
+    if language:
+        tokenizer = _tokenizers.get(language.partition('-')[0].lower(), default_tokenizer)
+    else:
+        tokenizer = default_tokenizer
+    return tokenizer(text)
+
+_text_extractors = {}
+
+def register_text_extractor(model_class):
+    """Decorator registering a function that, given the root of the XML of
+    a resource of `model_class`, returns a list of (text, language) for the
+    text in it.  The language may be None."""
+    def decorator(func):
+        _text_extractors[model_class.fqn] = func
+        return func
+    return decorator
+
+def read_terms(root):
+    """Returns a dict giving how many times each term occurs in the text of
+    the resource whose XML root is `root`, or None if resources of its kind
+    have no text"""
+    try:
+        extractor = _text_extractors[root.tag]
+    except KeyError:
+        return None
+    terms = {}
+    for text, language in extractor(root):
+        for term in tokenize(text, language):
+            terms[term] = terms.get(term, 0) + 1
+    return terms
+
+def html_to_text(html):
+    "Returns the text of an HTML fragment"
+    from genshi.core import TEXT
+    from genshi.input import HTML
+    return u' '.join(data for kind, data, pos in HTML(html) if kind is TEXT)
+
+_creole_macro_re = re.compile(r'<<.*?>>', re.DOTALL)
+
+def creole_to_text(markup):
+    """Returns the text of creole markup.  Markup characters need not be
+    removed, as the tokenizers skip them, but macros are."""
+    return _creole_macro_re.sub(u' ', markup)
+
+# term frequency saturation, as in BM25
+_k1 = 1.2
+
+def rank(terms, postings, containers):
+    """Ranks the current resources containing all of `terms`
+
+    `postings` gives, for each term, a dict of the number of times it occurs
+    in each resource.  `containers` gives, for each current resource, the
+    set of those resources that it is or links to.  Returns a list of
+    (score, urn), best first.
+    """
+    # a resource counts each term as many times as it occurs in the
+    # resource and everything it links to
+    frequencies = {}
+    for urn, contained in containers.items():
+        frequencies[urn] = [sum(postings[term].get(u, 0) for u in contained)
+                            for term in terms]
+
+    # rarer terms count for more
+    n = len(frequencies)
+    weights = []
+    for i in range(len(terms)):
+        df = sum(1 for f in frequencies.values() if f[i])
+        weights.append(math.log(1 + (n - df + 0.5) / (df + 0.5)))
+
+    rv = [(sum(w * tf * (_k1 + 1) / (tf + _k1) for w, tf in zip(weights, f)), urn)
+          for urn, f in frequencies.items() if all(f)]
+    rv.sort(key=lambda item: (-item[0], item[1]))
+    return rv
+
+def search_text(index, text, language=None, tags=None, notags=False,
+                pagename=None, pagename_prefix=None, limit=None):
+    """Returns a list of (absolute pagename, tags) for the current wiki
+    pages containing every term of `text`, best match first
+
+    `index` is the index backend to use, `language` is the language of
+    `text` if known, and the other arguments are as for
+    ductus.index.search_pages.
+    """
+    from ductus.index.pagenames import pagename_matches
+
+    terms = sorted(set(tokenize(text, language)))
+    if not terms:
+        return []
+    postings = index.get_postings(terms)
+    if not all(postings.values()):
+        return []
+    urns = set()
+    for urn_counts in postings.values():
+        urns.update(urn_counts)
+
+    # only the resources the search is restricted to are ranked
+    tags = set(tags or ())
+    containers = {}
+    for urn, (contained, pagenames, urn_tags) in index.find_current_containers(urns).items():
+        if (notags and urn_tags) or not tags.issubset(urn_tags):
+            continue
+        pagenames = [name for name in pagenames
+                     if pagename_matches(name, pagename, pagename_prefix)]
+        if pagenames:
+            containers[urn] = (contained, pagenames, urn_tags)
+
+    rv = []
+    for score, urn in rank(terms, postings, dict((urn, c[0]) for urn, c in containers.items())):
+        contained, pagenames, urn_tags = containers[urn]
+        rv.extend((name, urn_tags) for name in pagenames)
+        if limit is not None and len(rv) >= limit:
+            return rv[:limit]
+    return rv
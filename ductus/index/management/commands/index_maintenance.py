@@ -14,124 +14,221 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
+import itertools
 import logging
+import multiprocessing
+import time
+from collections import deque
+from optparse import make_option
 
-from django.core.management.base import NoArgsCommand
+from django.core.management.base import NoArgsCommand, CommandError
 from django.conf import settings
+from django.utils import timezone
 
 logger = logging.getLogger(__name__)
 
+# a run records its progress every this many seconds, so it can be resumed
+checkpoint_interval = 30
+
+def _index_batch(batch, force_update):
+    """Verifies each (urn, current_wikipages) in `batch`.  Returns the number
+    of urns that succeeded and the list of those that failed.
+
+    This runs in a worker process, which makes its own connections.
+    """
+    from ductus.index import get_index_backend, verify
+    index = get_index_backend()
+    memo = {}
+    n_successful = 0
+    failed = []
+    for urn, current_wikipages in batch:
+        try:
+            verify(index, urn, current_wikipages, force_update=force_update, memo=memo)
+        except Exception:
+            failed.append(urn)
+        else:
+            n_successful += 1
+    return n_successful, failed
+
+def _format_time(value):
+    # the state must be json-compatible
+    return value.strftime('%Y-%m-%dT%H:%M:%S.%f') if value is not None else None
+
+def _parse_time(value):
+    if value is None:
+        return None
+    since = datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S.%f')
+    return timezone.make_aware(since, timezone.utc)
+
+def _parse_since(value):
+    for format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            since = datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+        else:
+            return timezone.make_aware(since, timezone.get_default_timezone())
+    raise CommandError("--since must be a date like 2013-01-31 or 2013-01-31T12:00:00")
+
 class Command(NoArgsCommand):
     help = "maintain the ductus wikipage/urn index"
 
-    def handle_noargs(self, **options):
-        from ductus.index import get_indexing_mongo_database
-        indexing_db = get_indexing_mongo_database()
-        if indexing_db is None:
-            raise Exception
-        collection = indexing_db.urn_index
-
-        def perform_upsert(urn, obj, ignore=None):
-            # REMEMBER that dictionary order matters in mongodb; we just ignore
-            # it
-
-            # fixme: first inspect element to see if things might already be
-            # right.  also check to make sure there aren't any unexpected
-            # attributes on the toplevel element.  and do the same thing for
-            # blobs too.
-
-            obj = dict(obj)
-            obj["urn"] = urn
-            collection.update({"urn": urn}, obj, upsert=True, safe=True)
-            verified_urns.add(urn)
+    option_list = NoArgsCommand.option_list + (
+        make_option('--since', dest='since', default=None,
+                    help='index resources saved since this date and time (default: since the last run)'),
+        make_option('--full', action='store_true', dest='full', default=False,
+                    help='look at every resource in the resource database'),
+        make_option('--force', action='store_true', dest='force', default=False,
+                    help='reindex resources even if they are already in the index'),
+        make_option('--resume', action='store_true', dest='resume', default=False,
+                    help='continue the last run, if it did not finish'),
+        make_option('--processes', type='int', dest='processes', default=multiprocessing.cpu_count(),
+                    help='number of worker processes'),
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='number of resources given to a worker process at a time'),
+    )
 
+    def handle_noargs(self, **options):
         logging.basicConfig(level=logging.INFO) # FIXME
 
-        # create the mongodb indexes
-        collection.ensure_index("urn", unique=True, drop_dups=True)
-        collection.ensure_index("parents", sparse=True)
-        collection.ensure_index("tags", sparse=True)
-        collection.ensure_index("links")
-        collection.ensure_index("recursive_links")
-
-        # Begin actual code
-
-        from lxml import etree
-
-        from ductus.resource import get_resource_database, UnexpectedHeader, hash_name
-        from ductus.wiki.models import WikiPage
+        # the workers must be started before this process connects to
+        # anything, so they don't share its connections
+        if options['processes'] > 1:
+            pool = multiprocessing.Pool(options['processes'])
+        else:
+            pool = None
+
+        try:
+            self.__run(pool, options)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+    def __run(self, pool, options):
+        from ductus.index import get_index_backend
+        index = get_index_backend()
+        if index is None:
+            raise CommandError("indexing is not configured; set DUCTUS_INDEX_BACKEND or DUCTUS_INDEXING_MONGO_DATABASE")
+        index.prepare()
+
+        from ductus.resource import get_resource_database
+        from ductus.wiki.models import WikiRevision, get_current_wikipages_map
 
         resource_database = get_resource_database()
 
-        verified_urns = set()
-        current_wikipages_map = {}
-
-        operations = {None: 0}
-
-        def verify(urn):
-            """Updates a urn's indexing info and returns the set of its recursive links
-            """
-            operations[None] += 1
-            logger.info("operation %d: processing %s", operations[None], urn)
-
-            if urn in verified_urns:
-                q = collection.find_one({"urn": urn}, {"recursive_links": 1})
-                try:
-                    return set(q["recursive_links"])
-                except KeyError:
-                    return set()
-
-            try:
-                tree = resource_database.get_xml_tree(urn)
-            except UnexpectedHeader:
-                # it must be a blob
-                perform_upsert(urn, {"fqn": None})
-                return set()
-
-            links = set()
-            for event, element in etree.iterwalk(tree):
-                if '{http://www.w3.org/1999/xlink}href' in element.attrib and element.getparent().tag != '{http://ductus.us/ns/2009/ductus}parents':
-                    link = element.attrib['{http://www.w3.org/1999/xlink}href']
-                    if link.startswith('urn:%s:' % hash_name):
-                        links.add(link)
-
-            recursive_links = set(links)
-            for link in links:
-                additional_links = verify(link)
-                recursive_links.update(additional_links)
-
-            resource = resource_database.get_resource_object(urn)
-
-            assert resource.fqn is not None
-            obj = {
-                "fqn": resource.fqn,
-                "links": list(links),
-                "recursive_links": sorted(recursive_links),
-                "current_wikipages": sorted(current_wikipages_map.get(urn, ())),
+        state = index.get_state("maintenance") or {}
+        if options['resume']:
+            run = state.get("run")
+            if run is None:
+                raise CommandError("there is no unfinished run to resume")
+            logger.info("Resuming the run started at %s, after %d resources", run["started"], run["done"])
+        else:
+            if options['full']:
+                since = None
+            elif options['since']:
+                since = _parse_since(options['since'])
+            else:
+                # where the last run that finished left off, if any
+                since = _parse_time(state.get("indexed_until"))
+            run = {
+                "started": _format_time(timezone.now().astimezone(timezone.utc)),
+                "since": _format_time(since and since.astimezone(timezone.utc)),
+                "force": options['force'],
+                "done": 0,
+                # the resources that failed last time are tried again first
+                # (a full run looks at them anyway)
+                "retry": state.get("failed", []) if since is not None else [],
+                "failed": [],
             }
-            try:
-                obj["parents"] = sorted([parent.href for parent in resource.common.parents])
-                obj["tags"] = sorted([tag.value for tag in resource.tags])
-            except AttributeError:
-                pass
-            perform_upsert(urn, obj)
-
-            return recursive_links
-
-        for wikipage in WikiPage.objects.all():
-            revision = wikipage.get_latest_revision()
-            if revision is not None and revision.urn:
-                urn = 'urn:' + revision.urn
-                current_wikipages_map.setdefault(urn, set()).add(wikipage.name)
-
+        state["run"] = run
+        index.set_state("maintenance", state)
+        since = _parse_time(run["since"])
+
+        current_wikipages_map = get_current_wikipages_map()
+        # runs started before failed resources were kept have neither
+        run.setdefault("retry", [])
+        run.setdefault("failed", [])
+
+        if run["retry"]:
+            logger.info("Trying again %d resources that failed last time", len(run["retry"]))
+        if since is None:
+            logger.info("Looking at every resource")
+            urns = resource_database.iterkeys()
+        else:
+            # everything else that is new is linked from one of these, and
+            # verify() follows links
+            logger.info("Looking at resources saved since %s", since)
+            urns = ('urn:' + urn for urn in WikiRevision.objects
+                    .filter(timestamp__gte=since).exclude(urn='')
+                    .order_by('timestamp').values_list('urn', flat=True).iterator())
+        urns = itertools.islice(itertools.chain(run["retry"], urns), run["done"], None)
+
+        def batches():
+            while True:
+                batch = [(urn, sorted(current_wikipages_map.get(urn, ())))
+                         for urn in itertools.islice(urns, options['batch_size'])]
+                if not batch:
+                    return
+                yield batch
+
+        # a batch is done once it and every batch before it have been
+        # processed, so a run can be resumed after the last one that is done
+        pending = deque()
+        n_done = run["done"]
         n_attempted = n_successful = 0
-        for key in resource_database:
-            n_attempted += 1
-            try:
-                verify(key)
-            except Exception:
-                logger.warning("Key failed: %s", key)
+        start_time = last_checkpoint_time = time.time()
+
+        def finish_batch():
+            n_batch, result = pending.popleft()
+            if pool is not None:
+                result = result.get()
+            n_batch_successful, failed = result
+            for urn in failed:
+                logger.warning("Key failed: %s", urn)
+            run["failed"].extend(failed)
+            return n_batch, n_batch_successful
+
+        for batch in batches():
+            if pool is not None:
+                pending.append((len(batch), pool.apply_async(_index_batch, (batch, run["force"]))))
             else:
-                n_successful += 1
-
-        logger.info("Successfully processed %d of %d keys", n_successful, n_attempted)
+                pending.append((len(batch), _index_batch(batch, run["force"])))
+            # keep only a few batches waiting for each worker
+            while pending and (pool is None or len(pending) > 2 * options['processes']
+                               or pending[0][1].ready()):
+                n_batch, n_batch_successful = finish_batch()
+                n_done += n_batch
+                n_attempted += n_batch
+                n_successful += n_batch_successful
+            if time.time() - last_checkpoint_time > checkpoint_interval:
+                last_checkpoint_time = time.time()
+                run["done"] = n_done
+                index.set_state("maintenance", state)
+                elapsed = last_checkpoint_time - start_time
+                logger.info("Processed %d resources in %.0f seconds (%.1f per second)",
+                            n_attempted, elapsed, n_attempted / elapsed)
+        while pending:
+            n_batch, n_batch_successful = finish_batch()
+            n_attempted += n_batch
+            n_successful += n_batch_successful
+
+        # this also counts the tags again, fixing any count that has drifted
+        index.set_current_wikipages(current_wikipages_map)
+        # the cached search results may be wrong in any number of ways
+        from ductus.index.search_cache import index_rebuilt
+        index_rebuilt()
+
+        # the failed resources are not indexed yet, but only they need to be
+        # looked at again, so the next run starts from here and retries them
+        state["indexed_until"] = run["started"]
+        state["failed"] = sorted(set(run["failed"]))
+        del state["run"]
+        index.set_state("maintenance", state)
+        if state["failed"]:
+            logger.warning("%d resources failed; the next run will try them again",
+                           len(state["failed"]))
+
+        elapsed = time.time() - start_time
+        logger.info("Successfully processed %d of %d keys in %.0f seconds (%.1f per second)",
+                    n_successful, n_attempted, elapsed, n_attempted / elapsed if elapsed else 0)
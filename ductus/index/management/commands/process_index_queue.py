@@ -0,0 +1,66 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import threading
+import time
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+logger = logging.getLogger(__name__)
+
+# how often to report the state of the queue, in seconds
+report_interval = 60
+
+class Command(NoArgsCommand):
+    help = "do the queued index updates (see DUCTUS_INDEX_QUEUE)"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--workers', type='int', dest='workers', default=2,
+                    help='number of worker threads'),
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help='do the updates that are queued now, then exit'),
+    )
+
+    def handle_noargs(self, **options):
+        logging.basicConfig(level=logging.INFO) # FIXME
+
+        from ductus.index.queue import get_index_queue, process_job
+        queue = get_index_queue()
+        if queue is None:
+            raise CommandError("DUCTUS_INDEX_QUEUE is not set")
+
+        if options['once']:
+            n = queue.flush(process_job)
+            logger.info("Did %d index updates", n)
+            return
+
+        stop = threading.Event()
+        workers = [threading.Thread(target=queue.work, args=(process_job,), kwargs={'stop': stop})
+                   for i in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        try:
+            while True:
+                time.sleep(report_interval)
+                stats = queue.get_stats()
+                logger.info("%(pending)d index updates queued, the oldest for %(lag).0f seconds; "
+                            "%(failing)d have failed", stats)
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
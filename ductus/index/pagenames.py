@@ -0,0 +1,70 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Helpers for indexing page names so they can be searched quickly
+
+A page name is searched in its normalized form, given by pagename_key().
+Each name is indexed under its trigrams, so a substring of three or more
+characters can be looked up by the trigrams it contains, and under its
+tokens (plus the whole key), so a shorter query can be looked up as the
+start of a token.  (A query of one or two characters thus matches only
+at the start of a word, which is what an autocompleting user means
+anyway.)
+
+>>> pagename_key(u'en:Some Page')
+u'en:some_page'
+>>> sorted(pagename_tokens(u'en:some_page'))
+[u'en', u'en:some_page', u'page', u'some']
+>>> sorted(pagename_trigrams(u'en:some'))
+[u':so', u'en:', u'n:s', u'ome', u'som']
+"""
+
+import re
+
+_token_separator_re = re.compile(r'[\W_]+', re.UNICODE)
+
+def pagename_key(name):
+    # the search page turns spaces into underscores, so do the same
+    return name.lower().replace(u' ', u'_')
+
+def pagename_tokens(key):
+    tokens = set(token for token in _token_separator_re.split(key) if token)
+    tokens.add(key)
+    return tokens
+
+def pagename_trigrams(key):
+    return set(key[i:i + 3] for i in range(len(key) - 2))
+
+def pagename_matches(name, substring=None, prefix=None):
+    """Returns True if the page name `name` contains `substring` and starts
+    with `prefix`, ignoring case, just like an index search would
+
+    >>> pagename_matches(u'en:Some_page', substring=u'ME_P')
+    True
+    >>> pagename_matches(u'en:Some_page', substring=u'om')
+    False
+    """
+    key = pagename_key(name)
+    if substring:
+        substring = pagename_key(substring)
+        if len(substring) < 3:
+            if not any(token.startswith(substring) for token in pagename_tokens(key)):
+                return False
+        elif substring not in key:
+            return False
+    if prefix and not key.startswith(pagename_key(prefix)):
+        return False
+    return True
@@ -0,0 +1,251 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A durable queue of index updates, so edits need not wait for the index
+
+Each job asks for the index to be brought up to date after a change to a
+wiki page: the page is now current at a given urn (or at none, once it has
+been unlinked), and some urns (the page's previous revisions) need their
+index documents refreshed.  A job for a page that already has one waiting
+is merged into it, so a page edited many times in a row is only indexed
+once.  Since a job says what the page should look like rather than what
+changed, doing it twice does no harm.
+
+The queue is an SQLite file given by DUCTUS_INDEX_QUEUE.  Jobs are done by
+DUCTUS_INDEX_QUEUE_WORKERS threads in each process that queues them
+(default 2), or by the process_index_queue management command.  A job that
+fails is tried again later, waiting longer each time.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    pagename TEXT PRIMARY KEY,
+    urn TEXT,
+    urns TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    queued_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    not_before REAL NOT NULL,
+    claimed_until REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_queued_at ON jobs (queued_at);
+"""
+
+# a job not done within this many seconds of being claimed may be claimed
+# again, in case its worker died
+claim_timeout = 600
+
+# the most seconds to wait before trying a failed job again
+max_retry_delay = 600
+
+class IndexJob(object):
+    __slots__ = ('pagename', 'urn', 'urns', 'version', 'attempts')
+
+    def __init__(self, pagename, urn, urns, version, attempts):
+        self.pagename = pagename
+        self.urn = urn
+        self.urns = urns
+        self.version = version
+        self.attempts = attempts
+
+class IndexQueue(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.__local = threading.local()
+
+    def _get_connection(self):
+        local = self.__local
+        if getattr(local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.filename, timeout=30)
+            if self.filename != ':memory:':
+                connection.execute('PRAGMA journal_mode=WAL')
+            # each statement commits on its own (the sqlite3 module commits
+            # before anything but INSERT, UPDATE, DELETE and REPLACE), and
+            # connections opened meanwhile may run them too, which IF NOT
+            # EXISTS allows
+            for statement in _schema.split(';'):
+                if statement.strip():
+                    connection.execute(statement)
+            local.connection = connection
+            local.pid = os.getpid()
+        return local.connection
+
+    def put(self, pagename, urn, urns):
+        """Queues the index update for `pagename`, now current at `urn` (or
+        None), refreshing the index documents of `urns` too"""
+        now = time.time()
+        urns = set(urns)
+        if urn is not None:
+            urns.add(urn)
+        with self._get_connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            row = connection.execute('SELECT urns FROM jobs WHERE pagename = ?', (pagename,)).fetchone()
+            if row is not None:
+                # merge it with the job already waiting
+                urns.update(json.loads(row[0]))
+                connection.execute('UPDATE jobs SET urn = ?, urns = ?, version = version + 1 WHERE pagename = ?',
+                                   (urn, json.dumps(sorted(urns)), pagename))
+            else:
+                connection.execute('INSERT INTO jobs VALUES (?, ?, ?, 0, ?, 0, ?, NULL)',
+                                   (pagename, urn, json.dumps(sorted(urns)), now, now))
+
+    def claim(self, ignore_retry_delay=False):
+        """Returns the oldest job that is ready and not being done, marking
+        it as being done, or None"""
+        now = time.time()
+        with self._get_connection() as connection:
+            connection.execute('BEGIN IMMEDIATE')
+            sql = ('SELECT pagename, urn, urns, version, attempts FROM jobs '
+                   'WHERE (claimed_until IS NULL OR claimed_until < ?)')
+            params = [now]
+            if not ignore_retry_delay:
+                sql += ' AND not_before <= ?'
+                params.append(now)
+            row = connection.execute(sql + ' ORDER BY queued_at LIMIT 1', params).fetchone()
+            if row is None:
+                return None
+            pagename, urn, urns, version, attempts = row
+            connection.execute('UPDATE jobs SET claimed_until = ? WHERE pagename = ?',
+                               (now + claim_timeout, pagename))
+        return IndexJob(pagename, urn, json.loads(urns), version, attempts)
+
+    def done(self, job):
+        with self._get_connection() as connection:
+            cursor = connection.execute('DELETE FROM jobs WHERE pagename = ? AND version = ?',
+                                        (job.pagename, job.version))
+            if cursor.rowcount == 0:
+                # the page changed again meanwhile, so do it again
+                connection.execute('UPDATE jobs SET claimed_until = NULL WHERE pagename = ?', (job.pagename,))
+
+    def failed(self, job):
+        delay = min(2 ** job.attempts, max_retry_delay)
+        with self._get_connection() as connection:
+            connection.execute('UPDATE jobs SET attempts = attempts + 1, not_before = ?, claimed_until = NULL '
+                               'WHERE pagename = ?', (time.time() + delay, job.pagename))
+
+    def get_stats(self):
+        """Returns a dict giving the number of jobs waiting ("pending"), how
+        many seconds the oldest has waited ("lag"), and how many have failed
+        at least once ("failing")"""
+        pending, oldest, failing = self._get_connection().execute(
+            'SELECT COUNT(*), MIN(queued_at), SUM(attempts > 0) FROM jobs').fetchone()
+        return {
+            "pending": pending,
+            "lag": time.time() - oldest if oldest is not None else 0,
+            "failing": failing or 0,
+        }
+
+    def flush(self, process):
+        """Does every job in the queue now, with `process`, returning how
+        many were done.  An exception raised by `process` is passed on."""
+        n = 0
+        while True:
+            job = self.claim(ignore_retry_delay=True)
+            if job is None:
+                return n
+            try:
+                process(job)
+            except:
+                self.failed(job)
+                raise
+            self.done(job)
+            n += 1
+
+    def work(self, process, poll_interval=1, stop=None):
+        """Does jobs with `process` until the `stop` event is set"""
+        from django.db import close_connection
+        while stop is None or not stop.is_set():
+            try:
+                job = self.claim()
+            except sqlite3.Error:
+                logger.exception("Could not read the index queue")
+                job = None
+            if job is None:
+                _job_queued.wait(poll_interval)
+                _job_queued.clear()
+                continue
+            try:
+                process(job)
+            except Exception:
+                logger.exception("Index update for %s failed (attempt %d)", job.pagename, job.attempts + 1)
+                self.failed(job)
+            else:
+                self.done(job)
+            finally:
+                # each thread has its own database connection
+                close_connection()
+
+# set when a job is queued, to wake up this process's workers
+_job_queued = threading.Event()
+
+_index_queue = False  # False means uninitialized; None means updates are not
+                      # queued
+
+def get_index_queue():
+    """Returns the IndexQueue given by DUCTUS_INDEX_QUEUE, if any"""
+    global _index_queue
+    if _index_queue is False:
+        filename = getattr(settings, "DUCTUS_INDEX_QUEUE", None)
+        _index_queue = IndexQueue(filename) if filename else None
+    return _index_queue
+
+def process_job(job):
+    from ductus.index import update_index
+    update_index(job.pagename, job.urn, job.urns)
+
+_workers_lock = threading.Lock()
+_workers_pid = None
+
+def start_workers(queue, n_workers):
+    """Starts `n_workers` threads doing jobs from `queue`, unless this
+    process has already started them"""
+    global _workers_pid
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers_pid = os.getpid()
+        for i in range(n_workers):
+            worker = threading.Thread(target=queue.work, args=(process_job,),
+                                      name='index-worker-%d' % i)
+            worker.daemon = True
+            worker.start()
+
+def queue_job(pagename, urn, urns):
+    queue = get_index_queue()
+    queue.put(pagename, urn, urns)
+    _job_queued.set()
+    n_workers = getattr(settings, "DUCTUS_INDEX_QUEUE_WORKERS", 2)
+    if n_workers:
+        start_workers(queue, n_workers)
+
+def flush_index_queue():
+    """Does every queued index update now, in this thread.  This is for
+    tests, which want to see the index after an edit."""
+    queue = get_index_queue()
+    if queue is None:
+        return 0
+    return queue.flush(process_job)
@@ -0,0 +1,167 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""A cache of search results
+
+Results are cached under the normalized query along with a generation
+number for each thing the results depend on: each of the query's tags, or,
+for a query without tags, every page (or every page without tags, for a
+`notags` query).  When a page is saved or unlinked, update_index() calls
+pages_changed() with its tags before and after, which moves on the
+generations of those tags (and of every page), so exactly the results that
+may have changed are no longer found.  index_maintenance moves on a
+generation that every query depends on.
+
+With `stale=True`, cached_search_pages() returns the results from before
+the last change at once, if there are any, and searches again in a thread.
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+# generation numbers must outlive the results that depend on them
+_generation_timeout = 60 * 60 * 24 * 30
+
+# how long a thread may take to search again before another may try
+_refresh_timeout = 30
+
+def _hash(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True)).hexdigest()
+
+def _generation_key(name):
+    # tags may contain characters memcached does not allow in keys
+    return 'search_generation:' + _hash(name)
+
+def _get_generations(names):
+    keys = [_generation_key(name) for name in names]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        # start from the time, so a generation number forgotten by the
+        # cache is not used again
+        start = int(time.time() * 1000)
+        for key in missing:
+            cache.add(key, start, _generation_timeout)
+        generations.update(cache.get_many(missing))
+    return [generations.get(key) for key in keys]
+
+def _next_generations(names):
+    for name in names:
+        key = _generation_key(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # it is not in the cache, so any number from now on is new
+            cache.add(key, int(time.time() * 1000), _generation_timeout)
+
+def normalize_query(kwargs):
+    """Returns a json-compatible form of the arguments to
+    ductus.index.search_pages, the same for any two queries that are sure to
+    give the same results"""
+    from ductus.index.fulltext import tokenize
+    from ductus.index.pagenames import pagename_key
+    query = {}
+    for name, value in kwargs.items():
+        if name == 'tags':
+            value = sorted(set(value or ()))
+        elif name in ('pagename', 'pagename_prefix'):
+            value = pagename_key(value or u'')
+        elif name == 'text':
+            value = sorted(set(tokenize(value, kwargs.get('language'))))
+        elif name == 'notags':
+            value = True
+        query[name] = value
+    # the language only matters for splitting the text into terms
+    query.pop('language', None)
+    return query
+
+def _dependencies(query):
+    "Returns the names of the generations that the results of `query` use"
+    if 'notags' in query:
+        names = ['notags']
+    elif query.get('tags'):
+        names = ['tag:' + tag for tag in query['tags']]
+    else:
+        names = ['all']
+    return ['maintenance'] + names
+
+def pages_changed(tags_before, tags_after):
+    """Forgets the cached results that may have changed now that a page
+    that had `tags_before` has `tags_after`.  Either is None if the page was
+    not current then."""
+    names = set(['all'])
+    for tags in (tags_before, tags_after):
+        if tags is not None:
+            names.update('tag:' + tag for tag in tags)
+            if not tags:
+                names.add('notags')
+    _next_generations(names)
+
+def index_rebuilt():
+    "Forgets all the cached results"
+    _next_generations(['maintenance'])
+
+def _search(query_hash, key, kwargs):
+    from ductus.index import search_pages
+    results = search_pages(**kwargs)
+    if len(results) <= getattr(settings, "DUCTUS_SEARCH_CACHE_MAX_RESULTS", 1000):
+        cache.set_many({
+            'search_results:' + key: results,
+            'search_latest:' + query_hash: results,
+        }, getattr(settings, "DUCTUS_SEARCH_CACHE_TIMEOUT", 60 * 60))
+    return results
+
+def _refresh(query_hash, key, kwargs):
+    try:
+        _search(query_hash, key, kwargs)
+    except Exception:
+        logger.exception("Could not refresh the search results for %r", kwargs)
+    finally:
+        cache.delete('search_refresh:' + query_hash)
+
+def cached_search_pages(stale=False, **kwargs):
+    """Returns ductus.index.search_pages(**kwargs), from the cache if it is
+    there
+
+    If `stale` is True and the results have changed since they were cached,
+    the old results are returned, and a thread searches again.
+    """
+    query = normalize_query(kwargs)
+    query_hash = _hash(query)
+    key = _hash([query, _get_generations(_dependencies(query))])
+    results = cache.get('search_results:' + key)
+    if results is not None:
+        return results
+
+    if stale:
+        results = cache.get('search_latest:' + query_hash)
+        if results is not None:
+            # only one thread searches again at a time
+            if cache.add('search_refresh:' + query_hash, True, _refresh_timeout):
+                thread = threading.Thread(target=_refresh, args=(query_hash, key, kwargs))
+                thread.daemon = True
+                thread.start()
+            return results
+
+    return _search(query_hash, key, kwargs)
@@ -0,0 +1,197 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import gc
+import sys
+import time
+from cStringIO import StringIO
+from optparse import make_option
+
+from lxml import etree
+
+from django.core.management.base import NoArgsCommand
+
+from ductus.resource import _registered_ductmodels, read_resource_fields
+from ductus.resource.ductmodels import ValidationError
+
+# resources are built in memory and never saved, so links point at a urn
+# that need not exist
+dummy_urn = 'urn:sha384:35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs'
+dummy_license = 'http://creativecommons.org/licenses/by-sa/3.0/'
+
+def _fill_common(resource):
+    resource.common.author.text = u'benchmark'
+    resource.common.timestamp = u'2013-01-01T00:00:00'
+    license = resource.common.licenses.new_item()
+    license.href = dummy_license
+    resource.common.licenses.array.append(license)
+
+def _serialize(resource):
+    root = etree.Element(resource.fqn, nsmap=resource.nsmap)
+    resource.populate_xml_element(root, resource.ns)
+    return etree.tostring(root, encoding='utf-8', xml_declaration=True)
+
+def _parse(xml, validate=True):
+    root = etree.fromstring(xml)
+    resource = _registered_ductmodels[root.tag]()
+    resource.populate_from_xml(root)
+    if validate:
+        resource.validate(strict=False)
+    return resource
+
+def build_sample_resource(model):
+    """Returns a mostly empty instance of `model` that can be serialized
+
+    It need not pass validation, as we only measure reading and writing xml.
+    """
+    resource = model()
+    if 'common' in model.subelements:
+        _fill_common(resource)
+    # a required attribute that can't be blank is most likely a column index
+    for name, attribute in model.attributes.items():
+        if not attribute.optional:
+            try:
+                attribute.validate(getattr(resource, name))
+            except ValidationError:
+                setattr(resource, name, u'0')
+    return resource
+
+def build_flashcard_deck_xml(n_cards, n_columns=3):
+    """Returns the xml of a FlashcardDeck and of one of its Flashcards"""
+    from ductus.modules.flashcards.ductmodels import FlashcardDeck, Flashcard
+
+    card = Flashcard()
+    for i in range(n_columns):
+        side = card.sides.new_item()
+        side.href = dummy_urn if i else u''
+        card.sides.array.append(side)
+    _fill_common(card)
+
+    deck = FlashcardDeck()
+    for i in range(n_columns):
+        heading = deck.headings.new_item()
+        heading.text = u'column %d' % i
+        deck.headings.array.append(heading)
+    for i in range(n_cards):
+        item = deck.cards.new_item()
+        item.href = dummy_urn
+        deck.cards.array.append(item)
+    for tag in (u'target-language:en', u'benchmark'):
+        tag_element = deck.tags.new_item()
+        tag_element.value = tag
+        deck.tags.array.append(tag_element)
+    _fill_common(deck)
+
+    return _serialize(deck), _serialize(card)
+
+def measure_allocations(func):
+    """Returns (result, number of gc-tracked objects, approximate size in
+    bytes of those objects) for the objects created and kept alive by `func`"""
+    gc.collect()
+    gc.disable()
+    try:
+        before = set(id(o) for o in gc.get_objects())
+        result = func()
+        new_objects = [o for o in gc.get_objects()
+                       if id(o) not in before and o is not before]
+    finally:
+        gc.enable()
+    return result, len(new_objects), sum(sys.getsizeof(o) for o in new_objects)
+
+def measure_throughput(func, seconds=0.2):
+    "Returns the number of calls to `func` per second"
+    calls = 0
+    start = time.time()
+    while True:
+        func()
+        calls += 1
+        elapsed = time.time() - start
+        if elapsed >= seconds:
+            return calls / elapsed
+
+def measure_time(func, repeat):
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+class Command(NoArgsCommand):
+    help = "measure memory use and speed of loading ductmodels"
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--cards', type='int', dest='cards', default=300,
+                    help='number of cards in the benchmark flashcard deck'),
+        make_option('--repeat', type='int', dest='repeat', default=5,
+                    help='number of timing runs (the best is reported)'),
+    )
+
+    def handle_noargs(self, **options):
+        n_cards = options['cards']
+        repeat = options['repeat']
+
+        deck_xml, card_xml = build_flashcard_deck_xml(n_cards)
+
+        def load_deck_and_cards():
+            return [_parse(deck_xml)] + [_parse(card_xml) for i in range(n_cards)]
+
+        resources, n_objects, size = measure_allocations(load_deck_and_cards)
+        elapsed = measure_time(load_deck_and_cards, repeat)
+        self.stdout.write("flashcard deck with %d cards, loaded along with its cards:\n" % n_cards)
+        self.stdout.write("  %d objects, %d bytes, %.1f ms\n" % (n_objects, size, elapsed * 1000))
+
+        # what a blueprint '@patch' does: clone, then change one heading.  the
+        # resource being patched is a saved one, which its clone can share
+        # parts of; an unsaved one is copied
+        for state, urn in (('saved', dummy_urn), ('unsaved', None)):
+            deck = _parse(deck_xml)
+            deck.urn = urn
+            def clone_and_change_heading():
+                clone = deck.clone()
+                clone.headings.array[0].text = u'changed'
+                return clone
+
+            clone, n_objects, size = measure_allocations(clone_and_change_heading)
+            elapsed = measure_time(clone_and_change_heading, repeat)
+            self.stdout.write("cloning the %s deck and changing one heading:\n" % state)
+            self.stdout.write("  %d objects, %d bytes, %.3f ms\n" % (n_objects, size, elapsed * 1000))
+
+        # reading a few fields, compared with loading the whole resource
+        self.stdout.write("reading fields without loading the resource (calls per second):\n")
+        for name, xml, paths in (
+                ('Flashcard', card_xml, ('sides.href',)),
+                ('FlashcardDeck', deck_xml, ('common.parents.href',)),
+                ('FlashcardDeck', deck_xml, ('headings',))):
+            full_rate = measure_throughput(lambda: _parse(xml))
+            fields_rate = measure_throughput(lambda: read_resource_fields(StringIO(xml), paths))
+            self.stdout.write("  %-14s %-22s full load %9.0f  fields %9.0f\n"
+                              % (name, ','.join(paths), full_rate, fields_rate))
+
+        # xml throughput of every registered model
+        self.stdout.write("xml parse/serialize throughput (calls per second):\n")
+        samples = [(model.__name__, build_sample_resource(model))
+                   for model in _registered_ductmodels.values()]
+        samples.append(('FlashcardDeck (%d cards)' % n_cards, resources[0]))
+        for name, resource in sorted(samples):
+            xml = _serialize(resource)
+            parse_rate = measure_throughput(lambda: _parse(xml, validate=False))
+            serialize_rate = measure_throughput(lambda: _serialize(resource))
+            self.stdout.write("  %-30s parse %9.0f  serialize %9.0f\n"
+                              % (name, parse_rate, serialize_rate))
@@ -0,0 +1,70 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+
+from lxml import etree
+
+from django.core.management.base import NoArgsCommand
+
+logger = logging.getLogger(__name__)
+
+class Command(NoArgsCommand):
+    help = "convert and save the legacy resources linked from current wiki revisions"
+
+    def handle_noargs(self, **options):
+        from ductus.resource import get_resource_database, UnexpectedHeader, hash_name, _registered_ductmodels
+        from ductus.wiki.models import iter_current_revisions
+
+        logging.basicConfig(level=logging.INFO) # FIXME
+
+        resource_database = get_resource_database()
+
+        to_visit = [urn for name, urn in iter_current_revisions()]
+
+        visited = set()
+        n_converted = n_failed = 0
+        while to_visit:
+            urn = to_visit.pop()
+            if urn in visited:
+                continue
+            visited.add(urn)
+
+            try:
+                tree = resource_database.get_xml_tree(urn)
+            except UnexpectedHeader:
+                # it must be a blob
+                continue
+            root = tree.getroot()
+
+            model_class = _registered_ductmodels.get(root.tag)
+            if hasattr(model_class, "legacy_ductmodel_conversion"):
+                converted_urn = resource_database.convert_legacy_resource(urn, root)
+                if converted_urn is None:
+                    n_failed += 1
+                else:
+                    logger.info("%s was converted to %s", urn, converted_urn)
+                    n_converted += 1
+
+            # old revisions are not reachable, so we don't follow parents
+            for event, element in etree.iterwalk(tree):
+                if '{http://www.w3.org/1999/xlink}href' in element.attrib and element.getparent().tag != '{http://ductus.us/ns/2009/ductus}parents':
+                    link = element.attrib['{http://www.w3.org/1999/xlink}href']
+                    if link.startswith('urn:%s:' % hash_name):
+                        to_visit.append(link)
+
+        logger.info("Converted %d legacy resources (%d failed) among %d resources",
+                    n_converted, n_failed, len(visited))
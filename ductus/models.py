@@ -1,2 +1,33 @@
-# this file is necessary for tests to run, though it can be empty
-# (see http://stackoverflow.com/a/6964563)
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# (this file is also necessary for tests to run; see
+# http://stackoverflow.com/a/6964563)
+
+from django.db import models
+
+from ductus.resource import max_urn_length
+
+class LegacyConversion(models.Model):
+    """Records the resource that a legacy resource has been converted to (see
+    ResourceDatabase.convert_legacy_resource)
+
+    The table is created by syncdb (see doc/install.rst).
+    """
+
+    # both include the 'urn:' prefix
+    legacy_urn = models.CharField(max_length=max_urn_length, unique=True)
+    converted_urn = models.CharField(max_length=max_urn_length)
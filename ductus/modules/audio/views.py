@@ -136,13 +136,15 @@ def get_joined_audio_mediacache_url(resource, audio_urn_list, mime_type):
     if not audio_urn_list:
         return None
 
-    first_audio_resource = get_resource_database().get_resource_object(audio_urn_list[0])
+    resource_database = get_resource_database()
 
     if len(audio_urn_list) == 1:
+        first_audio_resource = resource_database.get_resource_object(audio_urn_list[0])
         return resolve_relative_mediacache_url(first_audio_resource)
     else:
+        first_blob_urn = resource_database.get_resource_fields(audio_urn_list[0], ('blob.href',))['blob.href']
         urn_list_hash = hashlib.sha1(' '.join(audio_urn_list)).hexdigest()
-        return resolve_relative_mediacache_url(resource, mime_type, urn_list_hash, first_audio_resource.blob.href)
+        return resolve_relative_mediacache_url(resource, mime_type, urn_list_hash, first_blob_urn)
 
 def mediacache_cat_audio(first_blob_urn, audio_urn_list, mime_type):
     if len(audio_urn_list) < 2:
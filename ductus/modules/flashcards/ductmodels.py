@@ -17,6 +17,7 @@
 from django.utils.six.moves import xrange
 
 from ductus.resource import ductmodels, register_ductmodel
+from ductus.index.fulltext import register_text_extractor
 
 # we import other models explicitly (until DuctModel supports interfaces)
 from ductus.modules.picture.ductmodels import Picture
@@ -28,6 +29,11 @@ class Phrase(ductmodels.BaseDuctModel):
     nsmap = {'phrase': ns}
 
     phrase = ductmodels.TextElement()
+
+@register_text_extractor(Phrase)
+def _phrase_text(root):
+    # fixme: a phrase does not say what language it is in
+    return [(ductmodels.FieldPath.get(Phrase, 'phrase').read(root), None)]
 # end of other models
 
 def _is_canonical_int(string):
@@ -157,7 +163,8 @@ class FlashcardDeck(ductmodels.DuctModel):
             raise ductmodels.ValidationError("there are no sides")
 
         if strict:
-            if any(len(card.get().sides) != headings_length for card in self.cards):
+            if any(card.get_metadata()['array_sizes'].get('sides') != headings_length
+                   for card in self.cards):
                 raise ductmodels.ValidationError("each card must have the same number of sides as headers given")
 
         nonempty_headings = [h.text for h in self.headings if h.text]
@@ -180,5 +187,10 @@ class FlashcardDeck(ductmodels.DuctModel):
             if highest_column_index >= headings_length:
                 raise ductmodels.ValidationError("column index out of range")
 
+@register_text_extractor(FlashcardDeck)
+def _flashcard_deck_text(root):
+    # the text of the cards is found through the phrases they link to
+    return [(heading, None) for heading in ductmodels.FieldPath.get(FlashcardDeck, 'headings').read(root)]
+
 # register legacy ductmodels
 import ductus.modules.flashcards.legacy_ductmodels
@@ -23,6 +23,16 @@ from ductus.modules.audio.ductmodels import Audio
 _phrase_choice_ns = 'http://wikiotics.org/ns/2011/phrase_choice'
 _picture_choice_ns = 'http://wikiotics.org/ns/2009/picture_choice'
 
+def _new_flashcard(lesson):
+    from ductus.modules.flashcards.ductmodels import Flashcard
+    flashcard = Flashcard()
+    # the cards are by the lesson's author, and dated with the lesson, so
+    # they can be saved (see ResourceDatabase.convert_legacy_resource) and a second
+    # conversion gives the same resources
+    flashcard.common.author = lesson.common.author.clone()
+    flashcard.common.timestamp = lesson.common.timestamp
+    return flashcard
+
 class PhraseChoiceElement(ductmodels.Element):
     ns = _phrase_choice_ns
     nsmap = {'phrase_choice': ns}
@@ -45,7 +55,7 @@ class PhraseChoiceLesson(ductmodels.DuctModel):
     groups = ductmodels.ArrayElement(ductmodels.ResourceElement(PhraseChoiceGroup))
 
     def legacy_ductmodel_conversion(self):
-        from ductus.modules.flashcards.ductmodels import FlashcardDeck, Flashcard, ChoiceInteraction, Phrase
+        from ductus.modules.flashcards.ductmodels import FlashcardDeck, ChoiceInteraction, Phrase
 
         fcd = FlashcardDeck()
 
@@ -65,7 +75,7 @@ class PhraseChoiceLesson(ductmodels.DuctModel):
                 answer = Phrase()
                 answer.phrase.text = element.answer.text
 
-                flashcard = Flashcard()
+                flashcard = _new_flashcard(self)
                 flashcard.sides.array.append(flashcard.sides.new_item())
                 flashcard.sides.array[0].store(prompt, False)
                 flashcard.sides.array.append(flashcard.sides.new_item())
@@ -110,7 +120,7 @@ class PictureChoiceLesson(ductmodels.DuctModel):
     groups = ductmodels.ArrayElement(ductmodels.ResourceElement(PictureChoiceGroup))
 
     def legacy_ductmodel_conversion(self):
-        from ductus.modules.flashcards.ductmodels import FlashcardDeck, Flashcard, ChoiceInteraction, Phrase
+        from ductus.modules.flashcards.ductmodels import FlashcardDeck, ChoiceInteraction, Phrase
 
         fcd = FlashcardDeck()
 
@@ -127,7 +137,7 @@ class PictureChoiceLesson(ductmodels.DuctModel):
                 phrase = Phrase()
                 phrase.phrase.text = element.phrase.text
 
-                flashcard = Flashcard()
+                flashcard = _new_flashcard(self)
                 for i in xrange(3):
                     flashcard.sides.array.append(flashcard.sides.new_item())
                 flashcard.sides.array[0].store(phrase, False)
@@ -14,6 +14,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from ductus.resource import get_resource_database
 from ductus.wiki.subviews import register_subview
 from ductus.modules.flashcards.ductmodels import Flashcard, FlashcardDeck, Phrase
 from django.core.cache import cache
@@ -26,12 +27,19 @@ def flashcard_subresources(resource):
 
 @register_subview(FlashcardDeck, 'subresources')
 def flashcard_deck_subresources(fcd):
+    from ductus.index import get_index_backend, get_links_many
+    resource_database = get_resource_database()
+    card_urns = set(fc.href for fc in fcd.cards if fc.href)
     s = set()
-    for fc in fcd.cards:
-        if not fc.href:
-            continue
-        #s.add(fc.href)
-        s.update(flashcard_subresources(fc.get()))
+    # a flashcard links only to its sides, so the index can give them all at
+    # once
+    if get_index_backend() is not None:
+        for urn, links in get_links_many(card_urns).items():
+            s.update(links)
+            card_urns.discard(urn)
+    for urn in card_urns:
+        sides = resource_database.get_resource_fields(urn, ('sides.href',))['sides.href']
+        s.update([href for href in sides if href])
     return s
 
 @register_subview(Phrase, 'as_html')
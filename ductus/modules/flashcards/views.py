@@ -20,6 +20,7 @@ import json
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 from django.utils.translation import ugettext_lazy, ugettext as _
+from django.utils.safestring import mark_safe
 from django.core.cache import cache
 from django.views.decorators.cache import never_cache
 from django.http import HttpResponse, Http404
@@ -28,11 +29,13 @@ from django.utils.six.moves import xrange
 
 from ductus.resource import get_resource_database
 from ductus.resource.ductmodels import tag_value_attribute_validator, ValidationError
+from ductus.resource.jsonize import iter_json, get_array_page
 from ductus.special.views import register_special_page
 from ductus.wiki.templatetags.jsonize import resource_json
 from ductus.wiki.models import WikiPage
 
-from ductus.index import search_pages, IndexingError
+from ductus.index import IndexingError
+from ductus.index.search_cache import cached_search_pages
 from ductus.wiki.decorators import register_creation_view, register_view, register_mediacache_view
 from ductus.wiki import get_writable_directories_for_user
 from ductus.wiki.views import handle_blueprint_post
@@ -138,6 +141,28 @@ flashcard_templates = {
     'storybook': storybook_flashcard_template,
 }
 
+def _flashcard_deck_editor_json(fcd):
+    """Returns the json the editor starts with.
+
+    Only the first page of cards is given in full; the others are given by
+    href, and the editor loads them as it needs them.
+    """
+    if fcd is None or not fcd.urn:
+        return resource_json(fcd)
+    json_dict = fcd.output_json_dict(depth=0)
+    if 'interactions' in json_dict:
+        json_dict['interactions'] = fcd.interactions.output_json_dict()
+    cards, next_cursor = get_array_page(fcd.cards, None, editor_page_size)
+    json_dict['cards'] = dict(json_dict['cards'],
+                              array=cards + json_dict['cards']['array'][len(cards):],
+                              next_cursor=next_cursor)
+    # (not iter_json() of the whole thing, which would give the cached json
+    # of the complete deck)
+    return mark_safe(u'{"href": %s, "resource": %s}' % (json.dumps(fcd.urn), u''.join(iter_json(json_dict))))
+
+# number of cards the editor loads at a time
+editor_page_size = 50
+
 @register_creation_view(FlashcardDeck, description=ugettext_lazy('a flexible lesson type arranged as a series of flashcards in a grid'), category='lesson')
 @register_view(FlashcardDeck, 'edit')
 def edit_flashcard_deck(request):
@@ -163,6 +188,7 @@ def edit_flashcard_deck(request):
     return render_to_response('flashcards/edit_flashcard_deck.html', {
         'writable_directories': get_writable_directories_for_user(request.user),
         'resource_or_template': resource_or_template,
+        'resource_json': _flashcard_deck_editor_json(resource_or_template),
         'available_audio_formats': available_audio_formats,
     }, RequestContext(request))
 
@@ -222,8 +248,10 @@ def storybook(request, interaction):
     }, RequestContext(request))
 
 def _get_audio_urns_in_column(flashcard_deck, column):
-    cells = [card.get().sides.array[column] for card in flashcard_deck.cards]
-    return [cell.href for cell in cells if cell.href]
+    resource_database = get_resource_database()
+    cells = [resource_database.get_resource_fields(card.href, ('sides.href',))['sides.href'][column]
+             for card in flashcard_deck.cards]
+    return [href for href in cells if href]
 
 @register_interaction_view(AudioLessonInteraction)
 def podcast(request, interaction):
@@ -284,21 +312,16 @@ def five_sec_widget(request, pagename):
         page = WikiPage.objects.get(name=url)
         revision = page.get_latest_revision()
         urn = 'urn:' + revision.urn
-        resource_database = get_resource_database()
-        old_fcd = resource_database.get_resource_object(urn)
-        fcd_bp = json.loads(resource_json(old_fcd))
-
-        # remove href and add a @patch statement so that the blueprint updates the database
-        fcd_bp['resource']['@patch'] = urn
-        del fcd_bp['href']
-
-        # set the flashcard href saved above
-        fcd_bp['resource']['cards']['array'][card_index]['href'] = new_fc_urn.urn
-        # remove all 'resource' keys in the blueprint as ResourceElement ignores the hrefs otherwise
-        for fc in fcd_bp['resource']['cards']['array']:
-            del fc['resource']
-        for interaction in fcd_bp['resource']['interactions']['array']:
-            del interaction['resource']
+
+        # patch the deck, replacing just the flashcard saved above
+        fcd_bp = {
+            'resource': {
+                '@patch': urn,
+                'cards': {
+                    '@ops': [{'op': 'replace', 'index': card_index, 'item': {'href': new_fc_urn.urn}}],
+                },
+            },
+        }
 
         request.POST = request.POST.copy()
         request.POST['blueprint'] = json.dumps(fcd_bp)
@@ -336,7 +359,7 @@ def fsw_get_flashcard(request, extra_tags, prompt_side, answer_side):
     language = request.GET.get('language', getattr(settings, "FIVE_SEC_WIDGET_DEFAULT_LANGUAGE", 'en'))
     search_tags = ['target-language:' + language] + extra_tags
     # get a list of pages tagged as we want
-    url_list = search_pages(tags=search_tags)
+    url_list = cached_search_pages(stale=True, tags=search_tags)
 
     if not url_list:
         raise Http404('No material available for this language')
@@ -24,21 +24,13 @@ from ductus.utils.tag_cloud import TagCloudElement, prepare_tag_cloud
 from ductus.utils.http import render_json_response
 
 def otics_front_page(request, pagename=None):
-    from ductus.index import get_indexing_mongo_database
-    indexing_db = get_indexing_mongo_database()
+    from ductus.index import get_index_backend
+    index = get_index_backend()
 
     languages = {}
-    if indexing_db is not None:
-        collection = indexing_db.urn_index
-        relevant_pages = collection.find({
-            "tags": {"$regex": "^target-language:"},
-            "current_wikipages": {"$not": {"$size": 0}},
-        }, {"tags": 1})
-        for page in relevant_pages:
-            for tag in page["tags"]:
-                if tag.startswith("target-language:"):
-                    lang_code = tag[len("target-language:"):]
-                    languages[lang_code] = languages.get(lang_code, 0) + 1
+    if index is not None:
+        for tag, count in six.iteritems(index.count_current_tags("target-language:")):
+            languages[tag[len("target-language:"):]] = count
 
     total_lesson_count = sum(a for a in languages.values())
     language_tag_cloud = []
@@ -16,8 +16,9 @@
 
 from django.conf import settings
 
-from ductus.resource import ductmodels, register_ductmodel
-from ductus.resource.ductmodels import ValidationError
+from ductus.index.fulltext import register_text_extractor, html_to_text, creole_to_text
+from ductus.resource import ductmodels, register_ductmodel, get_resource_database
+from ductus.resource.ductmodels import ValidationError, FieldPath
 from ductus.utils import create_property
 from genshi.filters import HTMLSanitizer
 from genshi.input import HTML
@@ -61,3 +62,14 @@ class Wikitext(ductmodels.DuctModel):
                 raise ValidationError(u'invalid html content')
 
         return super(Wikitext, self).save(encoding)
+
+@register_text_extractor(Wikitext)
+def _wikitext_text(root):
+    href, markup_language, natural_language = [FieldPath.get(Wikitext, path).read(root) for path in
+                                               ('blob.href', 'blob.markup_language', 'blob.natural_language')]
+    text = b''.join(get_resource_database().get_blob(href)).decode('utf-8')
+    if markup_language == 'ductus-html5':
+        text = html_to_text(text)
+    else:
+        text = creole_to_text(text)
+    return [(text, natural_language)]
@@ -144,7 +144,7 @@ def html5_pagelist_macro(macro_tag, fullpagesource):
 
     from lxml import etree
     from ductus.resource.ductmodels import tag_value_attribute_validator
-    from ductus.index import search_pages
+    from ductus.index.search_cache import cached_search_pages
 
     tags = macro_tag.get("data-tags", '')
 
@@ -156,7 +156,9 @@ def html5_pagelist_macro(macro_tag, fullpagesource):
         rv = etree.fromstring('<p>Invalid tag search</p>')
 
     try:
-        pages = search_pages(tags=parsed_tags)
+        # a page list may be a little out of date, so that popular pages
+        # need not wait for the search
+        pages = cached_search_pages(stale=True, tags=parsed_tags)
     except Exception:
         rv = etree.fromstring('<p>Search failed</p>')
 
@@ -208,7 +210,7 @@ def search_pages_macro(macro, environ, **kwargs):
     """
     from genshi import Markup
     from ductus.resource.ductmodels import tag_value_attribute_validator
-    from ductus.index import search_pages
+    from ductus.index.search_cache import cached_search_pages
 
     tags = kwargs.get("tags", '')
 
@@ -220,7 +222,9 @@ def search_pages_macro(macro, environ, **kwargs):
         return Markup('<p>Invalid tag search</p>')
 
     try:
-        pages = search_pages(tags=parsed_tags)
+        # a page list may be a little out of date, so that popular pages
+        # need not wait for the search
+        pages = cached_search_pages(stale=True, tags=parsed_tags)
     except Exception:
         return Markup('<p>Search failed</p>')
 
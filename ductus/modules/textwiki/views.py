@@ -73,22 +73,34 @@ new_textwiki = edit_textwiki
 
 # this should be in index/views.py
 from ductus.special.views import register_special_page
-from ductus.index import search_pages, IndexingError
+from ductus.index import IndexingError
+from ductus.index.search_cache import cached_search_pages
 from ductus.utils.http import query_string_not_found, render_json_response, HttpTextResponseBadRequest, ImmediateResponse
 from django.http import Http404
 
+SEARCH_PAGES_DEFAULT_LIMIT = getattr(settings, "DUCTUS_SEARCH_PAGES_DEFAULT_LIMIT", 50)
+SEARCH_PAGES_MAX_LIMIT = getattr(settings, "DUCTUS_SEARCH_PAGES_MAX_LIMIT", 500)
+
 @register_special_page('ajax/search-pages')
 def ajax_search_pages(request, pagename):
-    """return a JSON object containing the urls matching the query
-    in the request, such that:
-    TODO: document
+    """return a JSON list of the pages matching the query in the request,
+    sorted by page name, as returned by ``ductus.index.search_pages``.
+
+    The query may contain `pagename` (a string the page names must contain),
+    `prefix` (a string the page names must start with), any number of `tag`,
+    or `notags`.  It may also contain `text` (words the pages must contain,
+    in the optional `language`), in which case the best matches come first.
+    At most `limit` pages are returned (SEARCH_PAGES_MAX_LIMIT at most); to
+    get the next ones, repeat the query with `after` set to the
+    absolute_pagename of the last page returned (except for a text search).
     """
-    # TODO: limit the number of results returned
     if request.method != 'GET':
         raise ImmediateResponse(HttpTextResponseBadRequest('only GET is allowed'))
 
     params = {}
     params['pagename'] = request.GET.get('pagename', '')
+    if request.GET.get('prefix'):
+        params['pagename_prefix'] = request.GET['prefix']
     params['tags'] = request.GET.getlist('tag', '')
 
     # special search feature to report all pages without tags
@@ -96,6 +108,22 @@ def ajax_search_pages(request, pagename):
         params['notags'] = 1
         del params['tags']  # just to be extra sure
 
-    urls = search_pages(**params)
+    if request.GET.get('text'):
+        params['text'] = request.GET['text']
+        if request.GET.get('language'):
+            params['language'] = request.GET['language']
+
+    if request.GET.get('after'):
+        if 'text' in params:
+            raise ImmediateResponse(HttpTextResponseBadRequest('a text search cannot be continued with after'))
+        params['after'] = request.GET['after']
+    try:
+        params['limit'] = min(int(request.GET.get('limit', SEARCH_PAGES_DEFAULT_LIMIT)), SEARCH_PAGES_MAX_LIMIT)
+    except ValueError:
+        raise ImmediateResponse(HttpTextResponseBadRequest('limit must be a number'))
+    if params['limit'] < 1:
+        raise ImmediateResponse(HttpTextResponseBadRequest('limit must be positive'))
+
+    urls = cached_search_pages(**params)
 
     return render_json_response(urls)
@@ -17,13 +17,19 @@
 import base64
 import hashlib
 import itertools
+import logging
 import os
+import re
+import threading
+import time
+import weakref
 
 from lxml import etree
 
 from django.utils import six
+from django.utils.encoding import python_2_unicode_compatible
 
-from ductus.utils import iterator_to_tempfile, create_property, sequence_contains_only
+from ductus.utils import iterator_to_tempfile, create_property, LRUCache, SingleFlight
 
 hash_name = "sha384"
 hash_encode = base64.urlsafe_b64encode
@@ -31,6 +37,8 @@ hash_decode = base64.urlsafe_b64decode
 hash_algorithm = getattr(hashlib, hash_name)
 hash_digest_size = hash_algorithm().digest_size
 
+logger = logging.getLogger(__name__)
+
 max_urn_length = len('urn:%s:%s' % (hash_name, hash_encode(hash_algorithm(b'').digest()).decode("ascii")))
 
 class InvalidHeader(ValueError):
@@ -51,6 +59,138 @@ class UnsupportedURN(ValueError):
     def __repr__(self):
         return repr(self.value)
 
+@python_2_unicode_compatible
+class URN(object):
+    """A validated, interned resource identifier.
+
+    Stores the raw digest bytes and a small hash-type code instead of the
+    'urn:hash_type:hash_value' string.  Instances are immutable and
+    interned, so two live URN objects are equal exactly when they are the
+    same object.  For convenience a URN also compares and hashes equal to
+    its string form, so it can be used interchangeably with strings as a
+    dictionary key or in comparisons.
+
+    Use URN.parse() to validate a string once, at the edge of the system;
+    URN.parse() and URN.is_valid() also accept URN objects, in which case no
+    work is done.  unicode(urn) gives back the string form.  The last few
+    thousand URNs parsed are kept alive, so parsing one of them again only
+    takes a lookup.  URN.is_valid() checks a string without making a URN.
+    """
+
+    __slots__ = ('hash_type_code', 'digest', '_hash', '__weakref__')
+
+    hash_types = (hash_name,)
+    _hash_type_codes = dict((name, code) for code, name in enumerate(hash_types))
+    _interned = weakref.WeakValueDictionary()
+    _interned_text = weakref.WeakValueDictionary()
+    # most URN objects are dropped as soon as they are parsed, which would
+    # leave nothing in the weak tables above to be found next time
+    _recently_parsed = LRUCache(4096)
+
+    def __new__(cls, hash_type_code, digest, text=None):
+        key = (hash_type_code, digest)
+        try:
+            return cls._interned[key]
+        except KeyError:
+            pass
+        self = object.__new__(cls)
+        self.hash_type_code = hash_type_code
+        self.digest = digest
+        self._hash = hash(text or self._as_text())
+        return cls._interned.setdefault(key, self)
+
+    @classmethod
+    def from_digest(cls, digest, hash_type=hash_name):
+        """Returns the URN for a raw (binary) digest"""
+        try:
+            hash_type_code = cls._hash_type_codes[hash_type]
+        except KeyError:
+            raise UnsupportedURN(hash_type)
+        if len(digest) != hash_digest_size:
+            raise UnsupportedURN(digest)
+        return cls(hash_type_code, digest)
+
+    @classmethod
+    def parse(cls, urn):
+        """Validates a URN string, returning a URN object.
+
+        Raises UnsupportedURN if the string is not a URN we support.
+        """
+        if isinstance(urn, URN):
+            return urn
+        if not isinstance(urn, six.string_types):
+            raise UnsupportedURN(urn)
+
+        rv = cls._interned_text.get(urn)
+        if rv is not None:
+            return rv
+
+        match = cls._match(urn)
+        if match is None:
+            raise UnsupportedURN(urn)
+        hash_type, encoded_digest = match.groups()
+        digest = hash_decode(encoded_digest.encode("ascii"))
+
+        rv = cls(cls._hash_type_codes[hash_type], digest, urn)
+        cls._interned_text[urn] = rv
+        cls._recently_parsed.set(urn, rv)
+        return rv
+
+    @classmethod
+    def _match(cls, urn):
+        # a digest of the right length in base64 always decodes to the right
+        # number of bytes, so this is all the checking a string needs
+        match = _urn_re.match(urn)
+        if (match is None or match.group(1) not in cls._hash_type_codes
+                or len(match.group(2)) != _encoded_digest_length):
+            return None
+        return match
+
+    @classmethod
+    def is_valid(cls, urn):
+        if isinstance(urn, URN):
+            return True
+        return isinstance(urn, six.string_types) and cls._match(urn) is not None
+
+    @property
+    def hash_type(self):
+        return self.hash_types[self.hash_type_code]
+
+    @property
+    def encoded_digest(self):
+        return hash_encode(self.digest).decode("ascii")
+
+    def _as_text(self):
+        return u'urn:%s:%s' % (self.hash_type, self.encoded_digest)
+
+    def __str__(self):
+        return self._as_text()
+
+    def __repr__(self):
+        return 'URN(%r)' % self._as_text()
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if isinstance(other, URN):
+            return self is other
+        if isinstance(other, six.string_types):
+            return self._as_text() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        rv = self.__eq__(other)
+        if rv is NotImplemented:
+            return rv
+        return not rv
+
+    def __reduce__(self):
+        return (URN, (self.hash_type_code, self.digest))
+
+_urn_re = re.compile(r'urn:([A-Za-z0-9_-]+):([A-Za-z0-9_-]+)\Z')
+_encoded_digest_length = len(hash_encode(hash_algorithm(b'').digest()))
+
 def check_resource_size(data_iterator, max_resource_size):
     cumulative_size = 0
     while True:
@@ -96,6 +236,11 @@ class ResourceDatabase(object):
     * a simple framework for enforcing arbitrary, user-defined constraints on
       saved resources (e.g., check for acceptable license; check to ensure
       license compatibility with parents)
+
+    It may be used from several threads at once.  It keeps no state of its
+    own besides the (lock-protected) caches at the end of this module, each
+    thread parses XML with its own parser, and the storage backends make
+    each file appear all at once.
     """
 
     def __init__(self, storage_backend, max_resource_size=(20*1024*1024)):
@@ -116,27 +261,13 @@ class ResourceDatabase(object):
         return locals()
 
     def __contains__(self, key):
+        if isinstance(key, URN):
+            key = unicode(key)
         return key in self.storage_backend
 
     @staticmethod
     def is_valid_urn(key):
-        if not isinstance(key, six.string_types):
-            return False
-
-        try:
-            urn_str, hash_type, digest = key.split(':')
-        except ValueError:
-            return False
-
-        if not (urn_str == 'urn' and hash_type == hash_name):
-            return False
-
-        try:
-            decoded = hash_decode(digest.encode("ascii"))
-        except (TypeError, UnicodeEncodeError):
-            return False
-        else:
-            return bool(len(decoded) == hash_digest_size)
+        return URN.is_valid(key)
 
     def store(self, data_iterator, urn=None):
         """data_iterator is an iterator that returns all data.
@@ -154,8 +285,7 @@ class ResourceDatabase(object):
         tmpfile = iterator_to_tempfile(data_iterator)
 
         try:
-            digest = hash_encode(hash_obj.digest()).decode("ascii")
-            urn = "urn:%s:%s" % (hash_name, digest)
+            urn = unicode(URN.from_digest(hash_obj.digest()))
             if intended_urn and intended_urn != urn:
                 raise "URN given does not match content." # valueerror
 
@@ -186,7 +316,7 @@ class ResourceDatabase(object):
     def __check_xml(self, urn, filename):
         with file(filename, 'rb') as f:
             f.read(len(b'xml\0'))
-            tree = etree.parse(f)
+            tree = etree.parse(f, get_xml_parser())
 
         # Make sure we recognize the root node and the document is valid
         # fixme: combine below lines with get_resource_object function
@@ -229,41 +359,253 @@ class ResourceDatabase(object):
     def get_xml(self, urn):
         # as a stopgap measure, look in cache for the xml data
         from ductus.utils.cache import cache_compressed
-        cache_key = "xml-urn:" + urn
-        cached_resource = cache_compressed.get(cache_key)
+        urn = unicode(urn)
+        cached_resource = cache_compressed.get("xml-urn:" + urn)
         if cached_resource is not None:
             return iter([cached_resource])
 
-        header, data_iterator = determine_header(self[urn], False)
-        if header != 'xml':
-            raise UnexpectedHeader("Expecting 'xml', but received '%s'" % header)
-
-        # as a stopgap measure (see above), cache the xml data
-        data = b''.join(data_iterator)
-        cache_compressed.set(cache_key, data)
+        # when a popular resource falls out of the cache, many requests want
+        # it at once.  only one thread per process loads it; the others wait
+        # for its data
+        data = _xml_loads.do(urn, lambda: self.__load_xml(urn))
         return iter([data])
 
+    def __load_xml(self, urn):
+        from django.conf import settings
+        from ductus.utils.cache import cache, cache_compressed
+        cache_key = "xml-urn:" + urn
+
+        # other processes can be asked to wait too, for at most this many
+        # seconds, until the process holding the lock has cached the data
+        lock_timeout = getattr(settings, "DUCTUS_RESOURCE_LOAD_LOCK_TIMEOUT", 0)
+        lock_key = "xml-urn-lock:" + urn
+        have_lock = False
+        if lock_timeout:
+            have_lock = cache.add(lock_key, 1, lock_timeout)
+            if not have_lock:
+                deadline = time.time() + lock_timeout
+                while time.time() < deadline:
+                    time.sleep(0.05)
+                    data = cache_compressed.get(cache_key)
+                    if data is not None:
+                        return data
+                    if cache.get(lock_key) is None:
+                        # it failed (e.g. it is a blob)
+                        break
+                # otherwise, load it ourselves
+
+        try:
+            header, data_iterator = determine_header(self[urn], False)
+            if header != 'xml':
+                raise UnexpectedHeader("Expecting 'xml', but received '%s'" % header)
+
+            # as a stopgap measure (see above), cache the xml data
+            data = b''.join(data_iterator)
+            cache_compressed.set(cache_key, data)
+            return data
+        finally:
+            if have_lock:
+                cache.delete(lock_key)
+
     def get_xml_tree(self, urn):
         from cStringIO import StringIO
         # following line could be simplified if the data_iterator had
         # a "read" method instead ...
-        return etree.parse(StringIO(''.join(self.get_xml(urn))))
+        return etree.parse(StringIO(''.join(self.get_xml(urn))), get_xml_parser())
 
     def get_resource_object(self, urn):
+        # concurrent loads of the same resource share its data (see
+        # get_xml), but each gets its own object.  a saved resource shares
+        # its subelements with its clones until they use them (see
+        # Element.clone), so an object must not be used from more than one
+        # thread
         tree = self.get_xml_tree(urn) # fixme: what exceptions can this throw?
         root = tree.getroot()
         model_class = _registered_ductmodels[root.tag] # fixme: may raise KeyError
+        if hasattr(model_class, "legacy_ductmodel_conversion"):
+            converted_urn = self.get_converted_urn(urn)
+            if converted_urn is not None:
+                return self.get_resource_object(converted_urn)
+        return self.__convert_resource(self.__build_resource(urn, model_class, root), urn)
+
+    def __build_resource(self, urn, model_class, root):
         resource = model_class()
         resource.urn = urn
-        resource.resource_database = self
         resource.populate_from_xml(root)
         resource.validate(strict=False)
+        return resource
+
+    @staticmethod
+    def __convert_resource(resource, urn):
         while hasattr(resource, "legacy_ductmodel_conversion"):
             resource = resource.legacy_ductmodel_conversion()
             resource.urn = urn
-            resource.resource_database = self
         return resource
 
+    def get_converted_urn(self, urn):
+        """Returns the urn of the resource that the legacy resource at `urn`
+        has been converted to, or None if it has not been
+
+        This only looks the conversion up (see ductus.models.LegacyConversion);
+        conversions are saved by convert_legacy_resource(), which the
+        convert_legacy_resources command calls.  Until then,
+        get_resource_object() converts the legacy resource on each load.
+        """
+        from ductus.utils.cache import cache
+        from ductus.models import LegacyConversion
+        urn = unicode(urn)
+        converted_urn = _legacy_conversion_cache.get(urn)
+        if converted_urn is not None:
+            return converted_urn
+
+        cache_key = "legacy-conversion:" + urn
+        converted_urn = cache.get(cache_key)
+        if converted_urn is None:
+            try:
+                converted_urn = LegacyConversion.objects.get(legacy_urn=urn).converted_urn
+            except LegacyConversion.DoesNotExist:
+                # it may be converted later, so don't remember this for long
+                converted_urn = u''
+                cache.set(cache_key, converted_urn, 5 * 60)
+            else:
+                cache.set(cache_key, converted_urn)
+        if not converted_urn:
+            return None
+        _legacy_conversion_cache.set(urn, converted_urn)
+        return converted_urn
+
+    def convert_legacy_resource(self, urn, root=None):
+        """Converts the legacy resource at `urn`, saves the result, and records
+        it so that get_converted_urn() finds it.  Returns the urn of the
+        converted resource, or None if it could not be saved.
+        """
+        from ductus.utils.cache import cache
+        from ductus.models import LegacyConversion
+        urn = unicode(urn)
+        converted_urn = self.get_converted_urn(urn)
+        if converted_urn is not None:
+            return converted_urn
+        converted_urn = self.__save_conversion(urn, root)
+        if converted_urn is None:
+            return None
+        # if another process got there first, its conversion is the same
+        # resource, since conversion does not depend on when it is done
+        conversion, created = LegacyConversion.objects.get_or_create(legacy_urn=urn, defaults={
+            'converted_urn': converted_urn,
+        })
+        cache.set("legacy-conversion:" + urn, conversion.converted_urn)
+        return conversion.converted_urn
+
+    def __save_conversion(self, urn, root):
+        from ductus.resource.ductmodels import save_unsaved_resources
+        if root is None:
+            root = self.get_xml_tree(urn).getroot()
+        model_class = _registered_ductmodels[root.tag]
+        resource = self.__convert_resource(self.__build_resource(urn, model_class, root), urn)
+        resource.urn = None
+        try:
+            save_unsaved_resources(resource)
+            return resource.save()
+        except Exception:
+            logger.warning("Could not save the conversion of legacy resource %s", urn, exc_info=True)
+            return None
+
+    def get_resource_metadata(self, urn):
+        """Returns a few facts about a resource without building its ductmodel
+
+        The returned dict has these keys:
+
+        * 'fqn': fully-qualified name of the resource's (converted) ductmodel
+
+        * 'licenses': list of license hrefs in its DuctusCommonElement
+
+        * 'array_sizes': dict giving the number of items in each top-level
+          ArrayElement, keyed by subelement name
+
+        This is enough for strict validation to check links to other
+        resources.  Since resources are immutable, the result is kept in the
+        Django cache and in a small in-process cache.
+        """
+        from ductus.utils.cache import cache
+        urn = unicode(urn)
+        metadata = _resource_metadata_cache.get(urn)
+        if metadata is not None:
+            return metadata
+
+        cache_key = "resource-metadata:" + urn
+        metadata = cache.get(cache_key)
+        if metadata is None:
+            metadata = self.__read_resource_metadata(urn)
+            cache.set(cache_key, metadata)
+        _resource_metadata_cache.set(urn, metadata)
+        return metadata
+
+    def get_resource_fields(self, urn, paths):
+        """Returns a dict giving the value of each field in `paths` (see
+        ductus.resource.ductmodels.FieldPath), without building the resource
+
+        The XML is parsed incrementally, and parsing stops as soon as every
+        requested field has been read.  Values are cached per urn, so they
+        must not be modified by the caller.
+        """
+        from ductus.utils.cache import cache
+        urn = unicode(urn)
+        cache_key = "resource-fields:" + urn
+        fields = _resource_fields_cache.get(urn)
+        if fields is None:
+            fields = cache.get(cache_key) or {}
+        missing_paths = [path for path in paths if path not in fields]
+        if missing_paths:
+            fields = dict(fields)
+            fields.update(self.__read_resource_fields(urn, missing_paths))
+            cache.set(cache_key, fields)
+        _resource_fields_cache.set(urn, fields)
+        return dict((path, fields[path]) for path in paths)
+
+    def __read_resource_fields(self, urn, paths):
+        from cStringIO import StringIO
+        from ductus.resource.ductmodels import FieldPath
+        rv = read_resource_fields(StringIO(b''.join(self.get_xml(urn))), paths)
+        if rv is None:
+            resource = self.get_resource_object(urn)
+            rv = dict((path, FieldPath.get(type(resource), path).get_from_object(resource))
+                      for path in paths)
+        return rv
+
+    def __read_resource_metadata(self, urn):
+        from ductus.resource.ductmodels import ArrayElement, DuctusCommonElement, LinkElement
+        root = self.get_xml_tree(urn).getroot()
+        model_class = _registered_ductmodels.get(root.tag)
+        array_names = ()
+        if model_class is not None:
+            if hasattr(model_class, "legacy_ductmodel_conversion"):
+                # the stored xml does not describe the model we actually
+                # present, so there is nothing to do but load it
+                return _resource_metadata_from_object(self.get_resource_object(urn))
+            array_names = [name for name, subelement in model_class.subelements.items()
+                           if isinstance(subelement, ArrayElement)]
+
+        # only the top two levels of the tree are looked at; the items
+        # themselves are never turned into elements
+        array_sizes = dict.fromkeys(array_names, 0) # empty arrays may be omitted
+        licenses = []
+        common_tag = '{%s}common' % DuctusCommonElement.ns
+        licenses_tag = '{%s}licenses' % DuctusCommonElement.ns
+        href_fqn = LinkElement.attributes['href'].fqn
+        for child in root:
+            if child.tag == common_tag:
+                for license in child.iterchildren(licenses_tag):
+                    licenses.extend(item.get(href_fqn) for item in license)
+            else:
+                name = etree.QName(child).localname
+                if name in array_names:
+                    array_sizes[str(name)] = len(child)
+        return {
+            'fqn': root.tag,
+            'licenses': licenses,
+            'array_sizes': array_sizes,
+        }
+
     def keys(self):
         return self.storage_backend.keys()
 
@@ -271,9 +613,65 @@ class ResourceDatabase(object):
         return self.storage_backend.iterkeys()
 
     def __getitem__(self, key):
-        if not self.is_valid_urn(key):
+        try:
+            key = URN.parse(key)
+        except UnsupportedURN:
             raise KeyError('invalid urn: {0}'.format(repr(key)))
-        return self.storage_backend[key]
+        return self.storage_backend[unicode(key)]
+
+def read_resource_fields(xml_file, paths):
+    """Reads the fields in `paths` from the XML of a resource, stopping as
+    soon as they have all been read.  See ResourceDatabase.get_resource_fields
+
+    Returns None if the resource is of a legacy type, in which case the
+    fields can only be read from the converted resource.
+    """
+    from ductus.resource.ductmodels import FieldPath
+    context = etree.iterparse(xml_file, events=('start', 'end'))
+    event, root = six.next(context)
+    model_class = _registered_ductmodels[root.tag] # fixme: may raise KeyError
+    if hasattr(model_class, "legacy_ductmodel_conversion"):
+        return None
+
+    rv = {}
+    field_paths_by_tag = {}
+    for path in paths:
+        field_path = FieldPath.get(model_class, path)
+        if field_path.toplevel_fqn is None:
+            # an attribute of the root element, which we have already
+            rv[path] = field_path.read(root)
+        else:
+            field_paths_by_tag.setdefault(field_path.toplevel_fqn, []).append(field_path)
+
+    depth = 1
+    for event, element in context:
+        if not field_paths_by_tag:
+            break
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            # a child of the root element is complete
+            for field_path in field_paths_by_tag.pop(element.tag, ()):
+                rv[field_path.path] = field_path.read_toplevel(element)
+            element.clear()
+
+    # whatever is left is not in the resource at all
+    for field_paths in field_paths_by_tag.values():
+        for field_path in field_paths:
+            rv[field_path.path] = field_path.read_toplevel(None)
+    return rv
+
+_thread_local = threading.local()
+
+def get_xml_parser():
+    """Returns an lxml parser for use by the current thread only"""
+    try:
+        return _thread_local.xml_parser
+    except AttributeError:
+        parser = _thread_local.xml_parser = etree.XMLParser()
+        return parser
 
 def determine_header(data_iterator, replace_header=True):
     buf = bytes()
@@ -316,14 +714,30 @@ def register_ductmodel(model):
 
 _registered_ductmodels = {}
 
+def _resource_metadata_from_object(resource):
+    "See ResourceDatabase.get_resource_metadata"
+    from ductus.resource.ductmodels import ArrayElement
+    common = getattr(resource, 'common', None)
+    return {
+        'fqn': resource.fqn,
+        'licenses': [license.href for license in common.licenses] if common else [],
+        'array_sizes': dict((name, len(getattr(resource, name)))
+                            for name, subelement in resource.subelements.items()
+                            if isinstance(subelement, ArrayElement)),
+    }
+
+_resource_metadata_cache = LRUCache(4096)
+_resource_fields_cache = LRUCache(4096)
+_legacy_conversion_cache = LRUCache(4096)
+
+# loads currently in progress, keyed by urn
+_xml_loads = SingleFlight()
+
 def get_resource_database():
     return _resource_database
 
 _resource_database = None
 
-__b64_chrs = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
-__contains_only_base64_chrs = sequence_contains_only(__b64_chrs)
-
 def split_urn(urn):
     """Checks to make sure it is a URN we could possibly support
 
@@ -333,19 +747,14 @@ def split_urn(urn):
     Returns (hash_type, digest) as a tuple.
     """
 
-    if not isinstance(urn, six.string_types):
-        raise UnsupportedURN(urn)
+    if isinstance(urn, URN):
+        return urn.hash_type, urn.encoded_digest
 
-    urn_split = urn.split(':')
-    if len(urn_split) != 3:
+    if not isinstance(urn, six.string_types):
         raise UnsupportedURN(urn)
 
-    urn_str, hash_type, digest = urn_split
-    if not (urn_str == 'urn'
-            and hash_type != ''
-            and digest != ''
-            and __contains_only_base64_chrs(hash_type)
-            and __contains_only_base64_chrs(digest)):
+    match = _urn_re.match(urn)
+    if match is None:
         raise UnsupportedURN(urn)
 
-    return hash_type, digest
+    return match.groups()
@@ -17,7 +17,12 @@
 import re
 import copy
 import datetime
-from itertools import chain
+import hashlib
+import json
+import threading
+from functools import partial
+from itertools import chain, count
+from multiprocessing.pool import ThreadPool
 
 from lxml import etree
 
@@ -28,7 +33,8 @@ from django.utils import six
 
 from ductus.license import is_license_compatibility_satisfied
 from ductus.utils import create_property, is_punctuation
-from ductus.resource import register_ductmodel, get_resource_database, _registered_ductmodels
+from ductus.resource import register_ductmodel, get_resource_database, _registered_ductmodels, _resource_metadata_from_object
+from ductus.resource.jsonize import get_resource_json_dict
 
 # fixme: we could just not "follow" parents instead of excluding them.  If we
 # change it to work this way, the browser will be aware of the parents in case
@@ -64,53 +70,75 @@ def camelcase_to_underscores(v):
     # re lifted from django.db.models.options
     return re.sub('(((?<=[a-z])[A-Z])|([A-Z](?![A-Z]|$)))', ' \\1', v).lower().strip().replace(' ', '_')
 
-def oldest_ancestor(x):
-    while True:
-        x, y = getattr(x, "_parent", None), x
-        if x is None:
-            return y
-
 def _is_element(obj):
     "This function gets overwritten below once Element is defined"
     return False
 
 class ElementMetaclass(type):
-    def __init__(cls, name, bases, attrs):
+    """Sets up attributes and subelements, and gives each class `__slots__`
+
+    Each attribute value is kept in a slot named "_attr_<name>", behind a
+    property that validates on assignment.  Each subelement is kept in a slot
+    of its own name, which is left empty until the subelement is first
+    accessed; at that point Element.__getattr__ fills it in with a clone of
+    the subelement prototype.  Classes never get a `__dict__`, so elements
+    must not be given any attributes other than these.
+
+    Subelement slots, along with any slots named in `_shared_slots`, may be
+    left empty until needed, and may be shared between an element that is
+    never modified and its clones (see Element.clone).  All other slots must
+    always be set, normally by __init__.
+    """
+
+    def __new__(mcs, name, bases, attrs):
         if name == "NewBase":
-            # do nothing, since this is an object generated by
-            # six.with_metaclass()
-            return
+            # this is an object generated by six.with_metaclass(); it must
+            # not add a __dict__ to the classes deriving from it
+            attrs['__slots__'] = ()
+            return super(ElementMetaclass, mcs).__new__(mcs, name, bases, attrs)
+
+        attributes = dict(a for a in attrs.items() if isinstance(a[1], Attribute))
+        subelements = [s for s in attrs.items() if _is_element(s[1])]
+        subelements.sort(key=lambda s: s[1].creation_counter)
+        subelements = SortedDict(subelements)
+        for subelement in subelements:
+            # the slot takes the place of the prototype in the class
+            del attrs[subelement]
+
+        slots = list(attrs.get('__slots__', ()))
+        slots.extend('_attr_' + a for a in attributes)
+        slots.extend(subelements)
+        attrs['__slots__'] = tuple(slots)
+        cls = super(ElementMetaclass, mcs).__new__(mcs, name, bases, attrs)
 
         # Set up attributes
-        def attribute_property(name, obj):
+        def attribute_property(slot, obj):
             def fget(s):
-                return s._attribute_data[name]
+                return slot.__get__(s, None)
             def fset(s, v):
                 if not isinstance(v, six.string_types):
                     raise ValidationError
                 obj.validate(v)
-                s._attribute_data[name] = v
+                slot.__set__(s, v)
             if obj.optional:
                 def fdel(s):
-                    s._attribute_data[name] = None
+                    slot.__set__(s, None)
             else:
                 fdel = None
             return property(fget, fset, fdel, obj.__doc__)
-        attributes = dict(a for a in attrs.items() if isinstance(a[1], Attribute))
-        for a, o in attributes.items():
-            setattr(cls, a, attribute_property(a, o))
         cls.attributes = {}
+        cls._attribute_slots = {}
         for base in reversed(bases):
             if hasattr(base, "attributes"):
                 cls.attributes.update(base.attributes)
+                cls._attribute_slots.update(base._attribute_slots)
+        for a, o in attributes.items():
+            slot = getattr(cls, '_attr_' + a)
+            setattr(cls, a, attribute_property(slot, o))
+            cls._attribute_slots[a] = slot
         cls.attributes.update(attributes)
 
         # Set up subelements
-        subelements = [s for s in attrs.items() if _is_element(s[1])]
-        subelements.sort(key=lambda s: s[1].creation_counter)
-        subelements = SortedDict(subelements)
-        for subelement in subelements:
-            delattr(cls, subelement)
         cls.subelements = SortedDict()
         for base in reversed(bases):
             if hasattr(base, "subelements"):
@@ -118,22 +146,26 @@ class ElementMetaclass(type):
         cls.subelements.update(subelements)
 
         # Precalculate a few things
-        cls._required_attributes = {
-            name_
-            for name_, attribute in six.iteritems(cls.attributes)
-            if not getattr(attribute, "optional", False)
-        }
-        cls._required_subelements = {
-            name_
-            for name_, subelement in six.iteritems(cls.subelements)
-            if not getattr(subelement, "optional", False)
-        }
-        cls._attributes_by_fqn = {
-            (attribute.fqn or name_): name_
+        cls._xml_plans = {}
+        cls._attribute_defaults = tuple(
+            (cls._attribute_slots[name_], None if attribute.optional else "")
             for name_, attribute in six.iteritems(cls.attributes)
-        }
-
-        super(ElementMetaclass, cls).__init__(name, bases, attrs)
+        )
+        cls._shareable_slots = dict(
+            (name_, getattr(cls, name_))
+            for name_ in chain(cls.subelements, cls._shared_slots)
+        )
+        cls._cloned_shareable_slots = tuple(
+            (name_, slot) for name_, slot in six.iteritems(cls._shareable_slots)
+            if name_ not in cls._reset_on_clone
+        )
+        all_slots = set(chain.from_iterable(getattr(c, '__slots__', ())
+                                            for c in cls.__mro__))
+        all_slots.discard('_borrowed')
+        cls._copied_slots = tuple(getattr(cls, slot) for slot in sorted(all_slots)
+                                  if slot not in cls._shareable_slots)
+
+        return cls
 
 class NoChildElementMetaclass(ElementMetaclass):
     "Forbids subelements (but allows attributes)"
@@ -181,6 +213,63 @@ class DuctModelMetaclass(ElementMetaclass):
         nsmap[None] = cls.ns
         cls.nsmap = nsmap
 
+        # Prepare the XML plans of the model and everything it can contain,
+        # so we don't have to do it while loading resources
+        prepared = set()
+        def prepare_xml_plans(element_class, ns):
+            if (element_class, ns) in prepared:
+                return
+            prepared.add((element_class, ns))
+            plan = element_class._get_xml_plan(ns)
+            for name, fqn, local_ns, shared in plan.subelement_output:
+                subelement = element_class.subelements[name]
+                prepare_xml_plans(subelement.__class__, local_ns)
+                if isinstance(subelement, ArrayElement):
+                    prepare_xml_plans(subelement.item_prototype.__class__, local_ns)
+        prepare_xml_plans(cls, cls.ns)
+
+class _XMLPlan(object):
+    """Precalculated information for reading and writing the XML of an element
+    class, in a given namespace context
+
+    Subelements and attributes are each given a bit, so the checks for
+    uniqueness and for missing tags/attributes can use integer masks.  The
+    output lists are in the same order that has always been used to write
+    the XML, since any change would change the urn of a resource.
+    """
+
+    __slots__ = ('subelement_output', 'subelements_by_tag', 'required_subelements',
+                 'attribute_output', 'attributes_by_fqn', 'required_attributes')
+
+    def __init__(self, element_class, ns):
+        self.subelement_output = []
+        self.subelements_by_tag = {}
+        self.required_subelements = 0
+        for bit, (name, subelement) in enumerate(six.iteritems(element_class.subelements)):
+            local_ns = subelement.ns or ns
+            fqn = subelement.fqn or "{%s}%s" % (local_ns, name)
+            self.subelement_output.append((name, fqn, local_ns, subelement._shared_by_clones))
+            self.subelements_by_tag[fqn] = (name, 1 << bit, local_ns)
+            if not getattr(subelement, "optional", False):
+                self.required_subelements |= 1 << bit
+
+        self.attribute_output = []
+        self.attributes_by_fqn = {}
+        self.required_attributes = 0
+        for bit, (name, attribute) in enumerate(six.iteritems(element_class.attributes)):
+            slot = element_class._attribute_slots[name]
+            fqn = attribute.fqn or name
+            omit_if_blank = attribute.optional and attribute.blank_is_null
+            self.attribute_output.append((slot, fqn, omit_if_blank))
+            self.attributes_by_fqn[fqn] = (slot, attribute, 1 << bit)
+            if not attribute.optional:
+                self.required_attributes |= 1 << bit
+
+    @staticmethod
+    def missing(names, required, used):
+        missing = required & ~used
+        return [name for bit, name in enumerate(names) if missing & (1 << bit)]
+
 class Attribute(object):
     def __init__(self, optional=False, validator=None, fqn=None, blank_is_null=True):
         self.optional = optional
@@ -192,42 +281,146 @@ class Attribute(object):
         if self.validator:
             self.validator(v)
 
+# Clones keep the creation_counter of the element they were cloned from, so
+# it identifies the prototype an element descends from.
+_creation_counter = count()
+
 class Element(six.with_metaclass(ElementMetaclass, object)):
-    creation_counter = 0
+    __slots__ = ('creation_counter', '_borrowed', '_digest')
+
     fqn = None
     ns = None
 
+    # slots (other than subelements) that are filled in when first needed,
+    # and that clones may share
+    _shared_slots = ()
+
+    # subelements that a clone does not copy, getting a fresh one from the
+    # prototype instead
+    _reset_on_clone = ()
+
+    # False if clone() gives something that is not equal to the original, or
+    # if writing the element out may change it, in which case it is never
+    # read from its prototype or shared with a clone
+    _shared_by_clones = True
+
     def __init__(self):
-        self._attribute_data = dict((a, None if o.optional else "") for a, o in self.attributes.items())
-        for name, subelement in self.subelements.items():
-            setattr(self, name, subelement.clone())
-        self.creation_counter = Element.creation_counter
-        Element.creation_counter += 1
+        for slot, default in self._attribute_defaults:
+            slot.__set__(self, default)
+        self.creation_counter = next(_creation_counter)
+        self._borrowed = None
+        self._digest = None
+
+    def __getattr__(self, name):
+        # only called when a slot is empty.  for a subelement this means it has
+        # either not been needed yet, or it is shared with the element we were
+        # cloned from (in which case it never changes).  either way we make
+        # our own copy before anybody can modify it
+        borrowed = _borrowed_slot.__get__(self, None)
+        if borrowed and name in borrowed:
+            value = self._copy_shared_value(name, borrowed.pop(name), True)
+        else:
+            value = self._copy_shared_value(name, self._prototype_value(name))
+        setattr(self, name, value)
+        return value
 
-    def clone(self):
-        clone = copy.copy(self)
-        clone._attribute_data = dict(self._attribute_data)
-        for name in self.subelements:
-            setattr(clone, name, getattr(self, name).clone())
-        clone._parent = self
+    def _prototype_value(self, name):
+        try:
+            return self.subelements[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def _copy_shared_value(self, name, value, frozen=False):
+        return value.clone(frozen)
+
+    def _peek(self, name):
+        """Returns the value of a subelement (or other shareable slot) without
+        making a private copy of it
+
+        The returned object may be shared with other elements or be a
+        prototype, so it must not be modified.
+        """
+        try:
+            return self._shareable_slots[name].__get__(self, None)
+        except AttributeError:
+            pass
+        borrowed = _borrowed_slot.__get__(self, None)
+        if borrowed and name in borrowed:
+            return borrowed[name]
+        return self._prototype_value(name)
+
+    def _is_frozen(self):
+        "True if the element will never be modified (see get_digest)"
+        return self._digest is not None
+
+    def clone(self, frozen=False):
+        """Returns a copy of the element
+
+        Subelements that have not been needed yet are left for the clone to
+        fill in from the prototype when it needs them.
+
+        If the element will never be modified (`frozen` is true, or
+        _is_frozen() says so), the clone shares the other subelements with
+        it, and makes its own copy of each only when it first accesses it.
+        Until then, the shared object is kept in the clone's `_borrowed`
+        rather than in its slot.
+
+        Otherwise they are copied now, so that changing them through
+        references taken before or after the clone was made affects only the
+        element they belong to.
+        """
+        frozen = frozen or self._is_frozen()
+        cls = type(self)
+        clone = cls.__new__(cls)
+        for slot in self._copied_slots:
+            slot.__set__(clone, slot.__get__(self, None))
+        # the clone may be modified, so it must not keep a digest
+        clone._digest = None
+        # whatever we borrowed never changes, so the clone may borrow it too
+        borrowed = _borrowed_slot.__get__(self, None)
+        if borrowed:
+            borrowed = dict((name, value) for name, value in six.iteritems(borrowed)
+                            if name not in self._reset_on_clone)
+        for name, slot in self._cloned_shareable_slots:
+            try:
+                value = slot.__get__(self, None)
+            except AttributeError:
+                continue
+            if type(value) is list and not value:
+                # an empty array is cheaper to recreate than to share
+                continue
+            if frozen and getattr(value, '_shared_by_clones', True):
+                if not borrowed:
+                    borrowed = {}
+                borrowed[name] = value
+            else:
+                slot.__set__(clone, self._copy_shared_value(name, value, frozen))
+        clone._borrowed = borrowed or None
         return clone
 
-    def output_json_dict(self, exclude=()):
+    def output_json_dict(self, exclude=(), depth=None):
+        """Returns a dict representing the element, for use as json
+
+        Linked resources are included up to `depth` links away (all of them
+        if `depth` is None); beyond that, only their href is given.
+        """
         rv = {}
         # figure out how we are going to override things
         # what the heck did i mean by override things?
         # we should probably just output the blank string for null attributes, output null elements, etc
         for name, subelement in self.subelements.items():
+            obj = self._peek(name)
             # fixme: should we really be testing is_null_xml_element here?
-            if not getattr(self, name).is_null_xml_element():
+            if not obj.is_null_xml_element():
                 if name in exclude:
                     assert name == 'parents'
-                    rv['parents'] = [r.href for r in self.parents.array]
+                    rv['parents'] = [r.href for r in obj.array]
                 else:
-                    rv[name] = getattr(self, name).output_json_dict()
+                    rv[name] = obj.output_json_dict(depth=depth)
         for name, attribute in self.attributes.items():
-            if not (attribute.optional and attribute.blank_is_null and not self._attribute_data[name]):
-                rv[name] = self._attribute_data[name]
+            value = getattr(self, name)
+            if not (attribute.optional and attribute.blank_is_null and not value):
+                rv[name] = value
         return rv
 
     def patch_from_blueprint(self, blueprint, save_context):
@@ -248,17 +441,27 @@ class Element(six.with_metaclass(ElementMetaclass, object)):
             subelement = getattr(self, subelement_name)
             subelement.patch_from_blueprint(blueprint[subelement_name], save_context)
 
+    @classmethod
+    def _get_xml_plan(cls, ns):
+        try:
+            return cls._xml_plans[ns]
+        except KeyError:
+            plan = cls._xml_plans[ns] = _XMLPlan(cls, ns)
+            return plan
+
     def populate_xml_element(self, element, ns):
-        for name, subelement in self.subelements.items():
-            if not getattr(self, name).is_null_xml_element():
-                local_ns = subelement.ns or ns
-                fqn = subelement.fqn or "{%s}%s" % (local_ns, name)
-                xml_subelement = etree.SubElement(element, fqn)
-                getattr(self, name).populate_xml_element(xml_subelement, local_ns)
-        for name, attribute in self.attributes.items():
-            fqn = attribute.fqn or name
-            if not (attribute.optional and attribute.blank_is_null and not self._attribute_data[name]):
-                element.set(fqn, self._attribute_data[name])
+        plan = self._xml_plans.get(ns) or self._get_xml_plan(ns)
+        SubElement = etree.SubElement
+        for name, fqn, local_ns, shared in plan.subelement_output:
+            # writing the xml does not normally modify the subelement, so
+            # there's no need to make a private copy of it
+            subelement = self._peek(name) if shared else getattr(self, name)
+            if not subelement.is_null_xml_element():
+                subelement.populate_xml_element(SubElement(element, fqn), local_ns)
+        for slot, fqn, omit_if_blank in plan.attribute_output:
+            value = slot.__get__(self, None)
+            if value or not omit_if_blank:
+                element.set(fqn, value)
 
     def is_null_xml_element(self):
         return False
@@ -267,48 +470,50 @@ class Element(six.with_metaclass(ElementMetaclass, object)):
         if ns is None:
             # we must be a DuctModel
             ns = self.ns
-        self._populate_subelements_from_xml(xml_node, ns)
+        if self.subelements or len(xml_node):
+            self._populate_subelements_from_xml(xml_node, ns)
         self._populate_attributes_from_xml(xml_node, ns)
 
     def _populate_subelements_from_xml(self, xml_node, ns):
-        used_tags = set()
+        plan = self._xml_plans.get(ns) or self._get_xml_plan(ns)
+        subelements_by_tag = plan.subelements_by_tag
+        used = 0
         for child in xml_node:
-            subelement_name = child.tag.partition('}')[2]  # remove the ns prefix
             try:
-                global_subelement = self.subelements[subelement_name]
-                fqn = global_subelement.fqn or "{%s}%s" % (global_subelement.ns or ns, subelement_name)
-                if fqn != child.tag:
-                    raise KeyError
+                name, bit, local_ns = subelements_by_tag[child.tag]
             except KeyError:
                 raise Exception("Unrecognized tag")
-            if subelement_name in used_tags:
+            if used & bit:
                 raise Exception("Each tag must be unique")
-            used_tags.add(subelement_name)
-            subelement = getattr(self, subelement_name)
-            subelement.populate_from_xml(child, subelement.ns or ns)
-        missing_tags = self._required_subelements.difference(used_tags)
-        if missing_tags:
-            raise Exception("Missing tag(s)! %s" % tuple(missing_tags))
+            used |= bit
+            getattr(self, name).populate_from_xml(child, local_ns)
+        if plan.required_subelements & ~used:
+            missing_tags = plan.missing(self.subelements, plan.required_subelements, used)
+            raise Exception("Missing tag(s)! %s" % ", ".join(missing_tags))
 
     def _populate_attributes_from_xml(self, xml_node, ns):
-        used_attributes = set()
-        attributes_by_fqn = self._attributes_by_fqn
-        for attr, value in six.iteritems(xml_node.attrib):
+        plan = self._xml_plans.get(ns) or self._get_xml_plan(ns)
+        attributes_by_fqn = plan.attributes_by_fqn
+        used = 0
+        for attr, value in xml_node.items():
             try:
-                name = attributes_by_fqn[attr]
+                slot, attribute, bit = attributes_by_fqn[attr]
             except KeyError:
                 raise Exception("Unrecognized attribute tag: %s" % attr)
-            used_attributes.add(name)
-            setattr(self, name, value)
-        missing_attributes = self._required_attributes.difference(used_attributes)
-        if missing_attributes:
-            raise Exception("Missing attribute(s)! %s" % tuple(missing_attributes))
+            if attribute.validator:
+                attribute.validator(value)
+            slot.__set__(self, value)
+            used |= bit
+        if plan.required_attributes & ~used:
+            missing_attributes = plan.missing(self.attributes, plan.required_attributes, used)
+            raise Exception("Missing attribute(s)! %s" % ", ".join(missing_attributes))
 
     def validate(self, strict=True):
         for name, subelement in self.subelements.items():
-            obj = getattr(self, name)
-            # verify that the object is in fact a subelement of acceptable lineage
-            if oldest_ancestor(self.subelements[name]) is not oldest_ancestor(obj):
+            obj = self._peek(name)
+            # verify that the object is in fact a subelement of acceptable
+            # lineage, i.e. it was cloned from the prototype
+            if getattr(obj, "creation_counter", None) != subelement.creation_counter:
                 # fixme: if we are looking at a string, give an appropriate
                 # error message (it is quite easy to accidentally set a
                 # TextElement itself instead of its text property)
@@ -316,14 +521,50 @@ class Element(six.with_metaclass(ElementMetaclass, object)):
             # validate it
             obj.validate(strict)
         for name, attribute in self.attributes.items():
-            attribute.validate(self._attribute_data[name])
+            attribute.validate(getattr(self, name))
+
+    def get_digest(self, keep=False):
+        """Returns a digest of the element's contents, so two elements are
+        equal exactly when their digests are
+
+        A linked resource contributes only its href, which is in turn a
+        digest of the resource.  If `keep` is true, the digest is kept by this
+        element and each subelement, and used by __eq__ until the element is
+        cloned.  So this must only be done for elements that will never be
+        modified, i.e. those of a saved resource (see BaseDuctModel).
+        """
+        digest = self._digest
+        if digest is None:
+            hash_obj = hashlib.sha1(b'%s.%s\0' % (type(self).__module__, type(self).__name__))
+            self._update_digest(hash_obj, keep)
+            digest = hash_obj.digest()
+            if keep:
+                self._digest = digest
+        return digest
+
+    def _update_digest(self, hash_obj, keep):
+        for name in sorted(self.attributes):
+            value = getattr(self, name)
+            if value is None:
+                hash_obj.update(b'%s\0-\0' % name)
+            else:
+                value = value.encode('utf-8')
+                hash_obj.update(b'%s\0%d:%s' % (name, len(value), value))
+        for name in self.subelements:
+            hash_obj.update(self._peek(name).get_digest(keep))
 
     def __eq__(self, other):
         if self is other:
             return True
-        return (type(self) == type(other) and
-                self._attribute_data == other._attribute_data and
-                all(getattr(self, name) == getattr(other, name) for name in self.subelements))
+        if type(self) != type(other):
+            return False
+        if self._digest is not None and other._digest is not None:
+            return self._digest == other._digest
+        return self._contents_equal(other)
+
+    def _contents_equal(self, other):
+        return (all(getattr(self, name) == getattr(other, name) for name in self.attributes) and
+                all(self._peek(name) == other._peek(name) for name in self.subelements))
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -331,12 +572,18 @@ class Element(six.with_metaclass(ElementMetaclass, object)):
 def _is_element(obj):
     return isinstance(obj, Element)
 
+_borrowed_slot = Element._borrowed
+
 class TextElement(six.with_metaclass(NoChildElementMetaclass, Element)):
-    _text = ""
+    __slots__ = ('_text',)
 
     # fixme: In theory we should prevent subclasses from having adding elements
     # or attributes named "text"
 
+    def __init__(self):
+        super(TextElement, self).__init__()
+        self._text = ""
+
     @create_property
     def text():
         def fget(self):
@@ -361,11 +608,16 @@ class TextElement(six.with_metaclass(NoChildElementMetaclass, Element)):
             text = ""
         self.text = text
 
-    def __eq__(self, other):
-        return super(TextElement, self).__eq__(other) and self._text == other._text
+    def _update_digest(self, hash_obj, keep):
+        super(TextElement, self)._update_digest(hash_obj, keep)
+        text = self._text.encode('utf-8')
+        hash_obj.update(b'%d:%s' % (len(text), text))
+
+    def _contents_equal(self, other):
+        return super(TextElement, self)._contents_equal(other) and self._text == other._text
 
-    def output_json_dict(self):
-        rv = super(TextElement, self).output_json_dict()
+    def output_json_dict(self, depth=None):
+        rv = super(TextElement, self).output_json_dict(depth=depth)
         rv['text'] = self.text
         return rv
 
@@ -380,6 +632,10 @@ class ArrayElement(six.with_metaclass(NoChildElementMetaclass, Element)):
     # fixme: In theory we should prevent subclasses from having adding elements
     # or attributes named "array"
 
+    __slots__ = ('item_prototype', 'min_size', 'max_size', 'null_on_empty', 'array', '_unchanged_items')
+
+    _shared_slots = ('array',)
+
     def __init__(self, item_prototype, min_size=0, max_size=None, null_on_empty=False):
         super(ArrayElement, self).__init__()
         assert max_size is None or min_size <= max_size
@@ -389,71 +645,149 @@ class ArrayElement(six.with_metaclass(NoChildElementMetaclass, Element)):
         self.max_size = max_size
         self.null_on_empty = null_on_empty
         self.array = []
+        # items known to be valid already, keyed by id() (see _patch_from_blueprint_ops)
+        self._unchanged_items = None
 
     @property
     def optional(self):
         return self.null_on_empty
 
-    def clone(self):
-        clone = super(ArrayElement, self).clone()
-        clone.array = list(self.array)
-        return clone
+    def _prototype_value(self, name):
+        if name == 'array':
+            return ()
+        return super(ArrayElement, self)._prototype_value(name)
+
+    def _copy_shared_value(self, name, value, frozen=False):
+        if name == 'array':
+            return [item.clone(frozen) for item in value]
+        return super(ArrayElement, self)._copy_shared_value(name, value, frozen)
 
     def is_null_xml_element(self):
-        return (self.null_on_empty and len(self.array) == 0)
+        return (self.null_on_empty and len(self) == 0)
 
     def new_item(self):
         return self.item_prototype.clone()
 
+    def clone(self, frozen=False):
+        rv = super(ArrayElement, self).clone(frozen)
+        rv._unchanged_items = None
+        return rv
+
     def validate(self, strict=True):
         super(ArrayElement, self).validate(strict)
-        prototype_oldest_ancestor = oldest_ancestor(self.item_prototype)
-        if any(oldest_ancestor(item) is not prototype_oldest_ancestor for item in self.array):
+        array = self._peek('array')
+        prototype_creation_counter = self.item_prototype.creation_counter
+        if any(getattr(item, "creation_counter", None) != prototype_creation_counter for item in array):
             raise ValidationError
         if len(self) < self.min_size:
             raise ValidationError("too few elements")
         if self.max_size is not None and len(self) > self.max_size:
             raise ValidationError("too many elements")
-        for subelement in self.array:
-            subelement.validate(strict)
-
-    def output_json_dict(self):
-        rv = super(ArrayElement, self).output_json_dict()
-        rv['array'] = [x.output_json_dict() for x in self.array]
+        unchanged_items = self._unchanged_items
+        for subelement in array:
+            if unchanged_items is None or unchanged_items.get(id(subelement)) is not subelement:
+                subelement.validate(strict)
+
+    def output_json_dict(self, depth=None):
+        rv = super(ArrayElement, self).output_json_dict(depth=depth)
+        rv['array'] = [x.output_json_dict(depth=depth) for x in self._peek('array')]
         return rv
 
     def patch_from_blueprint(self, blueprint, save_context):
         super(ArrayElement, self).patch_from_blueprint(blueprint, save_context)
         if 'array' in blueprint:
+            if '@ops' in blueprint:
+                raise BlueprintError("cannot give both `array` and `@ops`", blueprint)
             array_blueprint = blueprint['array']
             blueprint_expects_list(array_blueprint)
             self.array = [self.new_item() for a in array_blueprint]
-            for i, bp in enumerate(array_blueprint):
-                self.array[i].patch_from_blueprint(bp, save_context)
+            _patch_items_from_blueprints(zip(self.array, array_blueprint), save_context)
+        elif '@ops' in blueprint:
+            self._patch_from_blueprint_ops(blueprint_expects_list(blueprint['@ops']), save_context)
+
+    def _patch_from_blueprint_ops(self, ops, save_context):
+        """Applies a list of operations to the array, in order.  Each is one of
+
+        {"op": "insert", "index": i, "item": blueprint}
+        {"op": "delete", "index": i}
+        {"op": "replace", "index": i, "item": blueprint}
+        {"op": "move", "index": i, "to": j}
+
+        where indices refer to the array as left by the previous operation.
+
+        The items already in the array are those of the resource being
+        patched, which was validated when it was saved.  They are remembered,
+        so validate() only needs to look at the items that were added.  (This
+        means a strict test added since then will not complain about the
+        items that were left alone, just as it doesn't when the resource is
+        loaded.)
+        """
+        array = self.array
+        unchanged_items = self._unchanged_items
+        if unchanged_items is None:
+            unchanged_items = self._unchanged_items = dict((id(item), item) for item in array)
+        for op in ops:
+            blueprint_expects_dict(op)
+            op_name = op.get('op')
+            if op_name not in ('insert', 'delete', 'replace', 'move'):
+                raise BlueprintError("unknown array operation", op)
+            index = blueprint_expects_index(op, 'index', len(array) + (op_name == 'insert'))
+            if op_name == 'move':
+                to = blueprint_expects_index(op, 'to', len(array))
+                array.insert(to, array.pop(index))
+            elif op_name == 'delete':
+                del array[index]
+            else:
+                if 'item' not in op:
+                    raise BlueprintError("operation needs an `item`", op)
+                item = self.new_item()
+                item.patch_from_blueprint(op['item'], save_context)
+                if op_name == 'insert':
+                    array.insert(index, item)
+                else:
+                    array[index] = item
 
     def populate_xml_element(self, element, ns):
         super(ArrayElement, self).populate_xml_element(element, ns)
-        for subelement in self.array:
-            child_fqn = subelement.fqn or "{%s}%s" % (ns, "item") # fixme: "item"
-            xml_subelement = etree.SubElement(element, child_fqn)
-            subelement.populate_xml_element(xml_subelement, ns)
+        # all items are clones of item_prototype, so they have the same fqn
+        child_fqn = self.item_prototype.fqn or "{%s}%s" % (ns, "item") # fixme: "item"
+        SubElement = etree.SubElement
+        for subelement in self._peek('array'):
+            subelement.populate_xml_element(SubElement(element, child_fqn), ns)
 
     def populate_from_xml(self, xml_node, ns):
         super(ArrayElement, self)._populate_attributes_from_xml(xml_node, ns) # or we can just forbid arrays from having attributes
+        if len(xml_node) == 0:
+            return
+        item_prototype = self.item_prototype
+        array = self.array
         for child in xml_node:
             # fixme: make sure child.tag is as expected (see "item" above)
-            item = self.new_item()
+            item = item_prototype.clone()
             item.populate_from_xml(child, ns)
-            self.array.append(item)
+            array.append(item)
 
-    def __eq__(self, other):
-        return super(ArrayElement, self).__eq__(other) and self.array == other.array
+    def _update_digest(self, hash_obj, keep):
+        super(ArrayElement, self)._update_digest(hash_obj, keep)
+        array = self._peek('array')
+        hash_obj.update(b'%d\0' % len(array))
+        for item in array:
+            hash_obj.update(item.get_digest(keep))
+
+    def _contents_equal(self, other):
+        if not super(ArrayElement, self)._contents_equal(other):
+            return False
+        array, other_array = self._peek('array'), other._peek('array')
+        return len(array) == len(other_array) and all(a == b for a, b in zip(array, other_array))
+
+    # iterating does not give a private copy of the items, so they must not be
+    # modified this way.  use `array` for that.
 
     def __iter__(self):
-        return iter(self.array)
+        return iter(self._peek('array'))
 
     def __len__(self):
-        return len(self.array)
+        return len(self._peek('array'))
 
     # fixme: __getitem__, __delitem__, __setitem__, __delslice__, __getslice__,
     # __setslice__, __reversed__, append, extend, insert, pop
@@ -461,6 +795,56 @@ class ArrayElement(six.with_metaclass(NoChildElementMetaclass, Element)):
     # maybe make an interface for new_item to be passed arguments, which will
     # call some yet-to-be-defined "set_stuff" function on the item
 
+# number of threads used to save the new resources in an array blueprint (see
+# below).  by default (1) they are saved one after another, which is fastest
+# with a local disk; a site whose storage backend is slow to answer (e.g. a
+# remote one) may do better with a few threads
+blueprint_save_threads = getattr(settings, "DUCTUS_BLUEPRINT_SAVE_THREADS", 1)
+_blueprint_save_pool = None
+_blueprint_save_pool_lock = threading.Lock()
+_in_blueprint_save_thread = threading.local()
+
+def _patch_item_from_blueprint(item_and_blueprint, save_context):
+    _in_blueprint_save_thread.value = True
+    item, blueprint = item_and_blueprint
+    item.patch_from_blueprint(blueprint, save_context)
+
+def _patch_items_from_blueprints(items_and_blueprints, save_context):
+    """Patches each item from its blueprint
+
+    Items whose blueprint gives a resource, which must then be saved, are
+    done in parallel.  Arrays nested within those are done serially, since
+    they are already in one of the pool's threads.  A blueprint given more
+    than once is done after the others, so it finds the first one's urn in
+    the save context.
+    """
+    global _blueprint_save_pool
+    serial, parallel, repeated = [], [], []
+    seen = set()
+    for item, blueprint in items_and_blueprints:
+        if isinstance(blueprint, dict) and isinstance(blueprint.get('resource'), dict):
+            key = json.dumps(blueprint, sort_keys=True)
+            if key in seen:
+                repeated.append((item, blueprint))
+            else:
+                seen.add(key)
+                parallel.append((item, blueprint))
+        else:
+            serial.append((item, blueprint))
+    if (len(parallel) < 2 or blueprint_save_threads < 2
+            or getattr(_in_blueprint_save_thread, 'value', False)):
+        serial.extend(parallel)
+        parallel = []
+    for item, blueprint in serial:
+        item.patch_from_blueprint(blueprint, save_context)
+    if parallel:
+        with _blueprint_save_pool_lock:
+            if _blueprint_save_pool is None:
+                _blueprint_save_pool = ThreadPool(blueprint_save_threads)
+        _blueprint_save_pool.map(partial(_patch_item_from_blueprint, save_context=save_context), parallel)
+    for item, blueprint in repeated:
+        item.patch_from_blueprint(blueprint, save_context)
+
 class OptionalArrayElement(ArrayElement):
     optional = True
 
@@ -478,8 +862,8 @@ class LinkElement(Element):
         super(LinkElement, self).__init__()
         self._xlink_type = "simple"
 
-    def output_json_dict(self):
-        rv = super(LinkElement, self).output_json_dict()
+    def output_json_dict(self, depth=None):
+        rv = super(LinkElement, self).output_json_dict(depth=depth)
         del rv['_xlink_type']
         return rv
 
@@ -493,16 +877,20 @@ class ResourceElement(LinkElement):
     # fixme: In theory we should prevent subclasses from having adding elements
     # or attributes named "resource"
 
+    __slots__ = ('allowed_resource_types', '_unsaved_resource', '_cached_resource')
+
     def __init__(self, *allowed_resource_types):
         # fixme: should be able to specify more general constraints on allowed
         # resource types
         # fixme: or should we instead allow only one resource type (an
         # "interface" and force things to derive from it?)
         self.allowed_resource_types = allowed_resource_types
+        self._unsaved_resource = None
+        self._cached_resource = None
         super(ResourceElement, self).__init__()
 
     def store(self, resource, save=True):
-        self.__check_type(resource)
+        self.__check_type(type(resource))
         if save:
             self.href = resource.save()
         else:
@@ -510,35 +898,59 @@ class ResourceElement(LinkElement):
             self.href = ""
 
     def get(self):
-        if self.href == "":
-            if hasattr(self, "_unsaved_resource"):
-                return self._unsaved_resource
-            else:
-                return None
-        if hasattr(self, "_cached_resource") and self._cached_resource[0] == self.href:
-            return self._cached_resource[1]
-        resource = get_resource_database().get_resource_object(self.href)
-        self.__check_type(resource)
-        self._cached_resource = (self.href, resource)
+        href = self.href
+        if href == "":
+            return self._unsaved_resource
+        # (read just once, since another thread may replace it)
+        cached_resource = self._cached_resource
+        if cached_resource is not None and cached_resource[0] == href:
+            return cached_resource[1]
+        resource = get_resource_database().get_resource_object(href)
+        self.__check_type(type(resource))
+        self._cached_resource = (href, resource)
         return resource
 
     #resource = property(get, store)
 
+    def get_metadata(self):
+        """Returns the linked resource's metadata, as given by
+        ResourceDatabase.get_resource_metadata(), without loading it.
+
+        Falls back to the loaded resource if there is no href (i.e. the
+        resource has not been saved yet) or if it is loaded already.
+        """
+        href = self.href
+        cached_resource = self._cached_resource
+        if href and (cached_resource is None or cached_resource[0] != href):
+            return get_resource_database().get_resource_metadata(href)
+        return _resource_metadata_from_object(self.get())
+
+    def get_model_class(self):
+        "Returns the ductmodel class of the linked resource"
+        fqn = self.get_metadata()['fqn']
+        try:
+            return _registered_ductmodels[fqn]
+        except KeyError:
+            raise ValidationError("Unknown resource type: %s" % fqn)
+
     def validate(self, strict=True):
         super(ResourceElement, self).validate(strict)
         if strict and self.href:
-            resource = get_resource_database().get_resource_object(self.href)
-            self.__check_type(resource)
+            self.__check_type(self.get_model_class())
 
-    def __check_type(self, resource):
+    def __check_type(self, model_class):
         if self.allowed_resource_types:
-            if not type(resource) in self.allowed_resource_types:
-                raise Exception("Not a correct resource type: %s but allowed types are %s" % (type(resource), self.allowed_resource_types))
-
-    def output_json_dict(self):
-        rv = super(ResourceElement, self).output_json_dict()
-        resource = self.get()
-        rv['resource'] = resource and resource.output_json_dict()
+            if not model_class in self.allowed_resource_types:
+                raise Exception("Not a correct resource type: %s but allowed types are %s" % (model_class, self.allowed_resource_types))
+
+    def output_json_dict(self, depth=None):
+        rv = super(ResourceElement, self).output_json_dict(depth=depth)
+        if depth is None and self.href:
+            # memoised, and shared with everything else linking to it
+            rv['resource'] = get_resource_json_dict(self.href)
+        elif depth is None or depth > 0:
+            resource = self.get()
+            rv['resource'] = resource and resource.output_json_dict(depth=depth and depth - 1)
         return rv
 
     def patch_from_blueprint(self, blueprint, save_context):
@@ -554,6 +966,22 @@ class ResourceElement(LinkElement):
                     'resource': blueprint['resource']
                 }, save_context)
 
+def save_unsaved_resources(element):
+    """Saves each resource linked from `element` (at any depth) that was given
+    to ResourceElement.store() with save=False, so that it gets an href
+    """
+    if isinstance(element, ResourceElement):
+        resource = element._unsaved_resource
+        if not element.href and resource is not None:
+            save_unsaved_resources(resource)
+            element.store(resource)
+        return
+    if isinstance(element, ArrayElement):
+        for item in element.array:
+            save_unsaved_resources(item)
+    for name in element.subelements:
+        save_unsaved_resources(getattr(element, name))
+
 class OptionalResourceElement(ResourceElement):
     optional = True
 
@@ -575,6 +1003,8 @@ class BlobElement(LinkElement):
 class TypedBlobElement(BlobElement):
     "Add type attribute"
 
+    __slots__ = ('allowed_mime_types',)
+
     mime_type = Attribute()
 
     def __init__(self, allowed_mime_types=None):
@@ -589,8 +1019,8 @@ class TypedBlobElement(BlobElement):
             raise ValidationError("not an allowed mime type: {}".format(self.mime_type))
 
 class TextBlobElement(BlobElement):
-    def output_json_dict(self):
-        rv = super(TextBlobElement, self).output_json_dict()
+    def output_json_dict(self, depth=None):
+        rv = super(TextBlobElement, self).output_json_dict(depth=depth)
         rv['text'] = b''.join(self).decode('utf-8')
         return rv
 
@@ -603,8 +1033,22 @@ class TextBlobElement(BlobElement):
 
     # fixme: implement textual diff
 
-class _AuthorElement(LinkElement, TextElement):
-    pass
+class _AuthorElement(TextElement):
+    # this is a LinkElement too, but slotted classes cannot have both
+    # LinkElement and TextElement as bases, so we duplicate LinkElement here
+    nsmap = LinkElement.nsmap
+
+    href = LinkElement.attributes['href']
+    _xlink_type = LinkElement.attributes['_xlink_type']
+
+    def __init__(self):
+        super(_AuthorElement, self).__init__()
+        self._xlink_type = "simple"
+
+    def output_json_dict(self, depth=None):
+        rv = super(_AuthorElement, self).output_json_dict(depth=depth)
+        del rv['_xlink_type']
+        return rv
 
 class DuctusCommonElement(Element):
     author = _AuthorElement()
@@ -616,13 +1060,13 @@ class DuctusCommonElement(Element):
     ns = "http://ductus.us/ns/2009/ductus"
     nsmap = {"ductus": ns}
 
-    def clone(self):
-        rv = super(DuctusCommonElement, self).clone()
-        rv.parents.array = []
+    # a clone starts out with none of these set
+    _reset_on_clone = ('parents', 'log_message', 'author')
+    _shared_by_clones = False
+
+    def clone(self, frozen=False):
+        rv = super(DuctusCommonElement, self).clone(frozen)
         rv.timestamp = ""
-        rv.log_message.text = ""
-        rv.author.text = ""
-        rv.author.href = ""
         return rv
 
     def validate(self, strict=True):
@@ -632,22 +1076,23 @@ class DuctusCommonElement(Element):
             if not self.author.text:
                 raise ValidationError("author must be given for the resource")
 
-            # load each parent; make sure license compatibility is satisfied.
+            # look up each parent; make sure license compatibility is satisfied.
             licenses = [license.href for license in self.licenses]
             for parent in self.parents:
-                parent_licenses = [license.href
-                                   for license in parent.get().common.licenses]
+                parent_licenses = parent.get_metadata()['licenses']
 
                 if not is_license_compatibility_satisfied(parent_licenses, licenses):
                     raise ValidationError("license compatibility not satisfied")
 
     def populate_xml_element(self, element, ns):
+        # this modifies us, which is fine since elements that are not
+        # _shared_by_clones are always given a private copy
         if not self.timestamp:
             self.timestamp = datetime.datetime.utcnow().isoformat()
         super(DuctusCommonElement, self).populate_xml_element(element, ns)
 
-    def output_json_dict(self):
-        return Element.output_json_dict(self, ('parents',))
+    def output_json_dict(self, depth=None):
+        return Element.output_json_dict(self, ('parents',), depth)
 
     def patch_from_blueprint(self, blueprint, save_context):
         # we don't allow patching, so we don't call the superclass
@@ -673,7 +1118,11 @@ class TagElement(Element):
 class BaseDuctModel(six.with_metaclass(DuctModelMetaclass, Element)):
     """all functionality of DuctModel, but without the `common` or `tags` elements"""
 
-    urn = None
+    __slots__ = ('urn',)
+
+    def __init__(self):
+        super(BaseDuctModel, self).__init__()
+        self.urn = None
 
     def save(self, encoding=None):
         if self.urn:
@@ -693,16 +1142,31 @@ class BaseDuctModel(six.with_metaclass(DuctModelMetaclass, Element)):
             raise DuctModelMismatchError("Expecting %s, got %s" % (cls, type(resource)))
         return resource
 
-    def clone(self):
-        rv = super(BaseDuctModel, self).clone()
+    def clone(self, frozen=False):
+        rv = super(BaseDuctModel, self).clone(frozen)
         rv.urn = None
         return rv
 
+    def _is_frozen(self):
+        # a saved resource never changes
+        return bool(self.urn) or super(BaseDuctModel, self)._is_frozen()
+
+    def get_digest(self, keep=False):
+        # a saved resource never changes, so it can always keep its digest
+        return super(BaseDuctModel, self).get_digest(keep or bool(self.urn))
+
+    def is_unchanged_from(self, original):
+        """True if this clone of `original` (after any changes made to it)
+        is the same resource, so there is no need to save it"""
+        return self == original
+
     def __eq__(self, other):
-        return (self.urn is not None and self.urn == other.urn) or super(BaseDuctModel, self).__eq__(other)
+        if self.urn is not None and type(other) == type(self) and other.urn is not None:
+            return self.urn == other.urn or self.get_digest() == other.get_digest()
+        return super(BaseDuctModel, self).__eq__(other)
 
-    def output_json_dict(self):
-        rv = super(BaseDuctModel, self).output_json_dict()
+    def output_json_dict(self, depth=None):
+        rv = super(BaseDuctModel, self).output_json_dict(depth=depth)
         rv['fqn'] = self.fqn
         return rv
 
@@ -731,11 +1195,21 @@ class BaseDuctModel(six.with_metaclass(DuctModelMetaclass, Element)):
         except KeyError:
             raise BlueprintError("blueprint needs either `href` or `resource`", blueprint)
         blueprint_expects_dict(resource_blueprint)
+
+        # a blueprint that has already been saved during this request (e.g. a
+        # phrase used by several cards) gives the same resource again
+        memo_key = hashlib.sha1(json.dumps(resource_blueprint, sort_keys=True)).digest()
+        urn = save_context.saved_blueprints.get(memo_key)
+        if urn is not None:
+            return urn
+
         resource_blueprint = dict(resource_blueprint) # copy it so we can modify
 
+        original = None
         if '@patch' in resource_blueprint:
             original_urn = resource_blueprint.pop('@patch')
-            resource = resource_database.get_resource_object(original_urn).clone()
+            original = resource_database.get_resource_object(original_urn)
+            resource = original.clone()
         elif '@create' in resource_blueprint:
             fqn = resource_blueprint.pop('@create')
             try:
@@ -749,7 +1223,13 @@ class BaseDuctModel(six.with_metaclass(DuctModelMetaclass, Element)):
             raise BlueprintError("resource blueprint must contain '@patch' or '@create'", resource_blueprint)
 
         resource.patch_from_blueprint(resource_blueprint, save_context)
-        return resource.save()
+        if original is not None and resource.is_unchanged_from(original):
+            # nothing changed, so there is nothing to write
+            urn = original_urn
+        else:
+            urn = resource.save()
+        save_context.saved_blueprints[memo_key] = urn
+        return urn
 
 class DuctModel(BaseDuctModel):
     common = DuctusCommonElement()
@@ -769,8 +1249,8 @@ class DuctModel(BaseDuctModel):
 
         return super(DuctModel, self).save(encoding)
 
-    def clone(self):
-        rv = super(DuctModel, self).clone()
+    def clone(self, frozen=False):
+        rv = super(DuctModel, self).clone(frozen)
         if self.urn:
             rv.common.parents.array = [rv.common.parents.new_item()]
             rv.common.parents.array[0].href = self.urn
@@ -793,13 +1273,24 @@ class DuctModel(BaseDuctModel):
         super(DuctModel, self).validate(strict)
         if strict:
             for parent in self.common.parents:
-                if type(parent.get()) != type(self):
+                if parent.get_model_class() != type(self):
                     raise ValidationError("Resource's parents must be of the same type")
 
         licenses = [license.href for license in self.common.licenses]
         if self.__allowed_licenses_set.isdisjoint(licenses + [None]):
             raise ValidationError("The content is not provided under a license acceptable for this wiki")
 
+    def is_unchanged_from(self, original):
+        # a clone has a new parent, timestamp, author and log message, but
+        # these only describe the revision, not the resource itself
+        if type(self) != type(original):
+            return False
+        common, original_common = self._peek('common'), original._peek('common')
+        return (all(getattr(self, name) == getattr(original, name) for name in self.attributes) and
+                all(self._peek(name) == original._peek(name) for name in self.subelements
+                    if name != 'common') and
+                common._peek('licenses') == original_common._peek('licenses'))
+
     def patch_from_blueprint(self, blueprint, save_context):
         super(DuctModel, self).patch_from_blueprint(blueprint, save_context)
         # we must save both subelements' blueprints explicitly for some reason
@@ -822,6 +1313,18 @@ def blueprint_expects_string(blueprint):
         raise BlueprintTypeError("expected string, got %s" % type(blueprint).__name__, blueprint)
     return blueprint
 
+def blueprint_expects_index(blueprint, key, length):
+    "Returns blueprint[key], which must be an index into a list of `length` items"
+    try:
+        index = blueprint[key]
+    except KeyError:
+        raise BlueprintError("expected `%s`" % key, blueprint)
+    if not isinstance(index, six.integer_types) or isinstance(index, bool):
+        raise BlueprintTypeError("expected integer, got %s" % type(index).__name__, blueprint)
+    if not 0 <= index < length:
+        raise BlueprintError("`%s` out of range" % key, blueprint)
+    return index
+
 def blueprint_cast_to_string(blueprint):
     if isinstance(blueprint, six.string_types):
         return blueprint
@@ -835,6 +1338,11 @@ class BlueprintSaveContext(object):
     author_ip_address = ""
     log_message = ""
 
+    def __init__(self):
+        # urns of the resource blueprints saved so far, keyed by a hash of
+        # their json (see BaseDuctModel.save_blueprint)
+        self.saved_blueprints = {}
+
     @classmethod
     def from_request(cls, request):
         rv = cls()
@@ -845,3 +1353,106 @@ class BlueprintSaveContext(object):
         rv.author_ip_address = request.remote_addr
         rv.log_message = request.POST.get('log_message', '')
         return rv
+
+class FieldPath(object):
+    """A path to a single field of a resource, such as 'common.parents.href'
+    or 'sides.href'
+
+    A path is a dotted list of subelement names, ending either in an
+    attribute name or in a TextElement (whose text is the value).  When an
+    ArrayElement is passed through, the rest of the path is followed for
+    each of its items, and the value is a list.
+
+    A FieldPath can read the value straight from the XML of a resource (see
+    ResourceDatabase.get_resource_fields), or from a loaded resource object.
+    Use FieldPath.get() rather than the constructor, so each path is only
+    worked out once per model.
+    """
+
+    __slots__ = ('path', 'steps', 'attribute_fqn', 'default')
+
+    __compiled = {}
+
+    @classmethod
+    def get(cls, model_class, path):
+        try:
+            return cls.__compiled[(model_class, path)]
+        except KeyError:
+            return cls.__compiled.setdefault((model_class, path), cls(model_class, path))
+
+    def __init__(self, model_class, path):
+        self.path = path
+        self.steps = [] # (fqn, is_array) of each element on the path
+        self.attribute_fqn = None
+        element_class, ns = model_class, model_class.ns
+        element = None
+        names = path.split('.')
+        for i, name in enumerate(names):
+            plan = element_class._xml_plans.get(ns) or element_class._get_xml_plan(ns)
+            if name in element_class.attributes and i == len(names) - 1:
+                attribute = element_class.attributes[name]
+                self.attribute_fqn = attribute.fqn or name
+                if element is not None:
+                    self.default = getattr(element, name)
+                else:
+                    self.default = None if attribute.optional else ""
+                return
+            for subelement_name, fqn, local_ns, shared in plan.subelement_output:
+                if subelement_name == name:
+                    break
+            else:
+                raise AttributeError("%s has no field '%s'" % (element_class.__name__, name))
+            element = element_class.subelements[name]
+            is_array = isinstance(element, ArrayElement)
+            self.steps.append((fqn, is_array))
+            if is_array:
+                element = element.item_prototype
+            element_class, ns = element.__class__, local_ns
+        if not isinstance(element, TextElement):
+            raise ValueError("path must end in an attribute or a TextElement: %s" % path)
+        self.default = element.text
+
+    @property
+    def toplevel_fqn(self):
+        "fqn of the child of the root element that holds the field, if any"
+        return self.steps[0][0] if self.steps else None
+
+    def read(self, root):
+        "Reads the value from the root element of a resource's XML"
+        return self.__read_child(root, 0)
+
+    def read_toplevel(self, element):
+        """Reads the value from the child of the root element named by
+        `toplevel_fqn`, which is None if the resource does not have it"""
+        return self.__read_element(element, 0)
+
+    def __read_child(self, node, i):
+        if i == len(self.steps):
+            return self.__read_value(node)
+        child = None if node is None else node.find(self.steps[i][0])
+        return self.__read_element(child, i)
+
+    def __read_element(self, node, i):
+        if self.steps[i][1]:
+            return [self.__read_child(item, i + 1)
+                    for item in (node if node is not None else ())]
+        return self.__read_child(node, i + 1)
+
+    def __read_value(self, node):
+        if node is None:
+            return self.default
+        if self.attribute_fqn is not None:
+            return node.get(self.attribute_fqn, self.default)
+        return node.text or ""
+
+    def get_from_object(self, resource):
+        "Gets the value from a loaded resource"
+        return self.__get_from_object(resource, self.path.split('.'))
+
+    def __get_from_object(self, element, names):
+        if not names:
+            return element.text if isinstance(element, TextElement) else element
+        value = getattr(element, names[0])
+        if isinstance(value, ArrayElement):
+            return [self.__get_from_object(item, names[1:]) for item in value]
+        return self.__get_from_object(value, names[1:])
@@ -0,0 +1,205 @@
+# Ductus
+# Copyright (C) 2013  Jim Garrison <garrison@wikiotics.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""JSON representation of resources, memoised per urn
+
+Resources are immutable, so the JSON of a saved resource never changes.  We
+keep it (as text, and as the dict given by output_json_dict()) in a small
+in-process cache and in the Django cache.  A resource that links to other
+resources is then composed from their cached JSON: its dict holds the very
+same dict objects, which are ResourceJSONDicts, and its text is written out
+with theirs pasted in, so nothing is encoded twice.  Since they are shared,
+the cached dicts, and the dicts and lists in them, are read-only.
+
+iter_json() writes the JSON a piece at a time, for use with a
+StreamingHttpResponse, so a large flashcard deck need never be held in
+memory as a single string.  get_array_page() gives a large array a page at a
+time.
+"""
+
+import itertools
+import json
+
+from django.core.cache import cache
+from django.utils import six
+
+from ductus.resource import get_resource_database
+from ductus.utils import LRUCache
+
+_json_dict_cache = LRUCache(4096)
+_json_text_cache = LRUCache(4096)
+
+# texts larger than this are kept in the Django cache only
+max_locally_cached_json_length = 64 * 1024
+
+class ReadOnlyDict(dict):
+    """A dict that raises TypeError when anything tries to modify it
+
+    A copy of one (by copy.copy() or copy.deepcopy()) is a plain dict.
+    """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("%s is read-only" % type(self).__name__)
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+class ReadOnlyList(list):
+    """A list that raises TypeError when anything tries to modify it
+
+    A copy of one (by copy.copy() or copy.deepcopy()) is a plain list.
+    """
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("%s is read-only" % type(self).__name__)
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+def _read_only(value):
+    "Returns a copy of the json-compatible `value` that cannot be modified"
+    if isinstance(value, (ReadOnlyDict, ReadOnlyList)):
+        return value
+    if isinstance(value, dict):
+        return ReadOnlyDict((key, _read_only(item)) for key, item in six.iteritems(value))
+    if isinstance(value, list):
+        return ReadOnlyList(_read_only(item) for item in value)
+    return value
+
+class ResourceJSONDict(ReadOnlyDict):
+    """The whole output_json_dict() of the resource at `urn`, as cached
+
+    iter_json() writes one of these out as the resource's cached JSON text,
+    which is why it is read-only (as is everything in it).
+    """
+    __slots__ = ('urn',)
+
+    def __init__(self, urn, value):
+        super(ResourceJSONDict, self).__init__(
+            (key, _read_only(item)) for key, item in six.iteritems(value))
+        self.urn = urn
+
+def _cache_key(urn):
+    return "resource-json:" + urn
+
+def get_resource_json_dict(urn):
+    """Returns output_json_dict() of the resource at `urn`, as a
+    ResourceJSONDict
+
+    The dict is shared with every other caller, so it is read-only.
+    """
+    urn = unicode(urn)
+    rv = _json_dict_cache.get(urn)
+    if rv is None:
+        text = cache.get(_cache_key(urn))
+        if text is not None:
+            rv = json.loads(text)
+        else:
+            rv = get_resource_database().get_resource_object(urn).output_json_dict()
+        rv = ResourceJSONDict(urn, rv)
+        _json_dict_cache.set(urn, rv)
+    return rv
+
+def get_resource_json(urn):
+    """Returns the JSON text of the resource at `urn`"""
+    urn = unicode(urn)
+    rv = _json_text_cache.get(urn)
+    if rv is None:
+        cache_key = _cache_key(urn)
+        rv = cache.get(cache_key)
+        if rv is None:
+            # a plain copy, so the resource itself is not looked up again
+            rv = u''.join(iter_json(dict(get_resource_json_dict(urn))))
+            cache.set(cache_key, rv)
+        if len(rv) <= max_locally_cached_json_length:
+            _json_text_cache.set(urn, rv)
+    return rv
+
+_encode_string = json.encoder.encode_basestring_ascii
+
+def _iter_json(value):
+    if isinstance(value, ResourceJSONDict):
+        yield get_resource_json(value.urn)
+    elif isinstance(value, dict):
+        yield u'{'
+        first = True
+        for key, item in six.iteritems(value):
+            if first:
+                first = False
+            else:
+                yield u', '
+            yield _encode_string(key) + u': '
+            for chunk in _iter_json(item):
+                yield chunk
+        yield u'}'
+    elif isinstance(value, (list, tuple)):
+        yield u'['
+        first = True
+        for item in value:
+            if first:
+                first = False
+            else:
+                yield u', '
+            for chunk in _iter_json(item):
+                yield chunk
+        yield u']'
+    elif isinstance(value, six.string_types):
+        yield _encode_string(value)
+    else:
+        yield json.dumps(value)
+
+def iter_json(value, chunk_size=8192):
+    """Encodes `value` as json.dumps() would, yielding the text in pieces of
+    about `chunk_size` characters
+
+    Each ResourceJSONDict is written using get_resource_json().
+    """
+    buf = []
+    buffered_length = 0
+    for chunk in _iter_json(value):
+        buf.append(chunk)
+        buffered_length += len(chunk)
+        if buffered_length >= chunk_size:
+            yield u''.join(buf)
+            buf = []
+            buffered_length = 0
+    if buf:
+        yield u''.join(buf)
+
+def get_array_page(array, cursor=None, limit=50, depth=None):
+    """Returns (items, next_cursor) for a page of the items of an ArrayElement
+
+    `items` are the items' output_json_dict(depth=depth), starting at
+    `cursor` (the first item if None).  `next_cursor` is the cursor of the
+    next page, or None if this is the last one.  A cursor is just an index
+    into the array, which is stable because saved resources never change.
+    Raises ValueError if the cursor is not valid.
+    """
+    start = int(cursor) if cursor else 0
+    if start < 0 or (start and start >= len(array)):
+        raise ValueError("invalid cursor: %s" % cursor)
+    end = start + limit
+    items = [item.output_json_dict(depth=depth)
+             for item in itertools.islice(array, start, end)]
+    next_cursor = unicode(end) if end < len(array) else None
+    return items, next_cursor
@@ -16,6 +16,7 @@
 
 import os
 from shutil import copyfile
+from tempfile import mkstemp
 
 from django.utils import six
 
@@ -55,15 +56,14 @@ class LocalStorageBackend(object):
 
         if os.path.exists(pathname):
             # Compare the files
-            f1 = file(pathname, 'rb')
-            f2 = file(tmpfile, 'rb')
-            while True:
-                x1 = f1.read(BLOCK_SIZE)
-                x2 = f2.read(BLOCK_SIZE)
-                if x1 != x2:
-                    break # collision!
-                if x1 == '':
-                    return # files have been fully examined and they are equal
+            with file(pathname, 'rb') as f1, file(tmpfile, 'rb') as f2:
+                while True:
+                    x1 = f1.read(BLOCK_SIZE)
+                    x2 = f2.read(BLOCK_SIZE)
+                    if x1 != x2:
+                        break # collision!
+                    if x1 == '':
+                        return # files have been fully examined and they are equal
 
             # Wow, we actually found a hash collision.  Actually, the key or
             # the existing file probably has the wrong name.  But we will save
@@ -78,7 +78,18 @@ class LocalStorageBackend(object):
             # fail only if the directory doesn't already exist
             if not os.path.isdir(dirname):
                 raise
-        copyfile(tmpfile, pathname)
+        # copy to a temporary file and rename it, so nobody (e.g. another
+        # thread storing the same resource) ever sees a partial file.  the
+        # name is not a valid digest, so iterkeys() skips it
+        fd, partial_pathname = mkstemp(prefix='.', dir=dirname)
+        try:
+            os.close(fd)
+            copyfile(tmpfile, partial_pathname)
+            os.chmod(partial_pathname, 0644)
+            os.rename(partial_pathname, pathname)
+        except:
+            os.remove(partial_pathname)
+            raise
 
     def __getitem__(self, key):
         pathname = self.__storage_location_else_keyerror(key)
@@ -31,6 +31,20 @@ DATABASES = {
 }
 
 #DUCTUS_INDEXING_MONGO_DATABASE = 'ductus_site.indexing_db'
+# or, to keep the index without a MongoDB server, point this at something
+# like SqliteIndexBackend('/path/to/index.sqlite')
+#DUCTUS_INDEX_BACKEND = 'ductus_site.index_backend'
+# to update the index after each edit without making the user wait, queue
+# the updates in this file; they are done by this many threads in each
+# process (or by manage.py process_index_queue if 0)
+#DUCTUS_INDEX_QUEUE = '/path/to/index-queue.sqlite'
+#DUCTUS_INDEX_QUEUE_WORKERS = 2
+# what links to a resource is cached for this many seconds
+#DUCTUS_INDEX_LINK_CACHE_TIMEOUT = 300
+# search results are cached for this many seconds, unless a page with the
+# tags searched for changes first; longer lists are not cached
+#DUCTUS_SEARCH_CACHE_TIMEOUT = 3600
+#DUCTUS_SEARCH_CACHE_MAX_RESULTS = 1000
 
 # A sample logging configuration. The only tangible logging
 # performed by this configuration is to send an email to
@@ -261,6 +275,8 @@ DUCTUS_ALLOWED_LICENSES = (
 
 DUCTUS_DEFAULT_LICENSE = 'http://creativecommons.org/licenses/by-sa/3.0/'
 
+#DUCTUS_BLUEPRINT_SAVE_THREADS = 1 # more may help if storage is slow to answer
+
 #DUCTUS_MEDIACACHE_DIR = ''
 DUCTUS_MEDIACACHE_URL = '/mediacache' # no trailing slash
 #DUCTUS_MEDIACACHE_URL_SECURE = None
@@ -81,6 +81,22 @@ def version(request, pagename):
     from django.http import HttpResponse
     return HttpResponse("version %s" % DUCTUS_VERSION, content_type="text/plain")
 
+@register_special_page
+def index_queue(request, pagename):
+    """report the state of the queue of index updates, for monitoring"""
+    from ductus.index.queue import get_index_queue
+    from django.http import HttpResponse
+    queue = get_index_queue()
+    if queue is None:
+        raise Http404("index updates are not queued")
+    stats = queue.get_stats()
+    statements = [
+        "pending {0}".format(stats["pending"]),
+        "lag {0:.1f}".format(stats["lag"]),
+        "failing {0}".format(stats["failing"]),
+    ]
+    return HttpResponse("\n".join(statements), content_type="text/plain")
+
 @register_special_page
 def user_count(request, pagename):
     from django.contrib.auth.models import User
@@ -142,11 +158,9 @@ def preview_textwiki(request, pagename):
 
 @register_special_page
 def search(request, pagename):
-    from ductus.index import get_indexing_mongo_database
-    indexing_db = get_indexing_mongo_database()
-    if indexing_db is None:
+    from ductus.index import get_index_backend
+    if get_index_backend() is None:
         raise Http404("indexing database is not available")
-    collection = indexing_db.urn_index
 
     # figure out target language (if given).
     # fixme: this probably doesn't belong here
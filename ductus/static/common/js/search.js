@@ -18,9 +18,12 @@
 $(function () {
 
     var taglist = [];   // list of all tags included in the search results, used for refining the search
+    var page_size = 100;    // number of results to ask the server for at a time
+    var latest_search = 0;  // incremented by each new search, so results of an older one are dropped
 
     $.fn.clear_search_results = function() {
         $(this).empty();
+        taglist = [];
         return this;
     };
 
@@ -30,7 +33,6 @@ $(function () {
         var i,
             item,
             res_length = results.length;
-        taglist = [];
         for (i = 0; i < res_length; i++) {
             item = $('<div class="result-item"><a href="' + results[i].path + '">' + results[i].absolute_pagename + '</a></div>');
             $.each(results[i].tags, function(i, tag) {
@@ -52,9 +54,14 @@ $(function () {
         var params = {},
             text,
             tags = [];
-        text = $('input.search-text').val().replace(' ', '_');
+        text = $('input.search-text').val();
         if (text != '') {
-            params['pagename'] = text;
+            if ($('input.search-content').is(':checked')) {
+                // search the words in the text of the pages, best matches first
+                params['text'] = text;
+            } else {
+                params['pagename'] = text.replace(' ', '_');
+            }
         }
         $('.tag-toggle.selected').each(function(i, tag_elt) {
             tags.push($(tag_elt).text());
@@ -63,22 +70,36 @@ $(function () {
         return params;
     }
 
-    function do_search(params) {
+    function do_search(params, after, search_id) {
         // actually perform the search with given parameters
         // params is an object describing search parameters (not serialised)
+        // after is the last page name already displayed, when fetching more results
         // TODO: validate params
+        if (!after) {
+            search_id = ++latest_search;
+        }
         if (!$.isEmptyObject(params)) {
             $.ajax({
                 url: 'ajax/search-pages',
-                data: params,
+                data: $.extend({}, params, {limit: page_size}, after ? {after: after} : {}),
                 traditional: true,  // allow multiple values for a param to be serialised properly (http://api.jquery.com/jQuery.param/)
                 success: function(data, textStatus, jqXHR) {
                     // display new search results and update the clickable list of tags
+                    if (search_id != latest_search) {
+                        return;
+                    }
+                    if (!after) {
+                        $('div.search-results').clear_search_results();
+                    }
                     if (data.length > 0) {
-                        $('div.search-results').clear_search_results().append_search_results(data);
+                        $('div.search-results').append_search_results(data);
                         update_search_toolbar(params);
-                    } else {
-                        $('div.search-results').clear_search_results().append('<span class="no-results">' + gettext('No results found') + '</span>');
+                        if (data.length == page_size && !params['text']) {
+                            // there may be more
+                            do_search(params, data[data.length - 1].absolute_pagename, search_id);
+                        }
+                    } else if (!after) {
+                        $('div.search-results').append('<span class="no-results">' + gettext('No results found') + '</span>');
                     }
                 }
             });
@@ -101,6 +122,12 @@ $(function () {
                 stat += 'and ';
             }
         }
+        if (params['text']) {
+            stat += gettext('pages containing "') + params['text'] + '" ';
+            if (params['tag']) {
+                stat += 'and ';
+            }
+        }
         if (params['tag']) {
             stat += gettext('tagged with: ') + params['tag'];
         }
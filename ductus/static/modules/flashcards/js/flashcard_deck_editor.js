@@ -611,14 +611,19 @@ $(function () {
             'html': gettext('add column'),
             'display': function() { return true; },
             'callback': function(column) {
-                column.fcd.add_column();
+                // every row gets a new side, so we need all of them
+                column.fcd.load_all_rows(function () {
+                    column.fcd.add_column();
+                });
             }
         },
         'bottom': {
             'html': gettext('delete column'),
             'display': function() { return true; },
             'callback': function(column) {
-                column.delete_column();
+                column.fcd.load_all_rows(function () {
+                    column.delete_column();
+                });
             }
         }
     };
@@ -660,8 +665,17 @@ $(function () {
         $.each(fcd.resource.headings.array, function (i, heading) {
             this_.add_column(heading.text);
         });
+        // cards past the first page only have an href; they are loaded
+        // when needed (see load_more_rows)
+        this.pending_cards = [];
+        this.next_cursor = fcd.resource.cards.next_cursor || null;
+        this.load_rows_error = null;
         $.each(fcd.resource.cards.array, function (i, card) {
-            this_.add_row(card);
+            if (card.href && card.resource === undefined) {
+                this_.pending_cards.push(card);
+            } else {
+                this_.add_row(card);
+            }
         });
 
         this.table.find(".topleft_th").ductus_selectable(null, function () {
@@ -702,9 +716,18 @@ $(function () {
 
         this.add_row_button = $('<div class="ductus_add_row">+</div>').appendTo(this.elt);
         this.add_row_button.click(function() {
-            this_.add_row(null, true);
+            this_.load_all_rows(function () {
+                this_.add_row(null, true);
+            });
         });
         this.record_initial_inner_blueprint();
+
+        // load more rows as the user scrolls down to them
+        $(window).scroll(function () {
+            if (this_.pending_cards.length && $(window).scrollTop() + 2 * $(window).height() > this_.elt.offset().top + this_.elt.height()) {
+                this_.load_more_rows();
+            }
+        });
     }
     FlashcardDeck.prototype = chain_clone(ModelWidget.prototype);
     FlashcardDeck.prototype.add_interaction = function (type) {
@@ -725,11 +748,81 @@ $(function () {
             this.tagging_widget.hide_source_lang_selector();
         }
     };
+    FlashcardDeck.prototype.load_more_rows = function (callback) {
+        // fetch the next page of pending cards from the server, and add them
+        // as rows.  callback (optional) is called once they have been added,
+        // or with the error if they could not be loaded.  once a request has
+        // failed, we don't try again (the user has been told to reload).
+        var this_ = this;
+        if (callback) {
+            (this._load_callbacks = this._load_callbacks || []).push(callback);
+        }
+        if (this._loading_rows) {
+            return;
+        }
+        function call_callbacks() {
+            var callbacks = this_._load_callbacks || [];
+            this_._load_callbacks = [];
+            $.each(callbacks, function (i, cb) { cb(this_.load_rows_error); });
+        }
+        if (!this.pending_cards.length || this.load_rows_error) {
+            call_callbacks();
+            return;
+        }
+        this._loading_rows = true;
+        $.ajax({
+            url: resolve_urn(this.initial_href),
+            data: {view: 'resource_json', array: 'cards', cursor: this.next_cursor},
+            dataType: 'json',
+            success: function (data) {
+                $.each(data.array, function (i, card) {
+                    this_.add_row(card);
+                });
+                this_.pending_cards.splice(0, data.array.length);
+                this_.next_cursor = data.next_cursor;
+                this_.ensure_min_width();
+            },
+            error: function (xhr, textStatus, errorThrown) {
+                this_.load_rows_error = xhr.status || textStatus || 'error';
+                alert(xhr.status + gettext(' error. could not load the flashcards.'));
+            },
+            complete: function () {
+                this_._loading_rows = false;
+                call_callbacks();
+            }
+        });
+    };
+    FlashcardDeck.prototype.load_all_rows = function (callback, error_callback) {
+        // load every pending card, then call callback.  if they cannot all be
+        // loaded, error_callback (optional) is called with the error instead.
+        var this_ = this;
+        if (!this.pending_cards.length) {
+            callback();
+        } else {
+            this.load_more_rows(function (error) {
+                if (error) {
+                    if (error_callback) {
+                        error_callback(error);
+                    }
+                } else if (this_._loading_rows || this_.pending_cards.length) {
+                    // either a request was already in flight and we must
+                    // wait for ours, or there are more cards to load
+                    this_.load_all_rows(callback, error_callback);
+                } else {
+                    callback();
+                }
+            });
+        }
+    };
     FlashcardDeck.prototype.inner_blueprint_repr = function () {
         var cards = [];
         $.each(this.rows, function (i, row) {
             cards.push(row.blueprint_repr());
         });
+        // cards that haven't been loaded can't have changed
+        $.each(this.pending_cards, function (i, card) {
+            cards.push({href: card.href});
+        });
         var headings = [];
         $.each(this.columns, function (i, column) {
             headings.push({text: column.heading});
@@ -745,7 +838,7 @@ $(function () {
             headings: {array: headings},
             tags: {array: tags},
             // we only save [pseudo-]dividers if we have a choice interaction
-            dividers: (this.interaction_count[ChoiceInteractionWidget.prototype.fqn] ? _get_pseudo_dividers(this.rows.length) : ''),
+            dividers: (this.interaction_count[ChoiceInteractionWidget.prototype.fqn] ? _get_pseudo_dividers(cards.length) : ''),
             interactions: this.interaction_chooser.blueprint_repr()
         });
     };
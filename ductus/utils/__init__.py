@@ -14,9 +14,12 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
 from contextlib import contextmanager
 from tempfile import mkstemp
 import os
+import sys
+import threading
 
 from django.utils import six
 
@@ -116,10 +119,102 @@ class sequence_contains_only(object):
 
     def __init__(self, allowed_elements):
         self.element_list = frozenset(allowed_elements)
-        self.allowed_elements = allowed_elements
 
     def __call__(self, x):
-        return self.element_list == frozenset(x + self.allowed_elements)
+        return self.element_list.issuperset(x)
+
+class LRUCache(object):
+    """A small in-process mapping which forgets its least recently used item
+    once it holds more than `maxsize` items.  It may be shared between
+    threads.
+
+    >>> c = LRUCache(2)
+    >>> c.set('a', 1); c.set('b', 2)
+    >>> c.get('a')
+    1
+    >>> c.set('c', 3)
+    >>> c.get('b') is None
+    True
+    >>> c.get('a'), c.get('c')
+    (1, 3)
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.__data = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.__lock:
+            try:
+                value = self.__data.pop(key)
+            except KeyError:
+                return default
+            self.__data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self.__lock:
+            self.__data.pop(key, None)
+            self.__data[key] = value
+            if len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+
+    def __len__(self):
+        return len(self.__data)
+
+class SingleFlight(object):
+    """Makes sure that a given piece of work is done only once at a time.
+
+    do(key, func) calls func() and returns its result.  If another thread
+    calls do() with the same key while func() is running, it waits and gets
+    the same result (or exception) instead of calling its own func().  Once
+    func() returns, the next call with that key starts afresh, so this is
+    not a cache.
+
+    >>> flight = SingleFlight()
+    >>> flight.do('a', lambda: 42)
+    42
+    """
+
+    class _Call(object):
+        __slots__ = ('event', 'result', 'exc_info')
+
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.exc_info = None
+
+    def __init__(self):
+        self.__calls = {}
+        self.__lock = threading.Lock()
+
+    def do(self, key, func):
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.__calls[key] = self._Call()
+
+        if not leader:
+            call.event.wait()
+        else:
+            try:
+                call.result = func()
+            except:
+                call.exc_info = sys.exc_info()
+            finally:
+                with self.__lock:
+                    del self.__calls[key]
+                call.event.set()
+
+        if call.exc_info is not None:
+            six.reraise(*call.exc_info)
+        return call.result
 
 def remove_adjacent_duplicates(list_):
     """Removes adjacent duplicates from a list.
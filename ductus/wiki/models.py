@@ -33,7 +33,6 @@ class WikiPage(models.Model):
         return u'/%s' % iri_to_uri(urlquote(slashname))
 
     def get_latest_revision(self):
-        # fixme: we need a db_index on page/timestamp combo
         query = WikiRevision.objects.filter(page=self).order_by('-timestamp')
         try:
             return query[0]
@@ -67,6 +66,10 @@ class WikiRevision(models.Model):
     class Meta:
         ordering = ('-timestamp',)
         get_latest_by = 'timestamp'
+        # for finding the latest revision of a page.  (syncdb does not add
+        # it to an existing table, which needs an index on (page_id,
+        # timestamp) created by hand.)
+        index_together = [('page', 'timestamp')]
 
     def save(self, *args, **kwargs):
         # fixme: See Django #6845.  We may need to move these tests to a
@@ -85,3 +88,34 @@ class WikiRevision(models.Model):
 
     def __str__(self):
         return u'%s (%s)' % (unicode(self.page), self.timestamp)
+
+def iter_current_revisions(urns=None):
+    """Yields (page name, urn) for each wiki page, giving the urn (with its
+    'urn:' prefix) of the page's latest revision
+
+    Pages that have been unlinked are left out.  If `urns` is given, only
+    pages whose latest revision is one of `urns` are included.  This is a
+    single query, whatever the number of pages.
+    """
+    revision_table = WikiRevision._meta.db_table
+    query = WikiRevision.objects.extra(where=[
+        '%(table)s.timestamp = (SELECT MAX(latest.timestamp) FROM %(table)s latest '
+        'WHERE latest.page_id = %(table)s.page_id)' % {'table': revision_table},
+    ]).exclude(urn='')
+    if urns is not None:
+        query = query.filter(urn__in=[urn[len('urn:'):] for urn in urns])
+    seen = set()
+    for name, urn in query.values_list('page__name', 'urn').iterator():
+        # two revisions of a page may have the same timestamp
+        if name not in seen:
+            seen.add(name)
+            yield name, 'urn:' + urn
+
+def get_current_wikipages_map(urns=None):
+    """Returns a dict mapping the urn of the latest revision of each wiki page
+    to the set of names of the pages that have it (see
+    iter_current_revisions)"""
+    rv = {}
+    for name, urn in iter_current_revisions(urns):
+        rv.setdefault(urn, set()).add(name)
+    return rv
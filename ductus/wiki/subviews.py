@@ -24,6 +24,7 @@ subviews.py.
 
 from functools import partial
 
+from ductus.resource import get_resource_database
 from ductus.wiki import registered_subviews
 from ductus.wiki.decorators import register_subview
 
@@ -48,12 +49,24 @@ def contributor_set(resource):
     if not hasattr(resource, "common"):
         return set()
     author = resource.common.author
-    s = set()
-    s.update(*[subview(p.get()).contributor_set()
-             for p in resource.common.parents])
-    s.add((author.text, author.href or None))
+    s = set([(author.text, author.href or None)])
+
+    # we only need the author of each ancestor, so we don't load them
+    resource_database = get_resource_database()
+    urns = [p.href for p in resource.common.parents]
+    seen = set()
+    while urns:
+        urn = urns.pop()
+        if urn in seen:
+            continue
+        seen.add(urn)
+        fields = resource_database.get_resource_fields(urn, _contributor_fields)
+        s.add((fields['common.author'], fields['common.author.href'] or None))
+        urns.extend(fields['common.parents.href'])
     return s
 
+_contributor_fields = ('common.author', 'common.author.href', 'common.parents.href')
+
 @register_subview(None, 'subresources')
 def subresources(resource):
     """Returns the urns of each resource this resource includes
@@ -19,6 +19,8 @@ import json
 from django.utils.safestring import mark_safe
 from django.template import Library
 
+from ductus.resource.jsonize import get_resource_json, iter_json
+
 register = Library()
 
 @register.filter
@@ -29,11 +31,12 @@ def jsonize(value):
 @register.filter
 def resource_json(resource):
     """Returns the json representation of a resource"""
-    if resource:
-        resource_json = {
-            'href': resource.urn,
-            'resource': resource.output_json_dict(),
-        }
-    else:
-        resource_json = None
-    return mark_safe(json.dumps(resource_json))
+    if not resource:
+        return mark_safe(json.dumps(None))
+    if resource.urn:
+        # a saved resource is immutable, so its json is memoised
+        return mark_safe(u'{"href": %s, "resource": %s}' % (json.dumps(resource.urn), get_resource_json(resource.urn)))
+    return mark_safe(u''.join(iter_json({
+        'href': resource.urn,
+        'resource': resource.output_json_dict(),
+    })))
@@ -17,6 +17,8 @@
 import json
 import re
 import logging
+from difflib import SequenceMatcher
+from itertools import chain
 from urllib2 import urlopen, HTTPError as urllib2_HTTPError
 
 from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotModified, Http404
@@ -29,10 +31,12 @@ from django.utils.encoding import iri_to_uri
 from django.utils.http import urlquote
 from django.utils.translation import ugettext_lazy, ugettext as _
 from django.conf import settings
+from django.utils.six.moves import xrange
 
-from ductus.index import update_index_on_save
+from ductus.index import queue_index_update
 from ductus.resource import get_resource_database, UnexpectedHeader
-from ductus.resource.ductmodels import DuctModel
+from ductus.resource.ductmodels import DuctModel, ArrayElement
+from ductus.resource.jsonize import iter_json, get_array_page
 from ductus.wiki import registered_views, registered_creation_views, SuccessfulEditRedirect, resolve_urn, is_legal_wiki_pagename, user_has_edit_permission, user_has_unlink_permission
 from ductus.wiki.namespaces import BaseWikiNamespace, registered_namespaces, split_pagename, join_pagename, WikiPrefixNotProvided
 from ductus.wiki.models import WikiPage, WikiRevision
@@ -214,7 +218,7 @@ def handle_blueprint_post(request, expected_model=DuctModel):
         parent_urn = None
     url = request.path
     url = ':'.join(url[1:].split('/', 1))
-    update_index_on_save(urn, [url], parent_urn)
+    queue_index_update(url, urn, [parent_urn] if parent_urn else [])
 
     return SuccessfulEditRedirect(urn)
 
@@ -488,20 +492,59 @@ def view_copy_resource(request):
         'writable_directories': get_writable_directories_for_user(request.user),
     }, RequestContext(request))
 
+def _iter_resource_json(request):
+    """Returns the resource's json, a piece at a time
+
+    The query string may give:
+
+    * depth: how many links away linked resources are included (by default
+      all of them are); beyond that only their href is given
+
+    * array (with optional cursor and limit): return only a page of the
+      items of an ArrayElement, such as 'cards' or 'common.parents', along
+      with the cursor of the next page and the total number of items
+    """
+    resource = get_resource_database().get_resource_object(request.ductus.resource.urn)
+    try:
+        depth = request.GET.get('depth')
+        depth = int(depth) if depth else None
+        if depth is not None and depth < 0:
+            raise ValueError
+        if not request.GET.get('array'):
+            # the resource itself is written out a piece at a time, while each
+            # resource it links to comes from the cache in one go (unless
+            # depth is given, as the cache has whole resources)
+            return iter_json(resource.output_json_dict(depth=depth))
+
+        array = resource
+        for name in request.GET['array'].split('.'):
+            if name not in array.subelements:
+                raise ValueError
+            array = getattr(array, name)
+        if not isinstance(array, ArrayElement):
+            raise ValueError
+        limit = int(request.GET.get('limit', 50))
+        if not 0 < limit <= 500:
+            raise ValueError
+        items, next_cursor = get_array_page(array, request.GET.get('cursor'), limit, depth)
+    except ValueError:
+        raise ImmediateResponse(HttpTextResponseBadRequest('invalid query string'))
+    return iter_json({
+        'href': resource.urn,
+        'array': items,
+        'next_cursor': next_cursor,
+        'total': len(array),
+    })
+
 @register_view(None, 'resource_json')
 def view_json(request):
-    urn = request.ductus.resource.urn
-    resource = get_resource_database().get_resource_object(urn)
-    json_text = json.dumps(resource.output_json_dict())
-    return HttpResponse(json_text, content_type='application/json; charset=utf-8')
+    return StreamingHttpResponse(_iter_resource_json(request),
+                                 content_type='application/json; charset=utf-8')
 
 @register_view(None, 'resource_jsonp')
 def view_jsonp(request):
-    urn = request.ductus.resource.urn
-    resource = get_resource_database().get_resource_object(urn)
-    json_text = json.dumps(resource.output_json_dict())
-    jsonp_text = "callback({});".format(json_text)
-    return HttpResponse(jsonp_text, content_type='application/javascript; charset=utf-8')
+    jsonp_text = chain(("callback(",), _iter_resource_json(request), (");",))
+    return StreamingHttpResponse(jsonp_text, content_type='application/javascript; charset=utf-8')
 
 if settings.DEBUG:
     @register_view(None, 'DEBUG_json')
@@ -628,7 +671,8 @@ def view_unlink_wikipage(request):
     if request.method == 'POST':
         revision = construct_wiki_revision(request.ductus.wiki_page, "", request)
         revision.save()
-        update_index_on_save('urn:%s' % request.ductus.wiki_revision.urn, [])
+        queue_index_update(request.ductus.wiki_page.name, None,
+                           ['urn:%s' % request.ductus.wiki_revision.urn])
 
         return render_to_response('wiki/unlink_deleted.html', {
         }, RequestContext(request))
@@ -672,6 +716,8 @@ class Diff(list):
                                  "Type <%s>" % type(that)))
             return
 
+        # for saved resources, this compares digests, which are then kept by
+        # every subelement so each level below is just as quick
         elements_are_equal = (this == that)
         if hierarchy:
             label = "[%s]" % hierarchy[-1]
@@ -687,14 +733,77 @@ class Diff(list):
                                  (this_attribute != that_attribute),
                                  this_attribute, that_attribute))
         for subelement in this.subelements:
-            self.__do_diff(getattr(this, subelement), getattr(that, subelement),
+            # (_peek, since a private copy would not have the digest)
+            self.__do_diff(this._peek(subelement), that._peek(subelement),
                            hierarchy + (subelement,))
         if isinstance(this, TextElement):
             self.append(DiffItem(hierarchy + ("text",),
                                  (this.text != that.text),
                                  this.text, that.text))
         if isinstance(this, ArrayElement):
-            pass # fixme
+            self.__diff_arrays(this, that, hierarchy)
+
+    def __diff_arrays(self, this, that, hierarchy):
+        """Lists the items inserted, deleted, moved and modified
+
+        Items are matched by digest, so for a ResourceElement by href, and a
+        linked resource is only loaded if its item was modified.
+        """
+        from ductus.resource.ductmodels import ResourceElement
+
+        new_items, old_items = this._peek('array'), that._peek('array')
+        new_keys = [item.get_digest() for item in new_items]
+        old_keys = [item.get_digest() for item in old_items]
+        opcodes = SequenceMatcher(None, old_keys, new_keys, autojunk=False).get_opcodes()
+
+        # an item deleted in one place and inserted in another has moved
+        deleted = {}
+        for tag, i1, i2, j1, j2 in opcodes:
+            for i in xrange(i1, i2 if tag != 'equal' else i1):
+                deleted.setdefault(old_keys[i], []).append(i)
+        moved_from = {}
+        for tag, i1, i2, j1, j2 in opcodes:
+            for j in xrange(j1, j2 if tag != 'equal' else j1):
+                if deleted.get(new_keys[j]):
+                    moved_from[j] = deleted[new_keys[j]].pop(0)
+        moved_to = dict((i, j) for j, i in moved_from.items())
+
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                label = "[%d unchanged]" % (i2 - i1)
+                self.append(DiffItem(hierarchy + ("%d-%d" % (j1, j2 - 1),),
+                                     False, label, label))
+                continue
+            old_indices = [i for i in xrange(i1, i2) if i not in moved_to]
+            new_indices = [j for j in xrange(j1, j2) if j not in moved_from]
+            # what is left of a replaced block is modified pairwise; the rest
+            # is inserted or deleted
+            modified = min(len(old_indices), len(new_indices)) if tag == 'replace' else 0
+            for i, j in zip(old_indices[:modified], new_indices[:modified]):
+                new_item, old_item = new_items[j], old_items[i]
+                self.__do_diff(new_item, old_item, hierarchy + (j,))
+                if isinstance(new_item, ResourceElement) and new_item.href and old_item.href:
+                    self.__do_diff(new_item.get(), old_item.get(),
+                                   hierarchy + (j, "resource"))
+            for i in old_indices[modified:]:
+                self.append(DiffItem(hierarchy + (i,), True,
+                                     "", "[deleted] %s" % _describe_item(old_items[i])))
+            for j in xrange(j1, j2):
+                if j in moved_from:
+                    self.append(DiffItem(hierarchy + (j,), True,
+                                         "[moved from %d] %s" % (moved_from[j], _describe_item(new_items[j])),
+                                         "[moved to %d]" % j))
+            for j in new_indices[modified:]:
+                self.append(DiffItem(hierarchy + (j,), True,
+                                     "[inserted] %s" % _describe_item(new_items[j]), ""))
+
+def _describe_item(item):
+    from ductus.resource.ductmodels import TextElement, LinkElement
+    if isinstance(item, TextElement):
+        return item.text
+    if isinstance(item, LinkElement):
+        return item.href
+    return "<%s>" % type(item).__name__
 
 @register_view(None, 'diff')
 def view_diff(request):
@@ -0,0 +1,237 @@
+import pytest
+
+from ductus.index import verify
+from ductus.index.backends import SqliteIndexBackend
+
+def _save_deck(tags, texts):
+    from ductus.modules.flashcards.ductmodels import Phrase, Flashcard, FlashcardDeck
+    deck = FlashcardDeck()
+    deck.common.author.text = u'tester'
+    heading = deck.headings.new_item()
+    heading.text = u'Phrase'
+    deck.headings.array.append(heading)
+    for text in texts:
+        phrase = Phrase()
+        phrase.phrase.text = text
+        card = Flashcard()
+        card.common.author.text = u'tester'
+        side = card.sides.new_item()
+        side.href = phrase.save()
+        card.sides.array.append(side)
+        item = deck.cards.new_item()
+        item.href = card.save()
+        deck.cards.array.append(item)
+    for tag in tags:
+        item = deck.tags.new_item()
+        item.value = tag
+        deck.tags.array.append(item)
+    return deck.save()
+
+def test_sqlite_index_backend(tmpdir):
+    index = SqliteIndexBackend(str(tmpdir.join('index.sqlite')))
+    index.prepare()
+
+    english = _save_deck(['target-language:en', 'colors'], [u'red', u'green'])
+    french = _save_deck(['target-language:fr'], [u'rouge'])
+    untagged = _save_deck([], [u'blue'])
+    old = _save_deck(['target-language:de'], [u'rot'])
+
+    recursive_links = verify(index, english, ['en:colors'])
+    assert len(recursive_links) == 4  # two flashcards and two phrases
+    assert index.get_recursive_links([english]) == {english: recursive_links}
+    verify(index, french, ['fr:couleurs'])
+    verify(index, untagged, ['en:blue'])
+    verify(index, old, [])
+
+    assert index.search(tags=['target-language:en']) == [('en:colors', ['colors', 'target-language:en'])]
+    assert index.search(tags=['target-language:en', 'target-language:fr']) == []
+    assert index.search(notags=True) == [('en:blue', [])]
+    assert [name for name, tags in index.search(pagename_prefix='en:')] == ['en:blue', 'en:colors']
+    assert index.get_tags('target-language:') == set(['target-language:en', 'target-language:fr', 'target-language:de'])
+    assert index.count_current_tags('target-language:') == {'target-language:en': 1, 'target-language:fr': 1}
+
+    # moving en:colors to another urn
+    index.set_current_wikipages({old: set(['en:colors']), french: set(['fr:couleurs'])})
+    assert index.count_current_tags('target-language:') == {'target-language:de': 1, 'target-language:fr': 1}
+    assert index.search(notags=True) == []
+
+    assert index.get_state('maintenance') is None
+    index.set_state('maintenance', {'done': 3})
+    assert index.get_state('maintenance') == {'done': 3}
+
+def test_sqlite_pagename_search(tmpdir):
+    index = SqliteIndexBackend(str(tmpdir.join('index.sqlite')))
+    lesson = _save_deck(['target-language:en'], [u'one'])
+    other = _save_deck([], [u'two'])
+    verify(index, lesson, ['en:Colors_and_shapes', 'en:Numbers', 'fr:Les_couleurs'])
+    verify(index, other, ['en:Shapes'])
+
+    def names(**kwargs):
+        return [name for name, tags in index.search(**kwargs)]
+
+    assert names(pagename='shape') == ['en:Colors_and_shapes', 'en:Shapes']
+    assert names(pagename='COLORS AND') == ['en:Colors_and_shapes']
+    assert names(pagename='ouleur') == ['fr:Les_couleurs']
+    assert names(pagename='sh') == ['en:Colors_and_shapes', 'en:Shapes']
+    assert names(pagename='ap') == []
+    assert names(pagename_prefix='en:s') == ['en:Shapes']
+    assert names(pagename='shape', tags=['target-language:en']) == ['en:Colors_and_shapes']
+    assert names(pagename='.*') == []
+
+    # paging through the results
+    assert names(pagename_prefix='en:', limit=2) == ['en:Colors_and_shapes', 'en:Numbers']
+    assert names(pagename_prefix='en:', limit=2, after='en:Numbers') == ['en:Shapes']
+
+    # en:Numbers is no longer current
+    verify(index, lesson, ['en:Colors_and_shapes', 'fr:Les_couleurs'], force_update=True)
+    assert names(pagename='numb') == []
+    index.set_current_wikipages({other: set(['en:Numbers'])})
+    assert names(pagename='numb') == ['en:Numbers']
+    assert names(pagename='shape') == []
+
+def test_sqlite_tag_counts(tmpdir):
+    index = SqliteIndexBackend(str(tmpdir.join('index.sqlite')))
+    first = _save_deck(['target-language:en'], [u'one'])
+    second = _save_deck(['target-language:en', 'target-language:es'], [u'dos'])
+    verify(index, first, ['en:numbers'])
+    verify(index, second, ['en:spanish_numbers'])
+    assert index.count_current_tags('target-language:') == {'target-language:en': 2, 'target-language:es': 1}
+
+    # editing en:numbers, as update_index does
+    edited = _save_deck(['target-language:fr'], [u'un'])
+    verify(index, edited, ['en:numbers'])
+    verify(index, first, [], force_update=True)
+    assert index.count_current_tags('target-language:') == {'target-language:en': 1, 'target-language:es': 1, 'target-language:fr': 1}
+
+    # unlinking en:spanish_numbers
+    verify(index, second, [], force_update=True)
+    assert index.count_current_tags('target-language:') == {'target-language:fr': 1}
+
+    index.set_current_wikipages({first: set(['en:numbers']), second: set(['en:spanish_numbers'])})
+    assert index.count_current_tags('target-language:') == {'target-language:en': 2, 'target-language:es': 1}
+
+def _mongo_index_backend(request):
+    pymongo = pytest.importorskip('pymongo')
+    from ductus.index.backends import MongoIndexBackend
+    client = pymongo.MongoClient(serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command('ping')
+    except pymongo.errors.PyMongoError:
+        pytest.skip("no MongoDB server")
+    request.addfinalizer(lambda: client.drop_database('ductus_test_index'))
+    client.drop_database('ductus_test_index')
+    return MongoIndexBackend(client.ductus_test_index)
+
+@pytest.fixture(params=['sqlite', 'mongodb', 'mongomock'])
+def index_backend(request, tmpdir):
+    if request.param == 'mongodb':
+        index = _mongo_index_backend(request)
+    elif request.param == 'mongomock':
+        # an in-memory imitation of MongoDB, for when there is no server
+        mongomock = pytest.importorskip('mongomock')
+        from ductus.index.backends import MongoIndexBackend
+        index = MongoIndexBackend(mongomock.MongoClient().ductus_test_index)
+    else:
+        index = SqliteIndexBackend(str(tmpdir.join('index.sqlite')))
+    index.prepare()
+    return index
+
+def test_page_takeover(index_backend):
+    index = index_backend
+    first = _save_deck(['target-language:en'], [u'one'])
+    second = _save_deck(['target-language:es'], [u'uno'])
+    verify(index, first, ['en:numbers', 'en:one'])
+    # second takes over a page without first being updated as well
+    verify(index, second, ['en:numbers'])
+    assert index.count_current_tags('target-language:') == {'target-language:en': 1, 'target-language:es': 1}
+    assert index.search(pagename_prefix='en:') == [('en:numbers', ['target-language:es']),
+                                                   ('en:one', ['target-language:en'])]
+    verify(index, second, ['en:numbers', 'en:one'], force_update=True)
+    assert index.count_current_tags('target-language:') == {'target-language:es': 1}
+    assert index.search(pagename_prefix='en:o') == [('en:one', ['target-language:es'])]
+
+def test_search_gives_each_page_name(index_backend):
+    index = index_backend
+    first = _save_deck(['target-language:en'], [u'one'])
+    second = _save_deck(['target-language:en'], [u'two'])
+    verify(index, first, ['en:a_one', 'en:c_one', 'en:d_One'])
+    verify(index, second, ['en:b_two', 'fr:b_one'])
+    en = [('en:a_one', ['target-language:en']), ('en:b_two', ['target-language:en']),
+          ('en:c_one', ['target-language:en']), ('en:d_One', ['target-language:en'])]
+    assert index.search(pagename_prefix='en:') == en
+    assert index.search(pagename_prefix='en:', limit=3) == en[:3]
+    assert index.search(pagename_prefix='en:', after='en:b_two', limit=1) == en[2:3]
+    assert [name for name, tags in index.search(pagename='one', limit=3)] == ['en:a_one', 'en:c_one', 'en:d_One']
+    assert [name for name, tags in index.search(pagename='b one')] == ['fr:b_one']
+
+def _save_wikitext(text, markup_language, natural_language=None):
+    from ductus.modules.textwiki.ductmodels import Wikitext
+    wikitext = Wikitext()
+    wikitext.common.author.text = u'tester'
+    wikitext.blob.markup_language = markup_language
+    wikitext.blob.natural_language = natural_language or ''
+    wikitext.text = text
+    return wikitext.save()
+
+def test_sqlite_text_search(tmpdir):
+    from ductus.index.fulltext import search_text
+    index = SqliteIndexBackend(str(tmpdir.join('index.sqlite')))
+    colors = _save_deck(['target-language:es'], [u'el perro rojo', u'el gato rojo', u'perro rojo'])
+    animals = _save_deck(['target-language:es'], [u'el perro', u'el gato'])
+    html = _save_wikitext(u'<p>Das <b>rote</b> Haus an der Stra\xdfe</p>', 'ductus-html5', 'de')
+    creole = _save_wikitext(u'== Colors ==\n**Red** things, see [[en:colors]] <<PageList tags=a>>', 'creole-1.0')
+    old = _save_deck(['target-language:es'], [u'el perro viejo'])
+    verify(index, colors, ['es:colors'])
+    verify(index, animals, ['es:animals'])
+    verify(index, html, ['de:haus'])
+    verify(index, creole, ['en:colors_page'])
+    verify(index, old, [])
+
+    def names(text, **kwargs):
+        return [name for name, tags in search_text(index, text, **kwargs)]
+
+    # found through the phrases of the cards, and ranked by how often the
+    # words occur
+    assert names(u'Perro') == ['es:colors', 'es:animals']
+    assert names(u'rojo') == ['es:colors']
+    assert names(u'gato rojo') == ['es:colors']
+    assert names(u'gato azul') == []
+    assert names(u'perro', limit=1) == ['es:colors']
+    assert names(u'perro', pagename_prefix=u'es:an') == ['es:animals']
+    assert names(u'perro', tags=['target-language:fr']) == []
+    assert names(u'viejo') == []
+
+    # german text is indexed with the german tokenizer
+    assert names(u'rote Stra\xdfe', language='de') == ['de:haus']
+    assert names(u'rote strasse') == ['de:haus']
+    assert names(u'rote Stra\xdfe') == []
+    assert names(u'red things') == ['en:colors_page']
+    assert names(u'pagelist') == []
+
+def test_link_queries(tmpdir, monkeypatch):
+    import ductus.index
+    from django.core.cache import get_cache
+    # the settings use a dummy cache
+    monkeypatch.setattr('django.core.cache.cache', get_cache('django.core.cache.backends.locmem.LocMemCache'))
+    index = SqliteIndexBackend(str(tmpdir.join('index.sqlite')))
+    monkeypatch.setattr(ductus.index, '_index_backend', index)
+    deck = _save_deck([], [u'one', u'two'])
+    other = _save_deck([], [u'three'])
+    verify(index, deck, ['en:numbers'])
+    verify(index, other, [])
+
+    cards = index.get_links([deck])[deck]
+    card = sorted(cards)[0]
+    phrase, = index.get_links([card])[card]
+    assert ductus.index.get_links(deck) == cards
+    assert ductus.index.get_recursive_links(deck) == index.get_recursive_links([deck])[deck]
+    assert ductus.index.get_links_to(phrase) == set([card])
+    assert ductus.index.get_links_to_many([phrase, deck], recursive=True) == {phrase: set([card, deck]), deck: set()}
+    assert ductus.index.get_pages_including_many([phrase, other]) == {phrase: set(['en:numbers']), other: set()}
+
+    # the other deck takes over the page, which clears what is cached.  (no
+    # other pages are current, so the wiki database is not needed.)
+    monkeypatch.setattr('ductus.wiki.models.get_current_wikipages_map', lambda urns: {})
+    ductus.index.update_index('en:numbers', other, [deck])
+    assert ductus.index.get_pages_including(phrase) == set()
+    assert ductus.index.get_pages_including(other) == set(['en:numbers'])
@@ -0,0 +1,57 @@
+import threading
+
+from ductus.index.queue import IndexQueue
+
+def test_index_queue(tmpdir):
+    queue = IndexQueue(str(tmpdir.join('queue.sqlite')))
+    queue.put('en:a', 'urn:1', [])
+    queue.put('en:b', 'urn:5', [])
+    # a second update for a page is merged with the first
+    queue.put('en:a', 'urn:2', ['urn:1'])
+    assert queue.get_stats()['pending'] == 2
+
+    job = queue.claim()
+    assert (job.pagename, job.urn, job.urns) == ('en:a', 'urn:2', ['urn:1', 'urn:2'])
+    # the page is unlinked while its job is being done
+    queue.put('en:a', None, ['urn:2'])
+    queue.done(job)
+    # it is done again, still first in line
+    job = queue.claim()
+    assert (job.pagename, job.urn, job.urns) == ('en:a', None, ['urn:1', 'urn:2'])
+    queue.done(job)
+    job = queue.claim()
+    assert job.pagename == 'en:b'
+    queue.failed(job)
+
+    # en:b waits before it is tried again
+    assert queue.claim() is None
+    stats = queue.get_stats()
+    assert (stats['pending'], stats['failing']) == (1, 1)
+    done = []
+    assert queue.flush(lambda job: done.append(job.pagename)) == 1
+    assert done == ['en:b']
+    assert queue.get_stats() == {'pending': 0, 'lag': 0, 'failing': 0}
+
+def test_index_queue_workers(tmpdir):
+    queue = IndexQueue(str(tmpdir.join('queue.sqlite')))
+    done = []
+    all_done = threading.Event()
+
+    def process(job):
+        done.append(job.pagename)
+        if len(done) == 20:
+            all_done.set()
+
+    stop = threading.Event()
+    workers = [threading.Thread(target=queue.work, args=(process,), kwargs={'poll_interval': 0.01, 'stop': stop})
+               for i in range(3)]
+    for worker in workers:
+        worker.start()
+    for i in range(20):
+        queue.put('en:page%d' % i, 'urn:%d' % i, [])
+    all_done.wait(10)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    assert sorted(done) == sorted('en:page%d' % i for i in range(20))
+    assert queue.get_stats()['pending'] == 0
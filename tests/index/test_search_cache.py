@@ -0,0 +1,53 @@
+import time
+
+from ductus.index import verify
+from ductus.index.backends import SqliteIndexBackend
+
+from test_index import _save_deck
+
+def test_search_cache(tmpdir, monkeypatch):
+    import ductus.index
+    from ductus.index.search_cache import cached_search_pages
+    from django.core.cache import get_cache
+    # the settings use a dummy cache
+    cache = get_cache('django.core.cache.backends.locmem.LocMemCache')
+    monkeypatch.setattr('django.core.cache.cache', cache)
+    monkeypatch.setattr('ductus.index.search_cache.cache', cache)
+    index = SqliteIndexBackend(str(tmpdir.join('index.sqlite')))
+    monkeypatch.setattr(ductus.index, '_index_backend', index)
+    monkeypatch.setattr('ductus.wiki.models.get_current_wikipages_map', lambda urns: {})
+    searches = []
+    search = index.search
+    monkeypatch.setattr(index, 'search', lambda **kwargs: searches.append(kwargs) or search(**kwargs))
+
+    colors = _save_deck(['test-cache-colors'], [u'red'])
+    shapes = _save_deck(['test-cache-shapes'], [u'square'])
+    verify(index, colors, ['en:colors'])
+    verify(index, shapes, ['en:shapes'])
+
+    def names(**kwargs):
+        return [page['absolute_pagename'] for page in cached_search_pages(**kwargs)]
+
+    assert names(tags=['test-cache-colors']) == ['en:colors']
+    assert names(tags=['test-cache-shapes']) == ['en:shapes']
+    assert names(tags=['test-cache-colors', 'test-cache-colors']) == ['en:colors']
+    assert len(searches) == 2
+
+    # only the results for the tags of the changed page are searched again
+    more_colors = _save_deck(['test-cache-colors'], [u'red', u'blue'])
+    ductus.index.update_index('en:more_colors', more_colors)
+    assert names(tags=['test-cache-shapes']) == ['en:shapes']
+    assert len(searches) == 2
+    assert names(tags=['test-cache-colors']) == ['en:colors', 'en:more_colors']
+    assert len(searches) == 3
+
+    # the old results are returned while the search is done again
+    ductus.index.update_index('en:more_colors', None, [more_colors])
+    assert names(stale=True, tags=['test-cache-colors']) == ['en:colors', 'en:more_colors']
+    for i in range(100):
+        if len(searches) == 4:
+            break
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assert names(tags=['test-cache-colors']) == ['en:colors']
+    assert len(searches) == 4
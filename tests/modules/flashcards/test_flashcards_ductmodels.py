@@ -1,7 +1,13 @@
+import copy
+import json
+
 import pytest
+from lxml import etree
 
-from ductus.resource import ductmodels
-from ductus.modules.flashcards.ductmodels import _divider_validator
+from ductus.resource import ductmodels, get_resource_database
+from ductus.resource.jsonize import iter_json, get_array_page, get_resource_json_dict
+from ductus.modules.flashcards.ductmodels import _divider_validator, FlashcardDeck, Flashcard, Phrase
+from ductus.modules.flashcards.legacy_ductmodels import _new_flashcard, PhraseChoiceLesson, PhraseChoiceGroup
 
 def test_divider_validator():
     _divider_validator(None)
@@ -18,3 +24,263 @@ def test_divider_validator():
         _divider_validator('4, 5,5')
     with pytest.raises(ductmodels.ValidationError):
         _divider_validator('4,x')
+
+some_urn = 'urn:sha384:35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs'
+
+# any change to this would change the urn of every flashcard deck
+flashcard_deck_xml = '<?xml version=\'1.0\' encoding=\'utf-8\'?>\n<flashcard_deck xmlns:ductus="http://ductus.us/ns/2009/ductus" xmlns:xlink="http://www.w3.org/1999/xlink" xmlns="http://wikiotics.org/ns/2011/flashcards" dividers="1"><ductus:common timestamp="2013-01-01T00:00:00"><ductus:author xlink:href="http://example.com/user/someone" xlink:type="simple">someone</ductus:author><ductus:parents/><ductus:licenses><ductus:item xlink:href="http://creativecommons.org/licenses/by-sa/3.0/" xlink:type="simple"/></ductus:licenses><ductus:log_message>a log message</ductus:log_message></ductus:common><tags><item value="target-language:en"/></tags><cards><item xlink:href="urn:sha384:35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs" xlink:type="simple"/><item xlink:href="urn:sha384:35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs" xlink:type="simple"/></cards><headings><item>phrase</item><item>audio</item></headings></flashcard_deck>'
+
+def _serialize(resource):
+    root = etree.Element(resource.fqn, nsmap=resource.nsmap)
+    resource.populate_xml_element(root, resource.ns)
+    return etree.tostring(root, encoding='utf-8', xml_declaration=True)
+
+def test_flashcard_deck_xml_output():
+    deck = FlashcardDeck()
+    for text in (u'phrase', u'audio'):
+        heading = deck.headings.new_item()
+        heading.text = text
+        deck.headings.array.append(heading)
+    for i in range(2):
+        card = deck.cards.new_item()
+        card.href = some_urn
+        deck.cards.array.append(card)
+    tag = deck.tags.new_item()
+    tag.value = u'target-language:en'
+    deck.tags.array.append(tag)
+    deck.dividers = u'1'
+    deck.common.author.text = u'someone'
+    deck.common.author.href = u'http://example.com/user/someone'
+    deck.common.timestamp = u'2013-01-01T00:00:00'
+    deck.common.log_message.text = u'a log message'
+    license = deck.common.licenses.new_item()
+    license.href = u'http://creativecommons.org/licenses/by-sa/3.0/'
+    deck.common.licenses.array.append(license)
+    assert _serialize(deck) == flashcard_deck_xml
+
+def test_flashcard_deck_xml_round_trip():
+    deck = FlashcardDeck()
+    deck.populate_from_xml(etree.fromstring(flashcard_deck_xml))
+    deck.validate(strict=False)
+    assert [h.text for h in deck.headings] == [u'phrase', u'audio']
+    assert _serialize(deck) == flashcard_deck_xml
+    assert _serialize(deck.clone()) != flashcard_deck_xml
+
+def _saved_flashcard(*texts):
+    flashcard = Flashcard()
+    for text in texts:
+        phrase = Phrase()
+        phrase.phrase.text = text
+        side = flashcard.sides.new_item()
+        side.store(phrase)
+        flashcard.sides.array.append(side)
+    flashcard.common.author.text = u'someone'
+    return flashcard.save()
+
+def test_strict_validation_uses_resource_metadata():
+    card_urn = _saved_flashcard(u'hello', u'hola')
+    metadata = get_resource_database().get_resource_metadata(card_urn)
+    assert metadata['fqn'] == Flashcard.fqn
+    assert metadata['array_sizes'] == {'sides': 2, 'tags': 0}
+    assert metadata['licenses']
+
+    deck = FlashcardDeck()
+    deck.common.author.text = u'someone'
+    license = deck.common.licenses.new_item()
+    license.href = metadata['licenses'][0]
+    deck.common.licenses.array.append(license)
+    card = deck.cards.new_item()
+    card.href = card_urn
+    deck.cards.array.append(card)
+    for text in (u'english', u'spanish'):
+        heading = deck.headings.new_item()
+        heading.text = text
+        deck.headings.array.append(heading)
+    deck.validate(strict=True)
+
+    deck.headings.array.pop()
+    with pytest.raises(ductmodels.ValidationError):
+        deck.validate(strict=True)
+
+def test_resource_fields():
+    root = etree.fromstring(flashcard_deck_xml)
+    deck = FlashcardDeck()
+    deck.populate_from_xml(root)
+    for path in ('cards.href', 'headings', 'dividers', 'column_order',
+                 'common.author', 'common.author.href', 'common.parents.href',
+                 'tags.value', 'interactions.href'):
+        field_path = ductmodels.FieldPath.get(FlashcardDeck, path)
+        assert field_path.read(root) == field_path.get_from_object(deck)
+    with pytest.raises(AttributeError):
+        ductmodels.FieldPath.get(FlashcardDeck, 'common.nonexistent')
+
+    card_urn = _saved_flashcard(u'hello', u'hola')
+    fields = get_resource_database().get_resource_fields(card_urn, ('sides.href', 'common.author'))
+    card = get_resource_database().get_resource_object(card_urn)
+    assert fields == {
+        'sides.href': [side.href for side in card.sides],
+        'common.author': u'someone',
+    }
+
+def test_resource_json():
+    deck = FlashcardDeck()
+    deck.populate_from_xml(etree.fromstring(flashcard_deck_xml))
+    card_urn = _saved_flashcard(u'hello', u'hola')
+    for card in deck.cards.array:
+        card.href = card_urn
+    json_dict = deck.output_json_dict()
+    assert u''.join(iter_json(json_dict)) == json.dumps(json_dict)
+
+    # linked resources are memoised, so they are the same object
+    first, second = [card['resource'] for card in json_dict['cards']['array']]
+    assert first is second
+    card = get_resource_database().get_resource_object(card_urn)
+    assert first == card.output_json_dict()
+    assert u''.join(iter_json(json_dict, chunk_size=10)) == json.dumps(json_dict)
+
+def test_cached_resource_json_is_read_only():
+    json_dict = get_resource_json_dict(_saved_flashcard(u'hello', u'hola'))
+    sides = json_dict['sides']['array']
+    for modify in (lambda: json_dict.update(fqn=u'x'), lambda: json_dict.pop('sides'),
+                   lambda: sides.append({}), lambda: sides[0].__setitem__('href', u'')):
+        with pytest.raises(TypeError):
+            modify()
+    json_copy = copy.deepcopy(json_dict)
+    json_copy['sides']['array'].append({})
+    assert json_copy == json.loads(json.dumps(json_copy)) != json_dict
+
+def test_iter_json_is_json_dumps():
+    deck = FlashcardDeck()
+    deck.populate_from_xml(etree.fromstring(flashcard_deck_xml))
+    card_urn = _saved_flashcard(u'hello', u'hola')
+    for card in deck.cards.array:
+        card.href = card_urn
+    json_dict = deck.output_json_dict(depth=1)
+    assert json.loads(u''.join(iter_json(json_dict))) == json_dict
+
+    # a linked resource that has been changed is written as it is
+    json_dict = deck.output_json_dict()
+    json_dict['cards']['array'][0] = {'href': card_urn, 'resource': {'trimmed': True}}
+    assert json.loads(u''.join(iter_json(json_dict))) == json_dict
+
+def test_resource_json_depth_and_pages():
+    deck = FlashcardDeck()
+    deck.populate_from_xml(etree.fromstring(flashcard_deck_xml))
+    card_urn = _saved_flashcard(u'hello', u'hola')
+    for card in deck.cards.array:
+        card.href = card_urn
+    json_dict = deck.output_json_dict(depth=0)
+    assert json_dict['cards']['array'] == [{'href': card_urn}] * 2
+
+    # the linked cards are included, but not their sides
+    json_dict = json.loads(u''.join(iter_json(deck.output_json_dict(depth=1))))
+    for card in json_dict['cards']['array']:
+        assert [side.keys() for side in card['resource']['sides']['array']] == [['href'], ['href']]
+    items, next_cursor = get_array_page(deck.cards, limit=1, depth=1)
+    json_dict = json.loads(u''.join(iter_json({'array': items})))
+    assert json_dict['array'][0]['resource']['sides']['array'][0] == {'href': items[0]['resource']['sides']['array'][0]['href']}
+
+    items, next_cursor = get_array_page(deck.cards, limit=1)
+    assert items[0]['resource'] == get_resource_database().get_resource_object(card_urn).output_json_dict()
+    assert next_cursor is not None
+    items, next_cursor = get_array_page(deck.cards, next_cursor, limit=1, depth=0)
+    assert items == [{'href': card_urn}]
+    assert next_cursor is None
+    with pytest.raises(ValueError):
+        get_array_page(deck.cards, '2')
+
+def test_array_blueprint_ops():
+    card_urns = [_saved_flashcard(text, text) for text in (u'one', u'two', u'three', u'four')]
+    deck = FlashcardDeck()
+    deck.populate_from_xml(etree.fromstring(flashcard_deck_xml))
+    for card, card_urn in zip(deck.cards.array, card_urns):
+        card.href = card_urn
+    deck.common.author.text = u'someone'
+    deck_urn = deck.save()
+
+    save_context = ductmodels.BlueprintSaveContext()
+    save_context.author_username = u'someone'
+    def apply_ops(ops):
+        urn = FlashcardDeck.save_blueprint({'resource': {
+            '@patch': deck_urn,
+            'cards': {'@ops': ops},
+        }}, save_context)
+        return [card.href for card in get_resource_database().get_resource_object(urn).cards]
+
+    assert apply_ops([
+        {'op': 'insert', 'index': 2, 'item': {'href': card_urns[2]}},
+        {'op': 'replace', 'index': 0, 'item': {'href': card_urns[3]}},
+        {'op': 'move', 'index': 2, 'to': 0},
+        {'op': 'delete', 'index': 2},
+    ]) == [card_urns[2], card_urns[3]]
+    for bad_op in ({'op': 'delete', 'index': 2}, {'op': 'insert', 'index': 0},
+                   {'op': 'move', 'index': '0', 'to': 1}, {'op': 'swap', 'index': 0}):
+        with pytest.raises(ductmodels.BlueprintError):
+            apply_ops([bad_op])
+
+@pytest.mark.parametrize('threads', [1, 4])
+def test_save_blueprint_reuses_unchanged_resources(threads, monkeypatch):
+    monkeypatch.setattr(ductmodels, 'blueprint_save_threads', threads)
+    save_context = ductmodels.BlueprintSaveContext()
+    save_context.author_username = u'someone'
+    phrase_fqn = Phrase.fqn
+    def card_blueprint(text):
+        return {'resource': {
+            '@create': Flashcard.fqn,
+            'sides': {'array': [
+                {'resource': {'@create': phrase_fqn, 'phrase': {'text': text}}},
+                {'resource': {'@create': phrase_fqn, 'phrase': {'text': u'same'}}},
+            ]},
+        }}
+    deck_urn = FlashcardDeck.save_blueprint({'resource': {
+        '@create': FlashcardDeck.fqn,
+        'cards': {'array': [card_blueprint(u'one'), card_blueprint(u'two'), card_blueprint(u'one')]},
+        'headings': {'array': [{'text': u'a'}, {'text': u'b'}]},
+    }}, save_context)
+    cards = [card.get() for card in get_resource_database().get_resource_object(deck_urn).cards]
+    assert cards[0].urn == cards[2].urn != cards[1].urn
+    assert cards[0].sides.array[1].href == cards[1].sides.array[1].href
+
+    phrase_urn = cards[0].sides.array[0].href
+    assert Phrase.save_blueprint({'resource': {'@patch': phrase_urn}}, save_context) == phrase_urn
+
+    # a DuctModel patched without changes is not saved again, even though
+    # its clone has a new parent
+    save_context = ductmodels.BlueprintSaveContext()
+    save_context.author_username = u'someone else'
+    assert FlashcardDeck.save_blueprint({'resource': {'@patch': deck_urn}}, save_context) == deck_urn
+    assert FlashcardDeck.save_blueprint({'resource': {
+        '@patch': deck_urn, 'headings': {'array': [{'text': u'a'}, {'text': u'c'}]},
+    }}, save_context) != deck_urn
+
+def test_legacy_conversion_can_be_saved():
+    group = PhraseChoiceGroup()
+    group.common.author.text = u'someone'
+    for i in range(4):
+        element = group.group.new_item()
+        element.prompt.text = u'prompt %d' % i
+        element.answer.text = u'answer %d' % i
+        group.group.array.append(element)
+    lesson = PhraseChoiceLesson()
+    lesson.common.author.text = u'someone'
+    lesson.groups.array.append(lesson.groups.new_item())
+    lesson.groups.array[0].store(group)
+    lesson.save()
+
+    # converting twice gives the same resources
+    urns = []
+    for i in range(2):
+        deck = lesson.legacy_ductmodel_conversion()
+        ductmodels.save_unsaved_resources(deck)
+        urns.append(deck.save())
+    assert urns[0] == urns[1]
+    card = deck.cards.array[3].get()
+    assert card.urn and card.common.author.text == u'someone'
+    assert card.sides.array[1].get().phrase.text == u'answer 3'
+
+def test_legacy_flashcards_do_not_share_the_author():
+    lesson = PhraseChoiceLesson()
+    lesson.common.author.text = u'someone'
+    first, second = _new_flashcard(lesson), _new_flashcard(lesson)
+    first.common.author.text = u'someone else'
+    assert second.common.author.text == lesson.common.author.text == u'someone'
@@ -0,0 +1,114 @@
+import pytest
+
+from ductus.resource import ductmodels
+
+class ExampleElement(ductmodels.Element):
+    name = ductmodels.Attribute()
+    note = ductmodels.Attribute(optional=True)
+    text = ductmodels.TextElement()
+    items = ductmodels.ArrayElement(ductmodels.TextElement())
+
+def test_element_has_no_dict():
+    with pytest.raises(AttributeError):
+        ExampleElement().unknown = 1
+
+def test_subelements_are_created_lazily():
+    e = ExampleElement()
+    assert e.name == '' and e.note is None
+    assert e._peek('text') is ExampleElement.subelements['text']
+    e.validate()
+    assert e == ExampleElement()
+    e.text.text = u'hello'
+    assert e._peek('text') is e.text
+    assert e != ExampleElement()
+
+def test_clone_is_independent():
+    e = ExampleElement()
+    e.name = u'x'
+    e.text.text = u'hello'
+    c = e.clone()
+    assert c == e
+    c.text.text = u'bye'
+    c.name = u'y'
+    assert e.text.text == u'hello' and e.name == u'x'
+    c.validate()
+    c.text = ExampleElement()
+    with pytest.raises(ductmodels.ValidationError):
+        c.validate()
+
+def test_clone_copies_array_items():
+    e = ExampleElement()
+    item = e.items.new_item()
+    item.text = u'one'
+    e.items.array.append(item)
+    c = e.clone()
+    assert c == e
+    c.items.array[0].text = u'two'
+    assert [i.text for i in e.items] == [u'one']
+    assert [i.text for i in c.items] == [u'two']
+    e.items.array.append(e.items.new_item())
+    assert len(c.items) == 1 and len(e.items) == 2
+    c.validate()
+    e.validate()
+    c.items.array.append(ExampleElement.subelements['text'].clone())
+    with pytest.raises(ductmodels.ValidationError):
+        c.validate()
+
+def test_digest_matches_equality():
+    e = ExampleElement()
+    e.name = u'x'
+    e.text.text = u'hello'
+    item = e.items.new_item()
+    item.text = u'one'
+    e.items.array.append(item)
+    c = e.clone()
+    assert c.get_digest() == e.get_digest(keep=True)
+    c.items.array[0].text = u'two'
+    assert c.get_digest() != e.get_digest()
+    assert c != e
+    # digests are kept by e, but not by its clones, which may be modified
+    assert e._peek('items')._digest is not None
+    c = e.clone()
+    assert c == e
+    c.note = u'a note'
+    assert c != e
+    assert ExampleElement().get_digest() != e.get_digest()
+
+def test_clone_leaves_original_references_alone():
+    e = ExampleElement()
+    e.text.text = u'a'
+    t = e.text
+    arr = e.items.array
+    c = e.clone()
+    assert c._peek('items') is not e._peek('items')
+    t.text = u'b'
+    arr.append(e.items.new_item())
+    assert c.text.text == u'a' and len(c.items) == 0
+    assert e.text.text == u'b' and len(e.items) == 1
+    assert e.text is t and e.items.array is arr
+
+def test_clone_leaves_unused_subelements_alone():
+    e = ExampleElement()
+    c = e.clone()
+    assert c._peek('text') is ExampleElement.subelements['text']
+
+def test_clone_of_frozen_element_shares_until_accessed():
+    e = ExampleElement()
+    e.text.text = u'a'
+    item = e.items.new_item()
+    item.text = u'one'
+    e.items.array.append(item)
+    e.get_digest(keep=True)
+    c = e.clone()
+    assert c._peek('items') is e._peek('items')
+    assert c._peek('text') is e._peek('text')
+    assert c == e
+    # so does a clone of the clone, for what the first clone has not used
+    c2 = c.clone()
+    assert c2._peek('text') is e._peek('text')
+    c.items.array[0].text = u'two'
+    c.text.text = u'b'
+    assert c._peek('items') is not e._peek('items')
+    assert e.text.text == u'a' and [i.text for i in e.items] == [u'one']
+    assert [i.text for i in c.items] == [u'two']
+    assert c2 == e
@@ -1,6 +1,11 @@
+import threading
+import time
+
 import pytest
 
-from ductus.resource import SizeTooLargeError, check_resource_size, calculate_hash, ResourceDatabase
+from ductus.resource import SizeTooLargeError, check_resource_size, calculate_hash, ResourceDatabase, get_resource_database
+from ductus.resource.jsonize import get_resource_json
+from ductus.utils import LRUCache
 
 some_data = 'aerfdnjdfgjkdsgkjdfsgjkdfsgds'
 
@@ -17,3 +22,70 @@ def test_is_valid_urn():
     assert not ResourceDatabase.is_valid_urn('urn:sha384::35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs')
     assert not ResourceDatabase.is_valid_urn('urn::35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs')
     assert not ResourceDatabase.is_valid_urn('urn:35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs')
+
+def test_concurrent_use():
+    from ductus.modules.flashcards.ductmodels import Phrase
+    resource_database = get_resource_database()
+    small_cache = LRUCache(5)
+    errors = []
+
+    def work(thread_number):
+        try:
+            for i in range(40):
+                # every thread saves the same few resources
+                text = u'concurrent phrase %d' % (i % 7)
+                phrase = Phrase()
+                phrase.phrase.text = text
+                urn = phrase.save()
+                assert resource_database.get_resource_object(urn).phrase.text == text
+                assert resource_database.get_resource_metadata(urn)['fqn'] == Phrase.fqn
+                assert text in get_resource_json(urn)
+                small_cache.set((thread_number, i % 7), urn)
+                assert small_cache.get((thread_number, i % 7)) in (urn, None)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(small_cache) == 5
+
+def test_concurrent_loads_are_coalesced():
+    from ductus.modules.flashcards.ductmodels import Phrase
+    from ductus.utils.cache import cache_compressed
+    resource_database = get_resource_database()
+    phrase = Phrase()
+    phrase.phrase.text = u'loaded only once'
+    urn = phrase.save()
+
+    storage_backend = resource_database.storage_backend
+    reads = []
+
+    class SlowStorage(object):
+        def __contains__(self, key):
+            return key in storage_backend
+
+        def __getitem__(self, key):
+            reads.append(key)
+            time.sleep(0.2)
+            return storage_backend[key]
+
+    # make it look as if the cached copy has expired
+    cache_compressed.set("xml-urn:" + urn, None)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resource_database.get_resource_object(urn)))
+               for n in range(6)]
+    resource_database.storage_backend = SlowStorage()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        resource_database.storage_backend = storage_backend
+    assert reads == [urn]
+    assert [r.phrase.text for r in results] == [u'loaded only once'] * 6
+    assert len(set(id(r) for r in results)) == 6
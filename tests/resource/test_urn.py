@@ -0,0 +1,46 @@
+import gc
+import pickle
+
+import pytest
+
+from ductus.resource import URN, UnsupportedURN, split_urn, hash_algorithm
+
+some_urn = 'urn:sha384:35F_NeGhyCPV0sZ-3dS3vCB9ZavpGLOszmTWjMRlso1sVH3MSYy796PqCmjCp9zs'
+
+def test_urn_round_trip():
+    urn = URN.parse(some_urn)
+    assert unicode(urn) == some_urn
+    assert urn.hash_type == 'sha384'
+    assert len(urn.digest) == hash_algorithm().digest_size
+    assert split_urn(urn) == split_urn(some_urn)
+
+def test_urn_interning():
+    assert URN.parse(some_urn) is URN.parse(unicode(some_urn))
+    assert URN.parse(URN.parse(some_urn)) is URN.parse(some_urn)
+    assert URN.from_digest(URN.parse(some_urn).digest) is URN.parse(some_urn)
+
+def test_urn_stays_interned_after_it_is_dropped():
+    text = unicode(URN.from_digest(hash_algorithm(b'dropped').digest()))
+    URN.parse(text)
+    gc.collect()
+    assert URN._interned_text.get(text) is not None
+
+def test_urn_equals_string_form():
+    urn = URN.parse(some_urn)
+    assert urn == some_urn
+    assert not (urn != some_urn)
+    assert hash(urn) == hash(some_urn)
+    assert {some_urn: 1}[urn] == 1
+    assert urn != some_urn[:-1] + 't'
+
+def test_urn_pickle():
+    urn = URN.parse(some_urn)
+    assert pickle.loads(pickle.dumps(urn)) is urn
+
+def test_invalid_urns():
+    for s in (some_urn[:-1], some_urn[:-1] + '!', some_urn[:-1] + '=',
+              some_urn.replace('sha384', 'sha383'), 'urn::' + some_urn[11:],
+              some_urn + ':', None, 42):
+        assert not URN.is_valid(s)
+        with pytest.raises(UnsupportedURN):
+            URN.parse(s)
@@ -1,6 +1,8 @@
 import pytest
 
+from ductus.resource.ductmodels import ArrayElement, TextElement
 from ductus.wiki import is_legal_wiki_pagename
+from ductus.wiki.views import Diff
 
 def test_legal_wiki_pagename():
     assert not is_legal_wiki_pagename('en', None)
@@ -20,3 +22,22 @@ def test_legal_wiki_pagename():
     assert is_legal_wiki_pagename('group', 'somegroup/somepage')
     assert is_legal_wiki_pagename('group', 'somegroup')
     assert not is_legal_wiki_pagename('group', 'somegroup//somepage')
+
+def test_diff_arrays():
+    def text_array(*texts):
+        array = ArrayElement(TextElement())
+        for text in texts:
+            item = array.new_item()
+            item.text = text
+            array.array.append(item)
+        return array
+
+    old = text_array(u'a', u'b', u'c', u'd', u'e')
+    new = text_array(u'a', u'x', u'c', u'e', u'd', u'f')
+    changes = [(item.hierarchy, item.that, item.this) for item in Diff(new, old)
+               if item.different and len(item.hierarchy) == 1]
+    assert sorted(changes) == [
+        ((1,), u'[1]', u'[1]'),
+        ((3,), u'[moved to 3]', u'[moved from 4] e'),
+        ((5,), u'', u'[inserted] f'),
+    ]